@@ -3,23 +3,83 @@
 from flask import Flask
 from flask_restx import Api
 from flask_sqlalchemy import SQLAlchemy
+from app.auth import API_KEY_HEADER, Auth, authenticated
+from app.cache import Cache
+from app.changes import Changes
+from app.compression import Compression
+from app.metrics import Metrics, timed_output_json
+from app.pool import PoolInstrumentation, enforce_foreign_keys
+from app.profiling import Profiler
+from app.replicas import Replicas, RoutingSession
+from app.timelines import Timelines
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+pool = PoolInstrumentation()
+replicas = Replicas()
+metrics = Metrics()
+profiler = Profiler()
+cache = Cache()
+auth = Auth()
+compression = Compression()
+timelines = Timelines()
+changes = Changes()
 
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
 
     from config import Config
 
-    app.config.from_object(Config)
+    app.config.from_object(config or Config)
+    pool.init_app(app)
+    replicas.init_app(app)
     db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            enforce_foreign_keys(engine)
+        pool.listen(db.engine)
+        replica_engines = replicas.listen(app, db.engines)
+        metrics.init_app(app, db.engine, *replica_engines)
+        profiler.init_app(app, db.engine)
+    cache.init_app(app)
+    auth.init_app(app)
+    compression.init_app(app)
+    timelines.init_app(app)
+    changes.init_app(app)
 
     @app.route("/hello")
     def hello():
         return "Goodbye World!"
 
-    api = Api()
+    # Stats are guarded like the API. /metrics is left open to Prometheus, which
+    # is configured without keys: keep it off the public network instead.
+    @app.route("/cache/stats")
+    @authenticated
+    def cache_stats():
+        return cache.stats()
+
+    @app.route("/db/pool")
+    @authenticated
+    def pool_stats():
+        return pool.stats()
+
+    @app.route("/db/replicas")
+    @authenticated
+    def replica_stats():
+        return replicas.stats()
+
+    @app.route("/tweets/stream/stats")
+    @authenticated
+    def stream_stats():
+        return changes.stats()
+
+    api = Api(
+        authorizations={
+            "apikey": {"type": "apiKey", "in": "header", "name": API_KEY_HEADER}
+        },
+        security="apikey",
+    )
+    api.representation("application/json")(timed_output_json)
 
     # /tweets and /users
     from .apis.tweets import api as tweets
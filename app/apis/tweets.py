@@ -1,11 +1,51 @@
 # pylint: disable=missing-docstring
 
-from flask import request
-from flask_restx import Namespace, Resource, fields
-from app.models import Tweet, User
-from app import db
+import uuid
 
-api = Namespace("tweets")
+from flask import Response, current_app, g, request
+from flask_restx import Resource, fields, inputs, reqparse
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from app.auth import require_api_key
+from app.change_log import (
+    StreamGap,
+    as_event,
+    catch_up_query,
+    check_catch_up,
+    latest_query,
+    pruned_query,
+    record,
+    settle_horizon,
+)
+from app.changes import (
+    SSE_HEADERS,
+    SSE_MIMETYPE,
+    cursor_field,
+    format_event,
+    parse_since,
+    retry_field,
+)
+from app.cache import dump_json, json_response, tweet_key, user_tweets_tag
+from app.conditional import (
+    CachedBody,
+    abort_unmatched,
+    conditional_response,
+    if_match_clause,
+    not_modified,
+    validator_headers,
+)
+from app.fieldsets import Fieldset, with_fields
+from app.ingest import QueueFull, ingest_queue
+from app.metrics import InstrumentedNamespace
+from app.models import Follow, Tweet, User
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, page_parser, paginate
+from app.replicas import reading_replica, route_reads
+from app.search import search_tweets
+from app.serializers import serialize, serialized_response
+from app.streaming import NDJSON_MIMETYPE, ndjson_response
+from app import cache, changes, db, timelines
+
+api = InstrumentedNamespace("tweets", decorators=[require_api_key, route_reads])
 
 class JsonUser(fields.Raw):
     def format(self, value):
@@ -33,6 +73,115 @@ create_tweet_fields = api.model(
     },
 )
 
+page_model = api.model(
+    "TweetPage",
+    {
+        "tweets": fields.List(fields.Nested(model)),
+        "next_cursor": fields.String(description="Opaque cursor for the next page"),
+    },
+)
+
+batch_result_fields = api.model(
+    "TweetBatchResult",
+    {
+        "index": fields.Integer(description="Position in the submitted array"),
+        "status": fields.Integer(description="HTTP-like status of this item"),
+        "id": fields.Integer(description="Id of the created tweet"),
+        "error": fields.String,
+    },
+)
+
+batch_model = api.model(
+    "TweetBatch",
+    {
+        "created": fields.Integer,
+        "failed": fields.Integer,
+        "results": fields.List(fields.Nested(batch_result_fields)),
+    },
+)
+
+search_parser = reqparse.RequestParser()
+search_parser.add_argument(
+    "q", required=True, location="args", help="Words the tweets must contain"
+)
+search_parser.add_argument(
+    "limit",
+    type=inputs.int_range(1, MAX_PAGE_SIZE),
+    default=DEFAULT_PAGE_SIZE,
+    location="args",
+    help=f"Page size (1-{MAX_PAGE_SIZE})",
+)
+search_parser.add_argument(
+    "cursor", location="args", help="next_cursor of the previous page"
+)
+
+stream_parser = reqparse.RequestParser()
+stream_parser.add_argument(
+    "since",
+    location="args",
+    help="Id of the last event seen; defaults to the Last-Event-ID header",
+)
+
+queued_model = api.model(
+    "QueuedTweet",
+    {
+        "provisional_id": fields.String(description="Id of the queued write"),
+        "status": fields.String(description="Always 'queued'"),
+    },
+)
+
+fieldset = Fieldset(
+    model,
+    Tweet,
+    {"id": Tweet.id, "text": Tweet.text, "created_at": Tweet.created_at},
+    nested={
+        "user": (
+            {"username": User.username, "email": User.email, "id": User.id},
+            Tweet.user,
+        )
+    },
+)
+list_parser = with_fields(page_parser, fieldset)
+fields_parser = with_fields(None, fieldset)
+# Every field, for rendering rows returned by INSERT and UPDATE
+every_field = fieldset.parse(",".join(fieldset.model))
+
+
+def returned_columns(author_id=Tweet.user_id):
+    """
+    What INSERT and UPDATE return: the tweet's representation and validators.
+
+    SQLite allows no joined tables in RETURNING, so the author is read by
+    subqueries on `author_id`. UPDATE correlates them with the updated row; an
+    INSERT has nothing to correlate with and passes the new author's id.
+    """
+
+    def author_column(column, label):
+        author = select(column).where(User.id == author_id).correlate(Tweet)
+        return author.scalar_subquery().label(label)
+
+    return [
+        Tweet.id.label("id"),
+        Tweet.text.label("text"),
+        Tweet.created_at.label("created_at"),
+        Tweet.version,
+        Tweet.updated_at,
+        *(
+            author_column(column, f"user__{key}")
+            for key, column in fieldset.nested["user"][0].items()
+        ),
+        author_column(User.version, "user__version"),
+        author_column(User.updated_at, "user__updated_at"),
+    ]
+
+
+def returned_validators(row):
+    return validator_headers(
+        Tweet.make_etag(row.id, row.version, row.user__version),
+        Tweet.make_last_modified(row.updated_at, row.user__updated_at),
+    )
+
+
 update_tweet_fields = api.model(
     "UpdateTweetModel",
     {
@@ -42,66 +191,390 @@ update_tweet_fields = api.model(
 )
 
 
+def fan_out(user_id, tweet_ids):
+    """
+    Push new tweets onto the home timelines of their author and followers.
+
+    Authors with more than TIMELINE_FANOUT_LIMIT followers are only flagged;
+    their tweets are merged into follower timelines at read time instead.
+    """
+    limit = current_app.config["TIMELINE_FANOUT_LIMIT"]
+    followers = (
+        db.session.query(Follow.follower_id)
+        .filter(Follow.followee_id == user_id)
+        .limit(limit + 1)
+        .all()
+    )
+    if len(followers) > limit:
+        timelines.mark_celebrity(user_id)
+        followers = []
+
+    recipients = [user_id] + [follower_id for (follower_id,) in followers]
+    for tweet_id in tweet_ids:
+        timelines.push(recipients, tweet_id)
+
+
+def write_tweets(rows):
+    """Insert queued tweets in one statement and transaction"""
+    inserted = db.session.execute(
+        insert(Tweet).values(rows).returning(Tweet.id, Tweet.user_id)
+    ).fetchall()
+    events = record_created([tweet_id for tweet_id, _ in inserted])
+    db.session.commit()
+    return inserted, events
+
+
+def publish_tweets(written):
+    """Publish and fan out the tweets `write_tweets` committed"""
+    inserted, events = written
+    changes.publish(events)
+    by_user = {}
+    for tweet_id, user_id in inserted:
+        by_user.setdefault(user_id, []).append(tweet_id)
+    for user_id, tweet_ids in by_user.items():
+        fan_out(user_id, tweet_ids)
+
+
+def record_created(tweet_ids):
+    """Record the creation of tweets inserted in the current transaction"""
+    created = db.session.execute(
+        select(*returned_columns()).where(Tweet.id.in_(tweet_ids)).order_by(Tweet.id)
+    )
+    rows = [(row.id, every_field.render(row)) for row in created]
+    return record(db.session, "created", *rows) if rows else []
+
+
+def stream_response(since):
+    """
+    The SSE response of GET /tweets/stream: the changes after `since`, then the
+    response ends.
+
+    A stream held open would hold a sync worker, so clients of the Flask app
+    poll instead: EventSource reconnects after TWEET_STREAM_RETRY_MS, sending
+    the Last-Event-ID of the last change it got. Without a cursor the response
+    only sets that id to the latest change. The ASGI app (app.asgi) serves
+    changes live, as they are committed.
+    """
+    config = current_app.config
+    horizon = settle_horizon(config["TWEET_STREAM_SETTLE_SECONDS"])
+    body = [retry_field(config)]
+    if since is None:
+        body.append(cursor_field(db.session.scalar(latest_query(horizon)) or 0))
+    else:
+        limit = config["TWEET_STREAM_CATCHUP_MAX"]
+        rows = db.session.execute(catch_up_query(since, limit, horizon))
+        backlog = [as_event(row) for row in rows]
+        try:
+            check_catch_up(since, db.session.scalar(pruned_query()), backlog, limit)
+        except StreamGap as e:
+            api.abort(410, str(e))
+        body.extend(format_event(event) for event in backlog)
+    return Response("".join(body), mimetype=SSE_MIMETYPE, headers=SSE_HEADERS)
+
+
+def tweet_page(args, *criteria):
+    """
+    The page of tweets matching `criteria` selected by the pagination arguments,
+    restricted to the requested `fields` if any.
+    """
+    try:
+        selection = fieldset.parse(args["fields"])
+        if selection is None:
+            query = db.session.query(Tweet)
+        else:
+            query = selection.query(db.session, Tweet.created_at, Tweet.id)
+        if criteria:
+            query = query.filter(*criteria)
+        tweets, next_cursor = paginate(
+            query,
+            Tweet.created_at,
+            Tweet.id,
+            args["limit"],
+            before=args["before"],
+            after=args["after"],
+        )
+    except ValueError as e:
+        api.abort(400, str(e))
+    if selection is None:
+        return serialized_response(
+            {"tweets": tweets, "next_cursor": next_cursor}, page_model
+        )
+    tweets = [selection.render(row) for row in tweets]
+    return json_response(dump_json({"tweets": tweets, "next_cursor": next_cursor}))
+
+
+def tweet_fields_row(session, selection, tweet_id):
+    """The selected fields of a tweet, with the versions of the tweet and author"""
+    return (
+        selection.query(
+            session,
+            Tweet.version,
+            Tweet.updated_at,
+            User.version.label("user__version"),
+            User.updated_at.label("user__updated_at"),
+            joins=[Tweet.user],
+        )
+        .filter(Tweet.id == tweet_id)
+        .first()
+    )
+
+
+def tweet_queue():
+    return ingest_queue(current_app._get_current_object(), write_tweets, publish_tweets)
+
+
+def enqueue_tweet(payload):
+    queue, _ = tweet_queue()
+    provisional_id = uuid.uuid4().hex
+    row = {"text": payload["text"], "user_id": payload["user_id"]}
+    try:
+        queue.put(provisional_id, row)
+    except QueueFull:
+        api.abort(503, "Ingest queue is full, retry later")
+    return {"provisional_id": provisional_id, "status": "queued"}, 202
+
+
 @api.route("")
 class TweetMain(Resource):
-    @api.doc(responses={400: "Invalid payload", 200: "Tweet Created"})
-    @api.marshal_with(model, code=200)
+    @api.doc(responses={400: "Invalid payload", 503: "Ingest queue full"})
+    @api.response(200, "Tweet Created", model)
+    @api.response(202, "Tweet Queued (TWEET_INGEST_MODE=async)", queued_model)
     @api.expect(create_tweet_fields, validate=True)
     def post(self):
         payload = request.json
 
-        # Check if user exists
-        user = db.session.query(User).get(payload["user_id"])
-        if user is None:
-            api.abort(400)
+        if current_app.config["TWEET_INGEST_MODE"] == "async":
+            # The write happens later, so check the author while we can answer 400
+            if db.session.query(User).get(payload["user_id"]) is None:
+                api.abort(400)
+            return enqueue_tweet(payload)
 
-        tweet = Tweet(text=payload["text"], user_id=payload["user_id"])
-        db.session.add(tweet)
-        db.session.commit()
+        # One INSERT ... RETURNING; the foreign key checks that the author exists
+        try:
+            row = db.session.execute(
+                insert(Tweet)
+                .values(text=payload["text"], user_id=payload["user_id"])
+                .returning(*returned_columns(payload["user_id"]))
+            ).one()
+            tweet = every_field.render(row)
+            events = record(db.session, "created", (row.id, tweet))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            api.abort(400)
+        changes.publish(events)
+        fan_out(payload["user_id"], [row.id])
         return tweet, 200
 
-    @api.doc(responses={200: "Success"})
-    @api.marshal_with(model, as_list=True, code=200)
+    @api.doc(responses={400: "Invalid cursor or fields"})
+    @api.response(200, "Success", page_model)
+    @api.expect(list_parser)
     def get(self):
-        return db.session.query(Tweet).all(), 200
+        args = list_parser.parse_args()
+        return tweet_page(args)
+
+
+@api.route("/batch")
+class TweetBatch(Resource):
+    @api.doc(responses={400: "Invalid payload", 200: "Batch processed"})
+    @api.marshal_with(batch_model, code=200)
+    @api.expect([create_tweet_fields], validate=True)
+    def post(self):
+        payload = request.json
+        if not isinstance(payload, list):
+            api.abort(400, "Expected a JSON array of tweets")
+        max_size = current_app.config["TWEET_BATCH_MAX_SIZE"]
+        if len(payload) > max_size:
+            api.abort(400, f"A batch holds at most {max_size} tweets")
+
+        # Check every referenced user in a single query
+        user_ids = {item["user_id"] for item in payload}
+        known = db.session.query(User.id).filter(User.id.in_(user_ids)).all()
+        known = {user_id for (user_id,) in known}
+
+        results, rows, indexes = [], [], []
+        for index, item in enumerate(payload):
+            if item["user_id"] in known:
+                rows.append({"text": item["text"], "user_id": item["user_id"]})
+                indexes.append(index)
+            else:
+                error = f"User {item['user_id']} does not exist"
+                results.append({"index": index, "status": 400, "error": error})
+
+        # One multi-row INSERT and one commit for the whole batch
+        if rows:
+            inserted = db.session.execute(
+                insert(Tweet).values(rows).returning(Tweet.id)
+            ).fetchall()
+            events = record_created([tweet_id for (tweet_id,) in inserted])
+            db.session.commit()
+            changes.publish(events)
+            by_user = {}
+            for index, (tweet_id,) in zip(indexes, inserted):
+                results.append({"index": index, "status": 200, "id": tweet_id})
+                by_user.setdefault(payload[index]["user_id"], []).append(tweet_id)
+            for user_id, tweet_ids in by_user.items():
+                fan_out(user_id, tweet_ids)
+
+        results.sort(key=lambda result: result["index"])
+        failed = len(payload) - len(rows)
+        return {"created": len(rows), "failed": failed, "results": results}, 200
+
+
+@api.route("/search")
+class TweetSearch(Resource):
+    @api.doc(responses={400: "Invalid cursor"})
+    @api.response(200, "Most relevant first", page_model)
+    @api.expect(search_parser)
+    def get(self):
+        args = search_parser.parse_args()
+        try:
+            tweets, next_cursor = search_tweets(
+                args["q"], args["limit"], args["cursor"]
+            )
+        except ValueError as e:
+            api.abort(400, str(e))
+        return serialized_response(
+            {"tweets": tweets, "next_cursor": next_cursor}, page_model
+        )
+
+
+@api.route("/ingest")
+class TweetIngest(Resource):
+    @api.doc(responses={200: "Async ingestion queue and writer metrics"})
+    def get(self):
+        config = current_app.config
+        if config["TWEET_INGEST_MODE"] != "async":
+            return {"mode": config["TWEET_INGEST_MODE"]}, 200
+        queue, writer = tweet_queue()
+        return {"mode": "async", **queue.stats(), **writer.stats()}, 200
+
+
+@api.route("/export")
+class TweetExport(Resource):
+    @api.doc(responses={200: "All tweets, one JSON object per line"})
+    @api.produces([NDJSON_MIMETYPE])
+    def get(self):
+        return ndjson_response(db.session.query(Tweet).order_by(Tweet.id), model)
+
+
+@api.route("/stream")
+class TweetStream(Resource):
+    @api.doc(
+        responses={
+            200: "Server-Sent Events: created, updated and deleted tweets, and "
+            "user_deleted for all the tweets of a deleted user. The response "
+            "ends after the changes already committed; the client polls again "
+            "after `retry`",
+            400: "Invalid cursor",
+            410: "Changes after the cursor are no longer all available",
+        }
+    )
+    @api.produces([SSE_MIMETYPE])
+    @api.expect(stream_parser)
+    def get(self):
+        args = stream_parser.parse_args()
+        try:
+            since = parse_since(args["since"], request.headers.get("Last-Event-ID"))
+        except ValueError as e:
+            api.abort(400, str(e))
+        # Catching up from a lagging replica could skip changes
+        g.pop("db_replica", None)
+        return stream_response(since)
 
 
 @api.route("/<int:tweet_id>")
 @api.doc(responses={404: "Tweet not found"})
 @api.param("tweet_id", "The tweet unique identifier")
 class TweetById(Resource):
-    @api.marshal_with(model, code=200)
-    @api.doc(responses={200: "Tweet Found"})
+    @api.response(200, "Tweet Found", model)
+    @api.response(304, "Not Modified")
+    @api.response(400, "Invalid fields")
+    @api.expect(fields_parser)
     def get(self, tweet_id):
+        try:
+            selection = fieldset.parse(fields_parser.parse_args()["fields"])
+        except ValueError as e:
+            api.abort(400, str(e))
+        if selection is not None:
+            return self.get_fields(tweet_id, selection)
+
+        cached = cache.get(tweet_key(tweet_id))
+        if cached is not None:
+            entry = CachedBody.decode(cached)
+            return conditional_response(entry, tweet_key(tweet_id))
+
         tweet = db.session.query(Tweet).get(tweet_id)
         if tweet is None:
             api.abort(404)
-        else:
-            return tweet, 200
+        entry = CachedBody(tweet.etag, tweet.last_modified, None)
+        if not_modified(entry.etag, entry.last_modified):
+            return conditional_response(entry)
+
+        entry = entry._replace(body=dump_json(serialize(tweet, model)))
+        tags = [user_tweets_tag(tweet.user_id)]
+        if not reading_replica():
+            cache.set(tweet_key(tweet_id), entry.encode(), tags=tags)
+        return conditional_response(entry, tweet_key(tweet_id))
 
-    @api.marshal_with(model, code=200)
-    @api.doc(responses={400: "Invalid payload", 200: "Tweet Updated"})
+    def get_fields(self, tweet_id, selection):
+        # Sparse bodies aren't cached, their validators are read with them
+        row = tweet_fields_row(db.session, selection, tweet_id)
+        if row is None:
+            api.abort(404)
+        entry = CachedBody(
+            Tweet.make_etag(tweet_id, row.version, row.user__version),
+            Tweet.make_last_modified(row.updated_at, row.user__updated_at),
+            None,
+        )
+        if not not_modified(entry.etag, entry.last_modified):
+            entry = entry._replace(body=dump_json(selection.render(row)))
+        return conditional_response(entry)
+
+    @api.doc(responses={400: "Invalid payload", 412: "ETag mismatch"})
+    @api.response(200, "Tweet Updated", model)
     @api.expect(update_tweet_fields, validate=True)
     def patch(self, tweet_id):
         payload = request.json
-        tweet = db.session.query(Tweet).get(tweet_id)
-
-        if tweet is None:
-            api.abort(404)
+        values = {key: payload[key] for key in ("text", "user_id") if key in payload}
 
-        tweet.text = payload["text"] if "text" in payload else tweet.text
-        tweet.user_id = payload["user_id"] if "user_id" in payload else tweet.user_id
+        # One UPDATE ... RETURNING, If-Match included; no row means 404 or 412
+        try:
+            row = db.session.execute(
+                update(Tweet)
+                .where(Tweet.id == tweet_id, if_match_clause(Tweet.etag_clause))
+                # A Core UPDATE leaves the ORM's version counter to us
+                .values(version=Tweet.version + 1, **values)
+                .returning(*returned_columns())
+                .execution_options(synchronize_session=False)
+            ).first()
+        except IntegrityError:
+            db.session.rollback()
+            api.abort(400, f"User {payload['user_id']} does not exist")
+        if row is None:
+            db.session.rollback()
+            abort_unmatched(db.session, Tweet.id, tweet_id)
+        tweet = every_field.render(row)
+        events = record(db.session, "updated", (tweet_id, tweet))
         db.session.commit()
+        changes.publish(events)
+        cache.delete(tweet_key(tweet_id))
 
-        return tweet, 200
+        return tweet, 200, returned_validators(row)
 
-    @api.doc(responses={204: "Tweet Deleted"})
+    @api.doc(responses={204: "Tweet Deleted", 412: "ETag mismatch"})
     def delete(self, tweet_id):
-        tweet = db.session.query(Tweet).get(tweet_id)
-
-        if tweet is None:
-            api.abort(404)
-
-        db.session.delete(tweet)
+        deleted = db.session.execute(
+            delete(Tweet)
+            .where(Tweet.id == tweet_id, if_match_clause(Tweet.etag_clause))
+            .returning(Tweet.id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if deleted is None:
+            db.session.rollback()
+            abort_unmatched(db.session, Tweet.id, tweet_id)
+        events = record(db.session, "deleted", (tweet_id, {"id": tweet_id}))
         db.session.commit()
+        changes.publish(events)
+        cache.delete(tweet_key(tweet_id))
         return "", 204
@@ -1,21 +1,57 @@
 # pylint: disable=missing-docstring
 
-from flask import request
-from flask_restx import Namespace, Resource, fields
-from app.models import User
-from app import db
+import time
+from datetime import datetime
 
-api = Namespace("users")
+from flask import current_app, request, url_for
+from flask_restx import Resource, fields, inputs, marshal, reqparse
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from app.apis.tweets import list_parser as tweet_list_parser
+from app.apis.tweets import page_model as tweet_page_model
+from app.apis.tweets import tweet_page
+from app.auth import authenticate_owner, generate_key, public, require_api_key
+from app.bulk import chunked, iter_json_items
+from app.change_log import record, user_deleted
+from app.cache import dump_json, json_response, user_key, user_tweets_tag
+from app.conditional import (
+    CachedBody,
+    abort_unmatched,
+    conditional_response,
+    if_match_clause,
+    not_modified,
+    validator_headers,
+)
+from app.metrics import InstrumentedNamespace
+from app.fieldsets import Fieldset, with_fields
+from app.models import Follow, Tweet, User
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.purge import purge_progress, start_purge
+from app.replicas import reading_replica, route_reads
+from app.serializers import serialize, serialized_response
+from app.streaming import NDJSON_MIMETYPE, ndjson_response
+from app import auth, cache, changes, db, timelines
+
+api = InstrumentedNamespace("users", decorators=[require_api_key, route_reads])
+# Failed items listed in an import summary; the rest are only counted
+MAX_IMPORT_ERRORS = 100
 model = api.model(
     "User",
     {
         "id": fields.Integer,
         "username": fields.String,
         "email": fields.String,
-        "api_key": fields.String,
     },
 )
 
+# Only the response to POST /users holds the key, which is stored as a digest
+created_user_model = api.clone(
+    "CreatedUser",
+    model,
+    {"api_key": fields.String(description="X-API-Key of the user, shown once")},
+)
+
 create_user_fields = api.model(
     "CreateUserModel",
     {
@@ -24,6 +60,90 @@ create_user_fields = api.model(
     },
 )
 
+import_error = api.model(
+    "UserImportError",
+    {
+        "index": fields.Integer(description="Position in the submitted items"),
+        "error": fields.String,
+    },
+)
+
+import_summary = api.model(
+    "UserImportSummary",
+    {
+        "received": fields.Integer,
+        "imported": fields.Integer,
+        "failed": fields.Integer,
+        "chunks": fields.Integer,
+        "seconds": fields.Float,
+        "rows_per_second": fields.Float,
+        "errors": fields.List(
+            fields.Nested(import_error),
+            description=f"The first {MAX_IMPORT_ERRORS} failed items",
+        ),
+    },
+)
+
+import_parser = reqparse.RequestParser()
+import_parser.add_argument(
+    "chunk_size",
+    type=inputs.int_range(1, 10000),
+    location="args",
+    help="Rows per transaction (defaults to USER_IMPORT_CHUNK_SIZE)",
+)
+import_parser.add_argument(
+    "upsert",
+    type=inputs.boolean,
+    default=False,
+    location="args",
+    help="Update the email of users whose username already exists",
+)
+
+purge_model = api.model(
+    "UserPurge",
+    {
+        "user_id": fields.Integer,
+        "status": fields.String(enum=["running", "done", "failed"]),
+        "total": fields.Integer(description="The user's tweets when it started"),
+        "deleted": fields.Integer,
+        "chunks": fields.Integer,
+        "seconds": fields.Float,
+        "error": fields.String,
+    },
+)
+
+delete_parser = reqparse.RequestParser()
+delete_parser.add_argument(
+    "purge",
+    choices=("inline", "background"),
+    default="inline",
+    location="args",
+    help="Delete the user's tweets in this request, or in chunks in the background",
+)
+
+timeline_parser = reqparse.RequestParser()
+timeline_parser.add_argument(
+    "limit",
+    type=inputs.int_range(1, MAX_PAGE_SIZE),
+    default=DEFAULT_PAGE_SIZE,
+    location="args",
+    help=f"Number of tweets (1-{MAX_PAGE_SIZE})",
+)
+
+fieldset = Fieldset(
+    model,
+    User,
+    {
+        "id": User.id,
+        "username": User.username,
+        "email": User.email,
+    },
+)
+fields_parser = with_fields(None, fieldset)
+
+# Dialects whose insert() supports ON CONFLICT DO UPDATE
+UPSERT_DIALECTS = {"postgresql": postgresql, "sqlite": sqlite}
+
 update_user_fields = api.model(
     "CreateUserModel",
     {
@@ -35,62 +155,417 @@ update_user_fields = api.model(
 
 @api.route("")
 class UserMain(Resource):
+    # Signing up is how a key is obtained
+    @public
     @api.doc(responses={400: "Invalid payload", 200: "User Created"})
-    @api.marshal_with(model, code=200)
+    @api.marshal_with(created_user_model, code=200)
     @api.expect(create_user_fields, validate=True)
     def post(self):
         payload = request.json
+        api_key, digest = generate_key()
         user = User(
-            username=payload["username"],
-            email=payload["email"],
-            api_key=(payload["api_key"] if "api_key" in payload else ""),
+            username=payload["username"], email=payload["email"], api_key=digest
         )
         db.session.add(user)
-        db.session.commit()
-        return user, 200
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            api.abort(400, f"Username {payload['username']} is taken")
+        return {**marshal(user, model), "api_key": api_key}, 200
+
+    @api.response(200, "Success", [model])
+    @api.response(400, "Invalid fields")
+    @api.expect(fields_parser)
+    def get(self):
+        try:
+            selection = fieldset.parse(fields_parser.parse_args()["fields"])
+        except ValueError as e:
+            api.abort(400, str(e))
+        if selection is None:
+            return serialized_response(db.session.query(User).all(), model)
+        rows = selection.query(db.session).all()
+        return json_response(dump_json([selection.render(row) for row in rows]))
+
+
+def user_fields_row(session, selection, user_id):
+    """The selected fields of a user, with its version"""
+    return (
+        selection.query(session, User.version, User.updated_at)
+        .filter(User.id == user_id)
+        .first()
+    )
+
+
+def invalidate_user(user_id):
+    # Tweets embed their author, so they go stale along with the user
+    cache.delete(user_key(user_id))
+    cache.invalidate_tag(user_tweets_tag(user_id))
+    auth.invalidate_user(user_id)
+
+
+def valid_user_row(item):
+    return (
+        isinstance(item, dict)
+        and isinstance(item.get("username"), str)
+        and isinstance(item.get("email"), str)
+    )
 
-    @api.doc(responses={200: "Success"})
-    @api.marshal_with(model, as_list=True, code=200)
+
+def insert_users(rows, upsert):
+    if not upsert:
+        return insert(User).values(rows)
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        api.abort(400, f"Upsert is not supported on {dialect}")
+    # ON CONFLICT cannot touch the same row twice in one statement
+    rows = list({row["username"]: row for row in rows}.values())
+    stmt = UPSERT_DIALECTS[dialect].insert(User).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.username],
+        set_={
+            "email": stmt.excluded.email,
+            # ORM onupdate hooks and version counters don't apply to Core upserts
+            "updated_at": datetime.utcnow(),
+            "version": User.version + 1,
+        },
+    )
+    return stmt.returning(User.id)
+
+
+@api.route("/batch")
+class UserBatch(Resource):
+    @api.doc(
+        responses={400: "Invalid payload", 200: "Import summary"},
+        consumes=["application/json", NDJSON_MIMETYPE],
+    )
+    @api.marshal_with(import_summary, code=200)
+    @api.expect(import_parser, [create_user_fields])
+    def post(self):
+        args = import_parser.parse_args()
+        chunk_size = args["chunk_size"] or current_app.config["USER_IMPORT_CHUNK_SIZE"]
+        received = imported = chunks = 0
+        errors = []
+        start = time.perf_counter()
+
+        def fail(index, error):
+            if len(errors) < MAX_IMPORT_ERRORS:
+                errors.append({"index": index, "error": error})
+
+        try:
+            for chunk in chunked(iter_json_items(request), chunk_size):
+                # Imported users get no API key
+                rows, indexes = [], []
+                for index, item in enumerate(chunk, received):
+                    if valid_user_row(item):
+                        rows.append(
+                            {"username": item["username"], "email": item["email"]}
+                        )
+                        indexes.append(index)
+                    else:
+                        fail(index, "Expected an object with username and email")
+                received += len(chunk)
+                if not rows:
+                    continue
+
+                # One multi-row statement and one commit per chunk
+                try:
+                    result = db.session.execute(insert_users(rows, args["upsert"]))
+                    upserted = result.fetchall() if args["upsert"] else []
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()
+                    # Find the offending rows, one statement and commit each
+                    upserted = []
+                    for index, row in zip(indexes, rows):
+                        try:
+                            result = db.session.execute(
+                                insert_users([row], args["upsert"])
+                            )
+                            upserted += result.fetchall() if args["upsert"] else []
+                            db.session.commit()
+                            imported += 1
+                        except IntegrityError:
+                            db.session.rollback()
+                            fail(index, f"Username {row['username']} is taken")
+                else:
+                    imported += len(rows)
+                for (user_id,) in upserted:
+                    invalidate_user(user_id)
+                chunks += 1
+        except ValueError as e:
+            api.abort(400, str(e))
+
+        seconds = time.perf_counter() - start
+        return {
+            "received": received,
+            "imported": imported,
+            "failed": received - imported,
+            "chunks": chunks,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(imported / seconds, 1) if seconds else 0.0,
+            "errors": errors,
+        }, 200
+
+
+@api.route("/export")
+class UserExport(Resource):
+    @api.doc(responses={200: "All users, one JSON object per line"})
+    @api.produces([NDJSON_MIMETYPE])
     def get(self):
-        return db.session.query(User).all(), 200
+        return ndjson_response(db.session.query(User).order_by(User.id), model)
 
 
 @api.route("/<int:user_id>", endpoint="user-by-id")
 @api.doc(responses={404: "User not found"})
 @api.param("user_id", "The user unique identifier")
 class UserById(Resource):
-    @api.marshal_with(model, code=200)
-    @api.doc(responses={200: "User Found"})
+    @api.response(200, "User Found", model)
+    @api.response(304, "Not Modified")
+    @api.response(400, "Invalid fields")
+    @api.expect(fields_parser)
     def get(self, user_id):
+        try:
+            selection = fieldset.parse(fields_parser.parse_args()["fields"])
+        except ValueError as e:
+            api.abort(400, str(e))
+        if selection is not None:
+            return self.get_fields(user_id, selection)
+
+        cached = cache.get(user_key(user_id))
+        if cached is not None:
+            entry = CachedBody.decode(cached)
+            return conditional_response(entry, user_key(user_id))
+
         user = db.session.query(User).get(user_id)
         if user is None:
             api.abort(404)
-        else:
-            return user, 200
+        entry = CachedBody(user.etag, user.last_modified, None)
+        if not_modified(entry.etag, entry.last_modified):
+            return conditional_response(entry)
+
+        entry = entry._replace(body=dump_json(serialize(user, model)))
+        if not reading_replica():
+            cache.set(user_key(user_id), entry.encode())
+        return conditional_response(entry, user_key(user_id))
+
+    def get_fields(self, user_id, selection):
+        row = user_fields_row(db.session, selection, user_id)
+        if row is None:
+            api.abort(404)
+        entry = CachedBody(User.make_etag(user_id, row.version), row.updated_at, None)
+        if not not_modified(entry.etag, entry.last_modified):
+            entry = entry._replace(body=dump_json(selection.render(row)))
+        return conditional_response(entry)
 
-    @api.marshal_with(model, code=200)
-    @api.doc(responses={400: "Invalid payload", 200: "User Updated"})
+    @api.doc(responses={400: "Invalid payload", 412: "ETag mismatch"})
+    @api.response(200, "User Updated", model)
     @api.expect(update_user_fields, validate=True)
     def patch(self, user_id):
         payload = request.json
-        user = db.session.query(User).get(user_id)
+        values = {key: payload[key] for key in ("username", "email") if key in payload}
 
-        if user is None:
+        # One UPDATE ... RETURNING, If-Match included; no row means 404 or 412
+        try:
+            row = db.session.execute(
+                update(User)
+                .where(User.id == user_id, if_match_clause(User.etag_clause))
+                # A Core UPDATE leaves the ORM's version counter to us
+                .values(version=User.version + 1, **values)
+                .returning(
+                    User.id,
+                    User.username,
+                    User.email,
+                    User.version,
+                    User.updated_at,
+                )
+                .execution_options(synchronize_session=False)
+            ).first()
+        except IntegrityError:
+            db.session.rollback()
+            api.abort(400, f"Username {payload['username']} is taken")
+        if row is None:
+            db.session.rollback()
+            abort_unmatched(db.session, User.id, user_id)
+        db.session.commit()
+        invalidate_user(user_id)
+
+        etag = User.make_etag(row.id, row.version)
+        return serialize(row, model), 200, validator_headers(etag, row.updated_at)
+
+    @api.doc(responses={204: "User Deleted", 412: "ETag mismatch"})
+    @api.response(202, "Purge Started (purge=background)", purge_model)
+    @api.expect(delete_parser)
+    def delete(self, user_id):
+        if delete_parser.parse_args()["purge"] == "background":
+            return self.purge(user_id)
+
+        # One DELETE; tweets and follows go with the user by ON DELETE CASCADE
+        deleted = db.session.execute(
+            delete(User)
+            .where(User.id == user_id, if_match_clause(User.etag_clause))
+            .returning(User.id)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if deleted is None:
+            db.session.rollback()
+            abort_unmatched(db.session, User.id, user_id)
+        events = record(db.session, "user_deleted", user_deleted(user_id))
+        db.session.commit()
+        changes.publish(events)
+        invalidate_user(user_id)
+        return "", 204
+
+    def purge(self, user_id):
+        found = db.session.execute(
+            select(User.id).where(User.id == user_id, if_match_clause(User.etag_clause))
+        ).first()
+        if found is None:
+            abort_unmatched(db.session, User.id, user_id)
+
+        job = start_purge(current_app._get_current_object(), user_id, invalidate_user)
+        location = url_for("user-purge", user_id=user_id)
+        return marshal(job.progress, purge_model), 202, {"Location": location}
+
+
+@api.route("/<int:user_id>/purge", endpoint="user-purge")
+@api.param("user_id", "The user unique identifier")
+class UserPurge(Resource):
+    @api.doc(responses={404: "No recent purge of this user"})
+    @api.marshal_with(purge_model, code=200)
+    def get(self, user_id):
+        progress = purge_progress(user_id)
+        if progress is None:
             api.abort(404)
+        return progress, 200
+
 
-        user.username = payload["username"] if "username" in payload else user.username
-        user.email = payload["email"] if "email" in payload else user.email
+@api.route("/<int:user_id>/key")
+@api.param("user_id", "The user unique identifier")
+class UserKey(Resource):
+    # Guarded by the user's current key or ADMIN_API_KEY, whatever AUTH_MODE:
+    # admins issue keys to imported users, and to those who lost theirs
+    @public
+    @api.doc(
+        responses={
+            401: "Neither the user's X-API-Key nor X-Admin-Key",
+            403: "Another user's X-API-Key",
+            404: "User not found",
+        }
+    )
+    @api.marshal_with(created_user_model, code=200, description="Key Issued")
+    def post(self, user_id):
+        authenticate_owner(user_id)
+        api_key, digest = generate_key()
+        row = db.session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(api_key=digest)
+            .returning(User.id, User.username, User.email)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if row is None:
+            db.session.rollback()
+            api.abort(404)
         db.session.commit()
+        # The previous key stops working here at once, in other workers within
+        # API_KEY_INDEX_TTL
+        auth.invalidate_user(user_id)
+        auth.forget(api_key)
+        return {**row._asdict(), "api_key": api_key}, 200
 
-        return user, 200
 
-    @api.doc(responses={204: "User Deleted"})
-    def delete(self, user_id):
+@api.route("/<int:user_id>/tweets")
+@api.doc(responses={404: "User not found"})
+@api.param("user_id", "The user unique identifier")
+class UserTweets(Resource):
+    @api.doc(responses={400: "Invalid cursor or fields"})
+    @api.response(200, "Success", tweet_page_model)
+    @api.expect(tweet_list_parser)
+    def get(self, user_id):
+        args = tweet_list_parser.parse_args()
         user = db.session.query(User).get(user_id)
-
         if user is None:
             api.abort(404)
 
-        db.session.delete(user)
+        return tweet_page(args, Tweet.user_id == user_id)
+
+
+@api.route("/<int:user_id>/following/<int:followee_id>")
+@api.doc(responses={404: "User not found"})
+@api.param("user_id", "The follower unique identifier")
+@api.param("followee_id", "The followed user unique identifier")
+class UserFollowing(Resource):
+    @api.doc(responses={204: "Following", 400: "Cannot follow oneself"})
+    def put(self, user_id, followee_id):
+        if user_id == followee_id:
+            api.abort(400, "Users cannot follow themselves")
+        found = db.session.query(User.id).filter(User.id.in_([user_id, followee_id]))
+        if found.count() != 2:
+            api.abort(404)
+
+        db.session.merge(Follow(follower_id=user_id, followee_id=followee_id))
+        db.session.commit()
+        return "", 204
+
+    @api.doc(responses={204: "Not following"})
+    def delete(self, user_id, followee_id):
+        db.session.query(Follow).filter_by(
+            follower_id=user_id, followee_id=followee_id
+        ).delete()
         db.session.commit()
         return "", 204
+
+
+def rebuild_timeline(user_id):
+    """
+    Refill a home timeline missing from the store, e.g. after a restart, with
+    the tweets fan-out would have pushed: the user's and their followees'.
+    """
+    followed = select(Follow.followee_id).where(Follow.follower_id == user_id)
+    tweet_ids = db.session.scalars(
+        select(Tweet.id)
+        .where(or_(Tweet.user_id == user_id, Tweet.user_id.in_(followed)))
+        .order_by(Tweet.created_at.desc(), Tweet.id.desc())
+        .limit(timelines.max_length)
+    ).all()
+    if tweet_ids:
+        timelines.rebuild(user_id, tweet_ids)
+    return tweet_ids
+
+
+@api.route("/<int:user_id>/timeline")
+@api.doc(responses={404: "User not found"})
+@api.param("user_id", "The user unique identifier")
+class UserTimeline(Resource):
+    @api.response(
+        200, "Tweets from the user and the accounts they follow", tweet_page_model
+    )
+    @api.expect(timeline_parser)
+    def get(self, user_id):
+        limit = timeline_parser.parse_args()["limit"]
+        user = db.session.query(User).get(user_id)
+        if user is None:
+            api.abort(404)
+
+        # Tweets fanned out on write, plus those of followed accounts too big for it
+        tweet_ids = timelines.read(user_id, limit)
+        if tweet_ids is None:
+            tweet_ids = rebuild_timeline(user_id)[:limit]
+        condition = Tweet.id.in_(tweet_ids)
+        celebrities = timelines.celebrities()
+        if celebrities:
+            followed = db.session.query(Follow.followee_id).filter(
+                Follow.follower_id == user_id, Follow.followee_id.in_(celebrities)
+            )
+            condition = or_(condition, Tweet.user_id.in_(followed))
+
+        tweets = (
+            db.session.query(Tweet)
+            .filter(condition)
+            .order_by(Tweet.created_at.desc(), Tweet.id.desc())
+            .limit(limit)
+            .all()
+        )
+        return serialized_response({"tweets": tweets}, tweet_page_model)
@@ -0,0 +1,698 @@
+# pylint: disable=missing-docstring
+
+"""
+ASGI entry point serving the core tweet and user routes on an async driver.
+
+Handlers await the database instead of holding a worker thread while a query
+runs, so one process can keep many slow requests in flight. Models, API
+models, pagination, sparse fieldsets, caching, compression and AUTH_MODE
+authentication and rate limiting (app.auth) are shared with the Flask app; the
+responses are the same, byte for byte, for the routes served here. The cache,
+timelines and rate limiter may be Redis clients, which block: they are called
+in the thread pool. Batch, export, search, timeline, ingestion and key issuing
+routes are only served by the WSGI app, and settings the ASGI app doesn't apply
+(`UNSUPPORTED_SETTINGS`) are rejected when creating it.
+
+GET /tweets/stream waits on the event loop rather than in a thread, so the
+streams held open are only limited by memory, and never cut short. The Flask
+app, on sync workers, only answers polls of the same stream.
+"""
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import jsonschema
+from flask_restx import marshal
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.endpoints import HTTPEndpoint
+from starlette.middleware import Middleware
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.exceptions import default_exceptions
+from werkzeug.http import (
+    parse_accept_header,
+    parse_date,
+    parse_etags,
+    quote_etag,
+    unquote_etag,
+)
+
+from app.apis import tweets, users
+from app.auth import (
+    API_KEY_HEADER,
+    KeyIndex,
+    check_auth_mode,
+    generate_key,
+    make_rate_limiter,
+    needs_key,
+    public,
+    retry_after,
+    user_id_query,
+)
+from app.cache import make_cache, tweet_key, user_key, user_tweets_tag
+from app.change_log import (
+    StreamGap,
+    as_event,
+    catch_up_query,
+    change_insert,
+    check_catch_up,
+    pruned_query,
+    user_deleted,
+)
+from app.changes import (
+    KEEPALIVE,
+    SSE_HEADERS,
+    SSE_MIMETYPE,
+    format_event,
+    make_change_feed,
+    parse_since,
+    retry_field,
+    unseen,
+)
+from app.compression import (
+    COMPRESSIBLE_MIMETYPES,
+    best_encoding,
+    compress,
+    encoded_etag,
+)
+from app.conditional import CachedBody, is_fresh, matches, validator_headers
+from app.models import Follow, Tweet, User
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset, page, paginate
+from app.pool import enforce_foreign_keys
+from app.timelines import make_timeline_store
+
+# Async driver used for each synchronous database URL scheme
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+# Settings the ASGI app would ignore, and why they can't be applied here
+UNSUPPORTED_SETTINGS = {
+    "TWEET_INGEST_MODE": (
+        lambda value: value != "sync",
+        "the ingestion queue is only drained by the WSGI app",
+    ),
+    "DATABASE_REPLICA_URLS": (
+        bool,
+        "reads are not routed to replicas; unset it for the ASGI app",
+    ),
+}
+
+
+def check_settings(settings):
+    for key, (unsupported, reason) in UNSUPPORTED_SETTINGS.items():
+        if unsupported(settings[key]):
+            raise ValueError(f"{key}={settings[key]!r} is not supported: {reason}")
+
+
+def async_database_uri(uri):
+    url = make_url(uri)
+    backend = url.drivername.split("+")[0]
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {url.drivername!r}")
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+class APIError(Exception):
+    """Turned into the same JSON error body flask-restx's api.abort produces"""
+
+    def __init__(self, code, message=None, headers=None, **extra):
+        super().__init__(message)
+        self.code = code
+        self.message = message or default_exceptions[code].description
+        self.headers = headers
+        self.extra = extra
+
+
+def dump_json(data):
+    return json.dumps(data) + "\n"
+
+
+def json_response(data, code=200, headers=None):
+    return Response(dump_json(data), code, headers, media_type="application/json")
+
+
+async def api_error(request, exc):  # pylint: disable=unused-argument
+    body = {"message": exc.message, **exc.extra}
+    return json_response(body, exc.code, exc.headers)
+
+
+async def read_payload(request, api_model):
+    """The request's JSON body, validated like `@api.expect(..., validate=True)`"""
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        raise APIError(400) from None
+
+    errors = {}
+    for error in jsonschema.Draft4Validator(api_model.__schema__).iter_errors(payload):
+        path = [str(part) for part in error.path]
+        if error.validator == "required":
+            path.append(error.message.split("'")[1])
+        errors[".".join(path)] = error.message
+    if errors:
+        raise APIError(400, "Input payload validation failed", errors=errors)
+    return payload
+
+
+def page_args(request):
+    params = request.query_params
+    try:
+        limit = int(params.get("limit", DEFAULT_PAGE_SIZE))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError()
+    except ValueError:
+        error = (
+            f"Page size (1-{MAX_PAGE_SIZE}) Invalid argument: {params['limit']}. "
+            f"argument must be within the range 1 - {MAX_PAGE_SIZE}"
+        )
+        raise APIError(
+            400, "Input payload validation failed", errors={"limit": error}
+        ) from None
+    return limit, params.get("before"), params.get("after")
+
+
+def parse_fields(request, fieldset):
+    try:
+        return fieldset.parse(request.query_params.get("fields"))
+    except ValueError as e:
+        raise APIError(400, str(e)) from None
+
+
+def conditional_response(request, entry):
+    """Async twin of app.conditional.conditional_response"""
+    headers = validator_headers(entry.etag, entry.last_modified)
+    if_none_match = request.headers.get("if-none-match")
+    fresh = is_fresh(
+        entry.etag,
+        entry.last_modified,
+        parse_etags(if_none_match) if if_none_match else None,
+        parse_date(request.headers.get("if-modified-since")),
+    )
+    if fresh:
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, 200, headers, media_type="application/json")
+
+
+def check_if_match(request, etag):
+    if_match = request.headers.get("if-match")
+    if if_match and not matches(parse_etags(if_match), etag):
+        raise APIError(412)
+
+
+class CompressionMiddleware:
+    """
+    Twin of app.compression.Compression: JSON responses larger than
+    COMPRESSION_MIN_SIZE are compressed, in the thread pool, and their ETag
+    suffixed with the encoding
+    """
+
+    def __init__(self, app, config):
+        self.app = app
+        self.config = config
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = parse_accept_header(Headers(scope=scope).get("accept-encoding"))
+        start, chunks = None, []
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "").split(";")[0]
+                if (
+                    message["status"] == 200
+                    and "content-encoding" not in headers
+                    and media_type in COMPRESSIBLE_MIMETYPES
+                ):
+                    start = message
+                    return
+            elif start is not None:
+                chunks.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                start, body = await self.encode(start, b"".join(chunks), accept)
+                await send(start)
+                message = {"type": "http.response.body", "body": body}
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+    async def encode(self, start, data, accept):
+        """The response start message and body to send for `data`"""
+        headers = MutableHeaders(raw=list(start["headers"]))
+        # Whatever the outcome, the response depended on Accept-Encoding
+        headers.add_vary_header("Accept-Encoding")
+        encoding = best_encoding(self.config, len(data), accept)
+        if encoding is not None:
+            data = await run_in_threadpool(compress, data, encoding, self.config)
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(data))
+            if "etag" in headers:
+                etag, weak = unquote_etag(headers["etag"])
+                headers["etag"] = quote_etag(encoded_etag(etag, encoding), weak)
+        return {**start, "headers": headers.raw}, data
+
+
+class Endpoint(HTTPEndpoint):
+    @property
+    def state(self):
+        return self.scope["app"].state
+
+    def session(self):
+        return self.state.sessionmaker()
+
+    async def dispatch(self):
+        headers = await self.authenticate(Request(self.scope))
+        if headers:
+            send = self.send
+
+            async def send_with_headers(message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        *((k.lower().encode(), v.encode()) for k, v in headers.items()),
+                    ]
+                await send(message)
+
+            self.send = send_with_headers
+        await super().dispatch()
+
+    async def authenticate(self, request):
+        """
+        Async twin of app.auth.authenticate, for methods not marked `public`.
+        Returns the rate limit headers to add to the response.
+        """
+        handler = getattr(self, request.method.lower(), None)
+        config = self.state.config
+        if getattr(handler, "public", False) or not needs_key(config, request.method):
+            return {}
+
+        api_key = request.headers.get(API_KEY_HEADER, "")
+        user_id = None
+        if api_key:
+            user_id = await self.state.keys.resolve_async(api_key, self.find_user_id)
+        if user_id is None:
+            raise APIError(401, f"A valid {API_KEY_HEADER} header is required")
+        request.state.user_id = user_id
+
+        limiter = self.state.rate_limiter
+        if limiter is None:
+            return {}
+        allowed, tokens = await run_in_threadpool(limiter.take, f"user:{user_id}")
+        headers = {
+            "X-RateLimit-Limit": str(limiter.burst),
+            "X-RateLimit-Remaining": str(int(tokens)),
+        }
+        if not allowed:
+            headers["Retry-After"] = str(retry_after(limiter, tokens))
+            raise APIError(429, "API key rate limit exceeded", headers=headers)
+        return headers
+
+    async def find_user_id(self, api_key):
+        async with self.session() as session:
+            return await session.scalar(user_id_query(api_key))
+
+
+async def record(session, action, *rows):
+    """Async twin of app.change_log.record"""
+    return [as_event(row) for row in await session.execute(change_insert(action, rows))]
+
+
+async def fan_out(session, state, user_id, tweet_ids):
+    """Async twin of app.apis.tweets.fan_out"""
+    limit = state.config["TIMELINE_FANOUT_LIMIT"]
+    followers = (
+        (
+            await session.execute(
+                select(Follow.follower_id)
+                .where(Follow.followee_id == user_id)
+                .limit(limit + 1)
+            )
+        )
+        .scalars()
+        .all()
+    )
+    if len(followers) > limit:
+        await run_in_threadpool(state.timelines.mark_celebrity, user_id)
+        followers = []
+
+    recipients = [user_id] + list(followers)
+    for tweet_id in tweet_ids:
+        await run_in_threadpool(state.timelines.push, recipients, tweet_id)
+
+
+class TweetMain(Endpoint):
+    async def post(self, request):
+        payload = await read_payload(request, tweets.create_tweet_fields)
+        async with self.session() as session:
+            user = await session.get(User, payload["user_id"])
+            if user is None:
+                raise APIError(400)
+
+            tweet = Tweet(text=payload["text"], user=user)
+            session.add(tweet)
+            await session.flush()
+            body = marshal(tweet, tweets.model)
+            events = await record(session, "created", (tweet.id, body))
+            await session.commit()
+            self.state.changes.publish(events)
+            await fan_out(session, self.state, tweet.user_id, [tweet.id])
+            return json_response(body)
+
+    async def get(self, request):
+        limit, before, after = page_args(request)
+        selection = parse_fields(request, tweets.fieldset)
+        if selection is not None:
+            return await self.get_fields(selection, limit, before, after)
+        try:
+            query = keyset(
+                select(Tweet), Tweet.created_at, Tweet.id, limit, before, after
+            )
+        except ValueError as e:
+            raise APIError(400, str(e)) from None
+        async with self.session() as session:
+            rows = (await session.execute(query)).scalars().all()
+            page_tweets, next_cursor = page(rows, limit)
+            body = {"tweets": page_tweets, "next_cursor": next_cursor}
+            return json_response(marshal(body, tweets.page_model))
+
+    async def get_fields(self, selection, limit, before, after):
+        def fetch(session):
+            query = selection.query(session, Tweet.created_at, Tweet.id)
+            return paginate(query, Tweet.created_at, Tweet.id, limit, before, after)
+
+        async with self.session() as session:
+            try:
+                rows, next_cursor = await session.run_sync(fetch)
+            except ValueError as e:
+                raise APIError(400, str(e)) from None
+        page_tweets = [selection.render(row) for row in rows]
+        return json_response({"tweets": page_tweets, "next_cursor": next_cursor})
+
+
+class TweetById(Endpoint):
+    async def get(self, request):
+        tweet_id = request.path_params["tweet_id"]
+        selection = parse_fields(request, tweets.fieldset)
+        if selection is not None:
+            return await self.get_fields(request, tweet_id, selection)
+
+        cached = await run_in_threadpool(self.state.cache.get, tweet_key(tweet_id))
+        if cached is not None:
+            return conditional_response(request, CachedBody.decode(cached))
+
+        async with self.session() as session:
+            tweet = await session.get(Tweet, tweet_id)
+            if tweet is None:
+                raise APIError(404)
+            entry = CachedBody(tweet.etag, tweet.last_modified, None)
+            entry = entry._replace(body=dump_json(marshal(tweet, tweets.model)))
+        tags = [user_tweets_tag(tweet.user_id)]
+        await run_in_threadpool(
+            self.state.cache.set, tweet_key(tweet_id), entry.encode(), tags=tags
+        )
+        return conditional_response(request, entry)
+
+    async def get_fields(self, request, tweet_id, selection):
+        async with self.session() as session:
+            row = await session.run_sync(tweets.tweet_fields_row, selection, tweet_id)
+        if row is None:
+            raise APIError(404)
+        entry = CachedBody(
+            Tweet.make_etag(tweet_id, row.version, row.user__version),
+            Tweet.make_last_modified(row.updated_at, row.user__updated_at),
+            dump_json(selection.render(row)),
+        )
+        return conditional_response(request, entry)
+
+    async def patch(self, request):
+        tweet_id = request.path_params["tweet_id"]
+        payload = await read_payload(request, tweets.update_tweet_fields)
+        async with self.session() as session:
+            tweet = await session.get(Tweet, tweet_id)
+            if tweet is None:
+                raise APIError(404)
+            check_if_match(request, tweet.etag)
+
+            tweet.text = payload["text"] if "text" in payload else tweet.text
+            tweet.user_id = payload.get("user_id", tweet.user_id)
+            try:
+                await session.flush()
+            except IntegrityError:
+                message = f"User {payload['user_id']} does not exist"
+                raise APIError(400, message) from None
+            # Picks up the new author if user_id changed
+            await session.refresh(tweet)
+            body = marshal(tweet, tweets.model)
+            events = await record(session, "updated", (tweet_id, body))
+            await session.commit()
+            self.state.changes.publish(events)
+            await run_in_threadpool(self.state.cache.delete, tweet_key(tweet_id))
+
+            headers = validator_headers(tweet.etag, tweet.last_modified)
+            return json_response(body, headers=headers)
+
+    async def delete(self, request):
+        tweet_id = request.path_params["tweet_id"]
+        async with self.session() as session:
+            tweet = await session.get(Tweet, tweet_id)
+            if tweet is None:
+                raise APIError(404)
+            check_if_match(request, tweet.etag)
+
+            await session.delete(tweet)
+            events = await record(session, "deleted", (tweet_id, {"id": tweet_id}))
+            await session.commit()
+        self.state.changes.publish(events)
+        await run_in_threadpool(self.state.cache.delete, tweet_key(tweet_id))
+        return Response(status_code=204)
+
+
+class TweetStream(Endpoint):
+    async def get(self, request):
+        config = self.state.config
+        try:
+            since = parse_since(
+                request.query_params.get("since"), request.headers.get("last-event-id")
+            )
+        except ValueError as e:
+            raise APIError(400, str(e)) from None
+
+        feed = self.state.changes
+        loop = asyncio.get_running_loop()
+        wake = asyncio.Event()
+        # Notifications are delivered from the listener's thread; subscribing
+        # may wait for that thread to LISTEN
+        subscription = await asyncio.to_thread(
+            feed.subscribe, lambda: loop.call_soon_threadsafe(wake.set)
+        )
+        backlog = []
+        try:
+            if since is not None:
+                limit = config["TWEET_STREAM_CATCHUP_MAX"]
+                async with self.session() as session:
+                    # Not held back to settle: the subscription, already
+                    # open, gets the changes committed after this query
+                    rows = await session.execute(catch_up_query(since, limit))
+                    backlog = [as_event(row) for row in rows]
+                    pruned = await session.scalar(pruned_query())
+                check_catch_up(since, pruned, backlog, limit)
+        except StreamGap as e:
+            feed.unsubscribe(subscription)
+            raise APIError(410, str(e)) from None
+        except BaseException:
+            feed.unsubscribe(subscription)
+            raise
+
+        async def generate():
+            try:
+                yield retry_field(config)
+                for event in backlog:
+                    yield format_event(event)
+                seen = {event["id"] for event in backlog}
+                while True:
+                    wake.clear()
+                    for event in unseen(subscription.drain(), seen):
+                        yield format_event(event)
+                    if subscription.closed:
+                        break
+                    try:
+                        await asyncio.wait_for(
+                            wake.wait(), config["TWEET_STREAM_HEARTBEAT"]
+                        )
+                    except asyncio.TimeoutError:
+                        yield KEEPALIVE
+            finally:
+                feed.unsubscribe(subscription)
+
+        return StreamingResponse(
+            generate(), media_type=SSE_MIMETYPE, headers=SSE_HEADERS
+        )
+
+
+class UserMain(Endpoint):
+    # Signing up is how a key is obtained
+    @public
+    async def post(self, request):
+        payload = await read_payload(request, users.create_user_fields)
+        api_key, digest = generate_key()
+        user = User(
+            username=payload["username"], email=payload["email"], api_key=digest
+        )
+        async with self.session() as session:
+            session.add(user)
+            try:
+                await session.commit()
+            except IntegrityError:
+                raise APIError(400, f"Username {user.username} is taken") from None
+        return json_response({**marshal(user, users.model), "api_key": api_key})
+
+    async def get(self, request):
+        selection = parse_fields(request, users.fieldset)
+        async with self.session() as session:
+            if selection is not None:
+                rows = await session.run_sync(lambda s: selection.query(s).all())
+                return json_response([selection.render(row) for row in rows])
+            rows = (await session.execute(select(User))).scalars().all()
+        return json_response(marshal(rows, users.model))
+
+
+class UserById(Endpoint):
+    async def invalidate(self, user_id):
+        cache = self.state.cache
+        await run_in_threadpool(cache.delete, user_key(user_id))
+        await run_in_threadpool(cache.invalidate_tag, user_tweets_tag(user_id))
+        self.state.keys.invalidate_user(user_id)
+
+    async def get(self, request):
+        user_id = request.path_params["user_id"]
+        selection = parse_fields(request, users.fieldset)
+        if selection is not None:
+            return await self.get_fields(request, user_id, selection)
+
+        cached = await run_in_threadpool(self.state.cache.get, user_key(user_id))
+        if cached is not None:
+            return conditional_response(request, CachedBody.decode(cached))
+
+        async with self.session() as session:
+            user = await session.get(User, user_id)
+        if user is None:
+            raise APIError(404)
+        entry = CachedBody(user.etag, user.last_modified, None)
+        entry = entry._replace(body=dump_json(marshal(user, users.model)))
+        await run_in_threadpool(self.state.cache.set, user_key(user_id), entry.encode())
+        return conditional_response(request, entry)
+
+    async def get_fields(self, request, user_id, selection):
+        async with self.session() as session:
+            row = await session.run_sync(users.user_fields_row, selection, user_id)
+        if row is None:
+            raise APIError(404)
+        entry = CachedBody(
+            User.make_etag(user_id, row.version),
+            row.updated_at,
+            dump_json(selection.render(row)),
+        )
+        return conditional_response(request, entry)
+
+    async def patch(self, request):
+        user_id = request.path_params["user_id"]
+        payload = await read_payload(request, users.update_user_fields)
+        async with self.session() as session:
+            user = await session.get(User, user_id)
+            if user is None:
+                raise APIError(404)
+            check_if_match(request, user.etag)
+
+            user.username = payload.get("username", user.username)
+            user.email = payload.get("email", user.email)
+            try:
+                await session.commit()
+            except IntegrityError:
+                message = f"Username {payload['username']} is taken"
+                raise APIError(400, message) from None
+        await self.invalidate(user_id)
+
+        headers = validator_headers(user.etag, user.last_modified)
+        return json_response(marshal(user, users.model), headers=headers)
+
+    async def delete(self, request):
+        user_id = request.path_params["user_id"]
+        async with self.session() as session:
+            user = await session.get(User, user_id)
+            if user is None:
+                raise APIError(404)
+            check_if_match(request, user.etag)
+
+            # The database deletes the user's tweets and follows along
+            await session.delete(user)
+            events = await record(session, "user_deleted", user_deleted(user_id))
+            await session.commit()
+        self.state.changes.publish(events)
+        await self.invalidate(user_id)
+        return Response(status_code=204)
+
+
+def create_asgi_app(config=None):
+    from config import Config
+
+    config = config or Config
+    settings = {key: getattr(config, key) for key in dir(config) if key.isupper()}
+    check_auth_mode(settings)
+    check_settings(settings)
+
+    engine = create_async_engine(
+        async_database_uri(settings["SQLALCHEMY_DATABASE_URI"])
+    )
+    enforce_foreign_keys(engine.sync_engine)
+
+    @asynccontextmanager
+    async def lifespan(app):  # pylint: disable=unused-argument
+        yield
+        await engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route("/tweets", TweetMain),
+            Route("/tweets/stream", TweetStream),
+            Route("/tweets/{tweet_id:int}", TweetById),
+            Route("/users", UserMain),
+            Route("/users/{user_id:int}", UserById),
+        ],
+        exception_handlers={APIError: api_error},
+        middleware=(
+            [Middleware(CompressionMiddleware, config=settings)]
+            if settings["COMPRESSION_ENCODINGS"]
+            else []
+        ),
+        lifespan=lifespan,
+    )
+    app.state.config = settings
+    app.state.engine = engine
+    app.state.sessionmaker = sessionmaker(
+        engine, class_=AsyncSession, expire_on_commit=False
+    )
+    app.state.cache = make_cache(settings)
+    app.state.timelines = make_timeline_store(settings)
+    app.state.changes = make_change_feed(settings)
+    app.state.keys = KeyIndex(
+        None, settings["API_KEY_INDEX_MAX_ENTRIES"], settings["API_KEY_INDEX_TTL"]
+    )
+    app.state.rate_limiter = make_rate_limiter(settings)
+    return app
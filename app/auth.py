@@ -0,0 +1,364 @@
+# pylint: disable=missing-docstring
+
+"""
+API key authentication and per-key rate limiting.
+
+Requests carry their user's API key in the X-API-Key header. Keys are made by
+the server (`generate_key`) and shown once, in the response to POST /users or
+POST /users/<id>/key; `users.api_key` holds their SHA-256 digests, unique, never
+the keys themselves. The X-Admin-Key header, holding ADMIN_API_KEY, stands for
+any user's key where one is required whatever AUTH_MODE.
+Keys are resolved to a user id through an in-process index, so only the first
+request with a key (per worker, per API_KEY_INDEX_TTL) queries the database.
+
+Every authenticated request then takes a token from its user's bucket: tokens
+refill at RATE_LIMIT_RATE per second up to RATE_LIMIT_BURST. With the "redis"
+backend the buckets are shared, so the limit holds across gunicorn workers.
+"""
+
+import hashlib
+import hmac
+import math
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, request
+from flask_restx import abort
+from sqlalchemy import select
+from werkzeug.exceptions import TooManyRequests
+
+API_KEY_HEADER = "X-API-Key"
+ADMIN_KEY_HEADER = "X-Admin-Key"
+AUTH_MODES = ("off", "writes", "all")
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def hash_key(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def generate_key():
+    """A new API key, and the digest to store in users.api_key"""
+    api_key = secrets.token_urlsafe(24)
+    return api_key, hash_key(api_key)
+
+
+def user_id_query(api_key):
+    from app.models import User
+
+    # The digest is unique, so there is one user at most
+    return select(User.id).where(User.api_key == hash_key(api_key))
+
+
+def find_user_id(api_key):
+    """Id of the user owning `api_key`, or None"""
+    from app import db
+
+    return db.session.scalar(user_id_query(api_key))
+
+
+def check_auth_mode(config):
+    if config["AUTH_MODE"] not in AUTH_MODES:
+        raise ValueError(f"Unknown AUTH_MODE {config['AUTH_MODE']!r}")
+
+
+def needs_key(config, method):
+    mode = config["AUTH_MODE"]
+    return not (mode == "off" or (mode == "writes" and method in SAFE_METHODS))
+
+
+def retry_after(limiter, tokens):
+    return math.ceil((1 - tokens) / limiter.rate)
+
+
+class KeyIndex:
+    """
+    LRU index of API key digests to user ids, each kept for `ttl` seconds.
+
+    Unknown keys are remembered too, for `miss_ttl` seconds, so retrying a bad
+    key doesn't reach the database either. Entries of updated or deleted users
+    are dropped with `invalidate_user`; other workers drop theirs within `ttl`.
+    """
+
+    def __init__(self, lookup, max_entries=10000, ttl=60, miss_ttl=5):
+        self.lookup = lookup
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()  # digest -> (expires_at, user_id)
+        self._users = {}  # user_id -> set of digests
+        self._lock = threading.Lock()
+
+    def resolve(self, api_key):
+        digest = hash_key(api_key)
+        found, user_id = self.cached(digest)
+        if found:
+            return user_id
+        # Looked up outside of the lock, which other requests need meanwhile
+        user_id = self.lookup(api_key)
+        self.remember(digest, user_id)
+        return user_id
+
+    async def resolve_async(self, api_key, lookup):
+        """`resolve`, looking keys up with the coroutine function `lookup`"""
+        digest = hash_key(api_key)
+        found, user_id = self.cached(digest)
+        if found:
+            return user_id
+        user_id = await lookup(api_key)
+        self.remember(digest, user_id)
+        return user_id
+
+    def cached(self, digest):
+        """`(found, user_id)` for `digest`, counting the hit or miss"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+        return False, None
+
+    def remember(self, digest, user_id):
+        ttl = self.ttl if user_id is not None else self.miss_ttl
+        with self._lock:
+            self._remove(digest)
+            self._entries[digest] = (time.monotonic() + ttl, user_id)
+            if user_id is not None:
+                self._users.setdefault(user_id, set()).add(digest)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def forget(self, *api_keys):
+        """Drop `api_keys`, e.g. remembered as unknown before their user existed"""
+        with self._lock:
+            for api_key in api_keys:
+                self._remove(hash_key(api_key))
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for digest in list(self._users.get(user_id, ())):
+                self._remove(digest)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, digest):
+        entry = self._entries.pop(digest, None)
+        if entry is None or entry[1] is None:
+            return
+        digests = self._users.get(entry[1])
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._users[entry[1]]
+
+
+class MemoryRateLimiter:
+    """Token buckets kept in process memory, so each worker enforces its own"""
+
+    def __init__(self, rate, burst, max_buckets=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_buckets = max_buckets
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """(allowed, tokens left) after taking one token from `key`'s bucket"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._prune(now)
+        return allowed, tokens
+
+    def _prune(self, now):
+        # Buckets that have refilled since are the same as missing ones
+        full = self.burst / self.rate
+        for key, (_, updated_at) in list(self._buckets.items()):
+            if now - updated_at >= full:
+                del self._buckets[key]
+
+
+# KEYS[1]: bucket, ARGV: rate, burst. Redis' own clock is used, so every worker
+# sees the same time. Lua numbers are returned as integers, hence the tostring.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call("TIME")
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisRateLimiter:
+    """Token buckets shared by every worker, updated atomically by a Lua script"""
+
+    def __init__(self, client, rate, burst, prefix="twitter-api:"):
+        self.rate = rate
+        self.burst = burst
+        self.prefix = prefix
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key):
+        allowed, tokens = self.script(
+            keys=[f"{self.prefix}ratelimit:{key}"], args=[self.rate, self.burst]
+        )
+        return bool(allowed), float(tokens)
+
+
+def make_rate_limiter(config):
+    """Build the limiter selected by RATE_LIMIT_BACKEND, or None if disabled"""
+    rate, burst = config["RATE_LIMIT_RATE"], config["RATE_LIMIT_BURST"]
+    if not rate:
+        return None
+    backend = config["RATE_LIMIT_BACKEND"]
+    if backend == "memory":
+        return MemoryRateLimiter(rate, burst)
+    if backend == "redis":
+        import redis
+
+        client = redis.Redis.from_url(config["RATE_LIMIT_REDIS_URL"])
+        return RedisRateLimiter(client, rate, burst)
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND {backend!r}")
+
+
+def public(method):
+    """Mark a Resource method as open to requests without an API key"""
+    method.public = True
+    return method
+
+
+def require_api_key(view):
+    """Namespace decorator applying AUTH_MODE to every method not marked `public`"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        handler = getattr(view.view_class, request.method.lower(), None)
+        if not getattr(handler, "public", False):
+            authenticate()
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def authenticated(view):
+    """
+    Decorator applying AUTH_MODE to a plain Flask view, like require_api_key to
+    Resources; X-Admin-Key lets requests through too
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin():
+            authenticate()
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def authenticate():
+    """
+    Resolve the request's API key into `g.user_id` and take a rate limit token.
+
+    Aborts with 401 for a missing or unknown key and 429 once the key's bucket
+    is empty. Does nothing for requests AUTH_MODE leaves open.
+    """
+    if not needs_key(current_app.config, request.method):
+        return
+
+    take_token(resolve_user_id())
+
+
+def resolve_user_id():
+    """The user id of the request's API key; aborts with 401 without a valid one"""
+    api_key = request.headers.get(API_KEY_HEADER, "")
+    user_id = current_app.extensions["auth"].resolve(api_key) if api_key else None
+    if user_id is None:
+        abort(401, f"A valid {API_KEY_HEADER} header is required")
+    g.user_id = user_id
+    return user_id
+
+
+def is_admin():
+    admin_key = current_app.config["ADMIN_API_KEY"]
+    header = request.headers.get(ADMIN_KEY_HEADER, "")
+    return bool(admin_key) and hmac.compare_digest(header, admin_key)
+
+
+def authenticate_owner(user_id):
+    """
+    Let through requests with `user_id`'s own API key, or with ADMIN_API_KEY,
+    whatever AUTH_MODE. Aborts with 401 without either and 403 for another
+    user's key.
+    """
+    if is_admin():
+        return
+    if resolve_user_id() != user_id:
+        abort(403, f"Only user {user_id} or an admin can do this")
+    take_token(user_id)
+
+
+def take_token(user_id):
+    limiter = current_app.extensions["rate_limiter"]
+    if limiter is None:
+        return
+    allowed, tokens = limiter.take(f"user:{user_id}")
+    g.rate_limit_remaining = int(tokens)
+    if not allowed:
+        raise TooManyRequests(
+            "API key rate limit exceeded", retry_after=retry_after(limiter, tokens)
+        )
+
+
+def rate_limit_headers(response):
+    if "rate_limit_remaining" in g:
+        limiter = current_app.extensions["rate_limiter"]
+        response.headers["X-RateLimit-Limit"] = str(limiter.burst)
+        response.headers["X-RateLimit-Remaining"] = str(g.rate_limit_remaining)
+    return response
+
+
+class Auth:
+    """
+    Flask extension holding the API key index and the rate limiter.
+
+    Attribute access is forwarded to the key index of the current app, so
+    `auth.invalidate_user(user_id)` works like `cache.delete(key)`.
+    """
+
+    def init_app(self, app):
+        config = app.config
+        check_auth_mode(config)
+        app.extensions["auth"] = KeyIndex(
+            find_user_id,
+            config["API_KEY_INDEX_MAX_ENTRIES"],
+            config["API_KEY_INDEX_TTL"],
+        )
+        app.extensions["rate_limiter"] = make_rate_limiter(config)
+        app.after_request(rate_limit_headers)
+
+    def __getattr__(self, name):
+        return getattr(current_app.extensions["auth"], name)
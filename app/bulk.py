@@ -0,0 +1,38 @@
+# pylint: disable=missing-docstring
+
+import json
+from itertools import islice
+
+from app.streaming import NDJSON_MIMETYPE
+
+
+def iter_json_items(req):
+    """
+    Yield the items of a JSON array request body, or the lines of an NDJSON one.
+
+    NDJSON bodies are read line by line from the WSGI stream, so they are never
+    held in memory whole. Lines that are not valid JSON are yielded as None.
+    """
+    if req.mimetype != NDJSON_MIMETYPE:
+        payload = req.get_json()
+        if not isinstance(payload, list):
+            raise ValueError("Expected a JSON array or an NDJSON body")
+        yield from payload
+        return
+
+    for line in req.stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def chunked(iterable, size):
+    """Split `iterable` into lists of at most `size` items"""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
@@ -0,0 +1,193 @@
+# pylint: disable=missing-docstring
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from app.metrics import observe_serialization
+
+try:
+    import orjson
+except ImportError:  # optional, see JSON_ENCODER
+    orjson = None
+
+
+def tweet_key(tweet_id):
+    return f"tweet:{tweet_id}"
+
+
+def user_key(user_id):
+    return f"user:{user_id}"
+
+
+def user_tweets_tag(user_id):
+    """Tag of every cached tweet that embeds this user"""
+    return f"user:{user_id}:tweets"
+
+
+class LRUCache:
+    """In-process LRU cache with a per-entry TTL and tag based invalidation"""
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key, raw=False):  # pylint: disable=unused-argument
+        # Values are returned as stored, so `raw` makes no difference here
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, tags=()):
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            for key in self._tags.pop(tag, ()):
+                self._remove(key)
+
+    def stats(self):
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCache:
+    """Cache backed by any client implementing the redis-py command methods"""
+
+    def __init__(self, client, ttl=300, prefix="twitter-api:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = self.misses = 0
+
+    def get(self, key, raw=False):
+        """The value under `key`, as bytes when `raw` and as text otherwise"""
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if raw:
+            return value
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value, tags=()):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+        for tag in tags:
+            tag_key = self.prefix + "tag:" + tag
+            self.client.sadd(tag_key, key)
+            self.client.expire(tag_key, self.ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def invalidate_tag(self, tag):
+        tag_key = self.prefix + "tag:" + tag
+        keys = self.client.smembers(tag_key)
+        keys = [key.decode() if isinstance(key, bytes) else key for key in keys]
+        self.client.delete(tag_key, *[self.prefix + key for key in keys])
+
+    def stats(self):
+        # Evictions happen inside Redis, so only the server knows about them
+        evictions = self.client.info("stats").get("evicted_keys")
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": evictions,
+        }
+
+
+def make_cache(config):
+    """Build the cache backend selected by CACHE_BACKEND in `config`"""
+    backend = config["CACHE_BACKEND"]
+    if backend == "memory":
+        return LRUCache(config["CACHE_MAX_ENTRIES"], config["CACHE_TTL"])
+    if backend == "redis":
+        import redis
+
+        client = redis.Redis.from_url(config["CACHE_REDIS_URL"])
+        return RedisCache(client, config["CACHE_TTL"])
+    raise ValueError(f"Unknown CACHE_BACKEND {backend!r}")
+
+
+class Cache:
+    """
+    Flask extension holding the configured cache backend.
+
+    Attribute access is forwarded to the backend of the current app, the same way
+    `db.session` resolves to the current app's session.
+    """
+
+    def init_app(self, app):
+        app.extensions["cache"] = make_cache(app.config)
+
+    def __getattr__(self, name):
+        return getattr(current_app.extensions["cache"], name)
+
+
+def dump_json(data):
+    """
+    Encode `data` exactly like flask-restx's JSON representation does.
+
+    With JSON_ENCODER = "orjson" (and orjson installed) the output is the same
+    JSON, but compact and UTF-8 rather than ASCII-escaped; RESTX_JSON settings
+    and debug indentation still go through the stdlib encoder.
+    """
+    started = time.perf_counter()
+    settings = dict(current_app.config.get("RESTX_JSON", {}))
+    if current_app.debug:
+        settings.setdefault("indent", 4)
+    if current_app.config["JSON_ENCODER"] == "orjson" and orjson and not settings:
+        body = orjson.dumps(data).decode() + "\n"
+    else:
+        body = json.dumps(data, **settings) + "\n"
+    observe_serialization("json", started)
+    return body
+
+
+def json_response(body, code=200):
+    return current_app.response_class(body, code, mimetype="application/json")
@@ -0,0 +1,145 @@
+# pylint: disable=missing-docstring
+
+"""
+The log of changes to tweets, which GET /tweets/stream catches up from.
+
+Every create, update and delete of a tweet adds a row to `tweet_changes` in the
+writing transaction, and that row's id is the event id of the change. A user's
+tweets go with them by ON DELETE CASCADE, so deleting a user adds a single
+"user_deleted" change instead, telling subscribers to drop all of that user's
+tweets. On PostgreSQL a trigger NOTIFYs each row as it is committed (see
+app.changes). Rows older than TWEET_CHANGES_RETENTION_HOURS are deleted by
+`manage.py prune_changes`, which records the last id it deleted in
+`tweet_change_prunes`.
+
+Ids are assigned when inserting but visible once committed, so a change may
+appear after one with a greater id. Catching up after `since` only goes as far
+as the first change younger than TWEET_STREAM_SETTLE_SECONDS: a client's
+cursor never moves past a change that could still be committing.
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+
+from app.models import TweetChange, TweetChangePrune
+
+# Changes per INSERT when recording many, well under the bind parameter limits
+RECORD_CHUNK_SIZE = 1000
+
+
+class StreamGap(Exception):
+    """The changes a client asked to catch up on are no longer all available"""
+
+
+def change_insert(action, rows):
+    """
+    INSERT of changes for `rows`, [(tweet_id, representation)], returning
+    their events. Works with sync and async sessions alike.
+    """
+    values = [
+        {"tweet_id": tweet_id, "action": action, "payload": json.dumps(data)}
+        for tweet_id, data in rows
+    ]
+    return (
+        insert(TweetChange)
+        .values(values)
+        .returning(TweetChange.id, TweetChange.action, TweetChange.payload)
+    )
+
+
+def as_event(row):
+    return {"id": row.id, "action": row.action, "data": row.payload}
+
+
+def record(session, action, *rows):
+    """Add changes to the session's transaction; publish the events after commit"""
+    return [as_event(row) for row in session.execute(change_insert(action, rows))]
+
+
+def deleted_inserts(tweet_ids):
+    """INSERTs recording the deletion of `tweet_ids`, RECORD_CHUNK_SIZE at a time"""
+    for start in range(0, len(tweet_ids), RECORD_CHUNK_SIZE):
+        chunk = tweet_ids[start : start + RECORD_CHUNK_SIZE]
+        yield change_insert(
+            "deleted", [(tweet_id, {"id": tweet_id}) for tweet_id in chunk]
+        )
+
+
+def user_deleted(user_id):
+    """The change row of the deletion of a user, along with all their tweets"""
+    return None, {"user_id": user_id}
+
+
+def record_deleted(session, tweet_ids):
+    """Add the deletion of `tweet_ids` to the session's transaction"""
+    return [
+        as_event(row)
+        for statement in deleted_inserts(tweet_ids)
+        for row in session.execute(statement)
+    ]
+
+
+def settle_horizon(seconds):
+    """The `settled_before` of catching up now, None when not waiting"""
+    return datetime.utcnow() - timedelta(seconds=seconds) if seconds else None
+
+
+def settled(since, settled_before):
+    """
+    Clause of the changes after `since`, up to the first one created at or after
+    `settled_before`; all of them when it is None
+    """
+    if settled_before is None:
+        return TweetChange.id > since
+    pending = (
+        select(func.min(TweetChange.id))
+        .where(TweetChange.id > since, TweetChange.created_at >= settled_before)
+        .scalar_subquery()
+    )
+    return and_(
+        TweetChange.id > since, or_(pending.is_(None), TweetChange.id < pending)
+    )
+
+
+def catch_up_query(since, limit, settled_before=None):
+    # One more than the limit, to tell when the client is too far behind
+    return (
+        select(TweetChange.id, TweetChange.action, TweetChange.payload)
+        .where(settled(since, settled_before))
+        .order_by(TweetChange.id)
+        .limit(limit + 1)
+    )
+
+
+def latest_query(settled_before=None):
+    return select(func.max(TweetChange.id)).where(settled(0, settled_before))
+
+
+def pruned_query():
+    """The last id deleted by `prune`, None if none was"""
+    return select(func.max(TweetChangePrune.through_id))
+
+
+def check_catch_up(since, pruned, events, limit):
+    """Raise StreamGap unless `events` are every change after `since`"""
+    if pruned is not None and since < pruned:
+        raise StreamGap(f"Changes after {since} were pruned, reload GET /tweets")
+    if len(events) > limit:
+        raise StreamGap(f"More than {limit} changes after {since}, reload GET /tweets")
+
+
+def prune(session, before):
+    """
+    Delete the changes up to the last one created before `before`, recording
+    that id for check_catch_up. Returns how many were deleted.
+    """
+    through = session.scalar(
+        select(func.max(TweetChange.id)).where(TweetChange.created_at < before)
+    )
+    if through is None:
+        return 0
+    result = session.execute(delete(TweetChange).where(TweetChange.id <= through))
+    session.add(TweetChangePrune(through_id=through, deleted=result.rowcount))
+    return result.rowcount
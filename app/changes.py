@@ -0,0 +1,259 @@
+# pylint: disable=missing-docstring
+
+"""
+Server-Sent Events of the changes to tweets, for GET /tweets/stream.
+
+A client reconnecting with `Last-Event-ID` (or `?since=`) catches up from the
+tweet_changes table first (see app.change_log), then gets changes as they are
+committed:
+
+- on PostgreSQL a trigger NOTIFYs each change, and one LISTEN connection per
+  process hands the notifications to that process's subscribers;
+- elsewhere the handlers publish their changes in-process after committing, so
+  subscribers only see the writes of their own process.
+
+Each subscriber buffers at most TWEET_STREAM_BUFFER events. One that falls
+further behind is disconnected rather than buffered without bound, and catches
+up from the table when it reconnects.
+"""
+
+import json
+import os
+import select as io_select
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+CHANNEL = "tweet_changes"
+SSE_MIMETYPE = "text/event-stream"
+# Keep proxies from buffering the stream or caching it
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# Sent on idle streams, so that proxies don't time them out
+KEEPALIVE = ": keepalive\n\n"
+
+
+def parse_since(since, last_event_id):
+    """The event id to resume after, None for new changes only"""
+    value = since if since is not None else last_event_id
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {value!r}") from None
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['action']}\ndata: {event['data']}\n\n"
+
+
+def unseen(events, seen):
+    """
+    `events` less those whose id is in `seen`, the ids sent while catching up.
+
+    Ids are compared as a set rather than against the last one sent: ids are
+    assigned when inserting but notified when committing, so a change may
+    arrive after one with a greater id.
+    """
+    for event in events:
+        if event["id"] in seen:
+            # Each change is notified once
+            seen.discard(event["id"])
+        else:
+            yield event
+
+
+def cursor_field(event_id):
+    # Sets the client's Last-Event-ID without dispatching an event
+    return f"id: {event_id}\n\n"
+
+
+def retry_field(config):
+    # EventSource clients reconnect after this long, with Last-Event-ID
+    return f"retry: {int(config['TWEET_STREAM_RETRY_MS'])}\n\n"
+
+
+class Subscription:
+    """
+    The bounded buffer of one stream's events.
+
+    `wake()` is called after each new event, from whichever thread delivers
+    it, so that a thread or an event loop can wait for events its own way.
+    """
+
+    def __init__(self, max_size, wake):
+        self.max_size = max_size
+        self.wake = wake
+        self.events = deque()
+        self.closed = False
+
+    def put(self, event):
+        if len(self.events) >= self.max_size:
+            # Behind by a full buffer: the client catches up on reconnecting
+            self.close()
+            return
+        self.events.append(event)
+        self.wake()
+
+    def close(self):
+        self.closed = True
+        self.wake()
+
+    def drain(self):
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+
+class ChangeFeed:
+    """
+    Subscribers of one process, and where their events come from.
+
+    With a `listener` the events come from PostgreSQL notifications, and
+    `publish` is a no-op: the committed changes will be notified.
+    """
+
+    def __init__(self, buffer_size, listener=None):
+        self.buffer_size = buffer_size
+        self.listener = listener
+        self.delivered = self.disconnected = 0
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._listener_pid = None
+
+    def subscribe(self, wake):
+        self._start_listener()
+        subscription = Subscription(self.buffer_size, wake)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            if subscription.closed:
+                self.disconnected += 1
+
+    def publish(self, events):
+        if self.listener is None:
+            self.deliver(events)
+
+    def deliver(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.delivered += len(events)
+        for subscription in subscribers:
+            for event in events:
+                if not subscription.closed:
+                    subscription.put(event)
+
+    def disconnect_all(self):
+        """Close every stream, e.g. after notifications may have been missed"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.close()
+
+    def _start_listener(self):
+        # Lazily, so that each gunicorn worker listens after forking
+        if self.listener is None:
+            return
+        with self._lock:
+            if self._listener_pid != os.getpid():
+                threading.Thread(
+                    target=self.listener.run,
+                    args=(self,),
+                    name="tweet-change-listener",
+                    daemon=True,
+                ).start()
+                self._listener_pid = os.getpid()
+        # Changes committed between a catch-up and LISTEN would be lost
+        self.listener.listening.wait(self.listener.poll_interval)
+
+    def stats(self):
+        return {
+            "backend": "postgres" if self.listener is not None else "memory",
+            "subscribers": len(self._subscribers),
+            "delivered": self.delivered,
+            # Streams closed early: a full buffer behind, or notifications missed
+            "disconnected": self.disconnected,
+        }
+
+
+class PostgresListener:
+    """LISTENs on the tweet_changes channel through a connection of its own"""
+
+    def __init__(self, url, poll_interval=5):
+        # Outside of the pool, which this connection would hold forever
+        self.engine = create_engine(url, poolclass=NullPool)
+        self.poll_interval = poll_interval
+        self.listening = threading.Event()
+
+    def run(self, feed):
+        while True:
+            try:
+                self.listen(feed)
+            except Exception:  # pylint: disable=broad-except
+                self.listening.clear()
+                time.sleep(1)
+            # Notifications sent while disconnected are lost, so every stream
+            # is closed and its client catches up from the table
+            feed.disconnect_all()
+
+    def listen(self, feed):
+        connection = self.engine.raw_connection()
+        try:
+            dbapi_connection = connection.driver_connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            self.listening.set()
+            while True:
+                readable, _, _ = io_select.select(
+                    [dbapi_connection], [], [], self.poll_interval
+                )
+                if not readable:
+                    continue
+                dbapi_connection.poll()
+                events = []
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    events.append(json.loads(notify.payload))
+                feed.deliver(events)
+        finally:
+            connection.close()
+
+
+def make_change_feed(config):
+    """Build the change feed selected by TWEET_STREAM_BACKEND in `config`"""
+    backend = config["TWEET_STREAM_BACKEND"]
+    url = config["SQLALCHEMY_DATABASE_URI"]
+    if backend == "auto":
+        is_postgres = make_url(url).get_backend_name() == "postgresql"
+        backend = "postgres" if is_postgres else "memory"
+    if backend == "memory":
+        return ChangeFeed(config["TWEET_STREAM_BUFFER"])
+    if backend == "postgres":
+        return ChangeFeed(config["TWEET_STREAM_BUFFER"], PostgresListener(url))
+    raise ValueError(f"Unknown TWEET_STREAM_BACKEND {backend!r}")
+
+
+class Changes:
+    """
+    Flask extension holding the app's change feed.
+
+    Attribute access is forwarded to the feed of the current app, so handlers
+    call `changes.publish(events)` after committing.
+    """
+
+    def init_app(self, app):
+        app.extensions["changes"] = make_change_feed(app.config)
+
+    def __getattr__(self, name):
+        return getattr(current_app.extensions["changes"], name)
@@ -0,0 +1,143 @@
+# pylint: disable=missing-docstring
+
+"""
+Content-negotiated gzip, brotli and zstd response compression.
+
+gzip is always available; brotli and zstd are used when the `brotli` and
+`zstandard` packages are installed. A strong ETag names one exact body, so
+compressed responses get theirs suffixed with the encoding, e.g. "3.2-gzip";
+app.conditional strips the suffix when comparing If-Match and If-None-Match, so
+that the ETag of any encoding validates the version. `Vary: Accept-Encoding`
+keeps shared caches from mixing encodings up.
+"""
+
+import gzip
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson"}
+# ETag suffixes stripped, including those of codecs not installed here
+ENCODINGS = {"gzip", "br", "zstd"}
+
+
+def _gzip(data, level):
+    # mtime=0 keeps the output, and so precompressed entries, deterministic
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+# Content-Encoding -> (compress(data, level), config key of its level)
+CODECS = {"gzip": (_gzip, "COMPRESSION_GZIP_LEVEL")}
+if brotli is not None:
+    CODECS["br"] = (_brotli, "COMPRESSION_BR_LEVEL")
+if zstandard is not None:
+    CODECS["zstd"] = (_zstd, "COMPRESSION_ZSTD_LEVEL")
+
+
+def available_encodings(config):
+    """COMPRESSION_ENCODINGS that can be produced here, most preferred first"""
+    return [
+        encoding.strip()
+        for encoding in config["COMPRESSION_ENCODINGS"].split(",")
+        if encoding.strip() in CODECS
+    ]
+
+
+def best_encoding(config, size, accept_encodings):
+    """The encoding to send a `size` bytes body in, or None to send it as is"""
+    if size < config["COMPRESSION_MIN_SIZE"]:
+        return None
+    return accept_encodings.best_match(available_encodings(config))
+
+
+def negotiate(size):
+    return best_encoding(current_app.config, size, request.accept_encodings)
+
+
+def compress(data, encoding, config=None):
+    function, level_key = CODECS[encoding]
+    return function(data, (config or current_app.config)[level_key])
+
+
+def variant_key(key, etag, encoding):
+    # The ETag makes variants of replaced entries unreachable; they age out
+    return f"{key}:{etag}:{encoding}"
+
+
+def compressed_body(data, encoding, key, etag):
+    """`data` compressed, compressed once per cache entry version and encoding"""
+    cache = current_app.extensions["cache"]
+    variant = variant_key(key, etag, encoding)
+    compressed = cache.get(variant, raw=True)
+    if compressed is None:
+        compressed = compress(data, encoding)
+        cache.set(variant, compressed)
+    return compressed
+
+
+def encoded_etag(etag, encoding):
+    return f"{etag}-{encoding}"
+
+
+def strip_encoding(etag):
+    """The ETag of the uncompressed body for the ETag of a compressed one"""
+    base, separator, encoding = etag.rpartition("-")
+    return base if separator and encoding in ENCODINGS else etag
+
+
+def set_encoding(response, encoding, compressed):
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag(encoded_etag(etag, encoding), weak)
+
+
+class Compression:
+    """
+    Flask extension compressing JSON responses larger than COMPRESSION_MIN_SIZE.
+
+    Bodies served from the response cache are compressed beforehand by
+    `conditional_response`, which keeps their compressed variants in the cache.
+    """
+
+    def init_app(self, app):
+        if app.config["COMPRESSION_ENCODINGS"]:
+            app.after_request(self.after_request)
+
+    @staticmethod
+    def after_request(response):
+        if (
+            response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+
+        # Whatever the outcome, the response depended on Accept-Encoding
+        response.vary.add("Accept-Encoding")
+        data = response.get_data()
+        encoding = negotiate(len(data))
+        if encoding is not None:
+            set_encoding(response, encoding, compress(data, encoding))
+        return response
@@ -0,0 +1,109 @@
+# pylint: disable=missing-docstring
+
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from flask import abort, current_app, request
+from sqlalchemy import exists, false, or_, true
+from werkzeug.http import http_date, quote_etag
+
+from app.cache import json_response
+from app.compression import compressed_body, negotiate, set_encoding, strip_encoding
+
+
+def http_time(value):
+    """HTTP dates are whole seconds in UTC; model timestamps are naive UTC"""
+    return value.replace(microsecond=0, tzinfo=timezone.utc)
+
+
+class CachedBody(namedtuple("CachedBody", ["etag", "last_modified", "body"])):
+    """A serialized resource along with the validators of the row it came from"""
+
+    def encode(self):
+        last_modified = self.last_modified.isoformat() if self.last_modified else ""
+        return f"{self.etag}\n{last_modified}\n{self.body}"
+
+    @classmethod
+    def decode(cls, value):
+        etag, last_modified, body = value.split("\n", 2)
+        last_modified = datetime.fromisoformat(last_modified) if last_modified else None
+        return cls(etag, last_modified, body)
+
+
+def matches(etags, etag):
+    """Whether If-Match or If-None-Match `etags` name `etag`, in any encoding"""
+    return etags.star_tag or etag in {strip_encoding(tag) for tag in etags}
+
+
+def is_fresh(etag, last_modified, if_none_match, if_modified_since):
+    """Whether a client sending these conditional headers holds this version"""
+    if if_none_match:
+        return matches(if_none_match, etag)
+    if if_modified_since and last_modified is not None:
+        return http_time(last_modified) <= if_modified_since
+    return False
+
+
+def not_modified(etag, last_modified):
+    """Whether the request's If-None-Match / If-Modified-Since allow a 304"""
+    return is_fresh(
+        etag, last_modified, request.if_none_match, request.if_modified_since
+    )
+
+
+def check_if_match(etag):
+    """Abort with 412 when If-Match is sent and doesn't match the current ETag"""
+    if request.if_match and not matches(request.if_match, etag):
+        abort(412)
+
+
+def if_match_clause(etag_clause):
+    """
+    check_if_match as a WHERE clause, for single-statement UPDATE and DELETE.
+
+    `etag_clause(etag)` is the condition for a row to have that ETag.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return true()
+    etags = {strip_encoding(etag) for etag in request.if_match}
+    return or_(false(), *(etag_clause(etag) for etag in etags))
+
+
+def abort_unmatched(session, column, value):
+    """
+    Abort after a write guarded by if_match_clause matched no row: with 412
+    when the row exists, which only takes a query if If-Match was sent, else 404.
+    """
+    if request.if_match and session.query(exists().where(column == value)).scalar():
+        abort(412)
+    abort(404)
+
+
+def validator_headers(etag, last_modified):
+    headers = {"ETag": quote_etag(etag)}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(http_time(last_modified))
+    return headers
+
+
+def conditional_response(entry, key=None):
+    """
+    Serve `entry`, or an empty 304 when the client already holds this version.
+
+    Entries cached under `key` get their compressed variants cached alongside.
+    """
+    if not_modified(entry.etag, entry.last_modified):
+        response = current_app.response_class(status=304)
+        response.headers.update(validator_headers(entry.etag, entry.last_modified))
+        return response
+
+    response = json_response(entry.body)
+    # Before compressing, which suffixes the ETag
+    response.headers.update(validator_headers(entry.etag, entry.last_modified))
+    encoding = None
+    if key is not None and current_app.config["COMPRESSION_ENCODINGS"]:
+        encoding = negotiate(response.content_length)
+    if encoding is not None:
+        compressed = compressed_body(response.get_data(), encoding, key, entry.etag)
+        set_encoding(response, encoding, compressed)
+    return response
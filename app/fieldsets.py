@@ -0,0 +1,131 @@
+# pylint: disable=missing-docstring
+
+"""
+Sparse fieldsets: `?fields=id,text,user.username`.
+
+The requested fields are selected as plain columns, so no ORM instance is built
+and unrequested columns (and joins) are never read. Rows are rendered straight
+to dicts with the fields' formatting from the API model, in the model's order.
+"""
+
+from flask_restx import reqparse
+from sqlalchemy.sql.elements import Label
+
+
+class Selection:
+    """The fields picked from a Fieldset by one request"""
+
+    def __init__(self, fieldset, picked):
+        self.fieldset = fieldset
+        self.picked = picked  # key -> tuple of nested keys, or None
+
+    @property
+    def joins(self):
+        return [self.fieldset.nested[key][1] for key in self.picked if self.picked[key]]
+
+    def columns(self, *extra):
+        """
+        Labelled columns to select, plus `extra` ones needed by the route.
+
+        Extra columns are labelled with their key unless already labelled.
+        """
+        columns = {}
+        for key, nested in self.picked.items():
+            if nested:
+                subcolumns = self.fieldset.nested[key][0]
+                for subkey in nested:
+                    label = f"{key}__{subkey}"
+                    columns[label] = subcolumns[subkey].label(label)
+            else:
+                columns[key] = self.fieldset.columns[key].label(key)
+        for column in extra:
+            if not isinstance(column, Label):
+                column = column.label(column.key)
+            columns.setdefault(column.name, column)
+        return list(columns.values())
+
+    def query(self, session, *extra, joins=()):
+        """Column-only query over the fieldset's table, joined as needed"""
+        query = session.query(*self.columns(*extra)).select_from(self.fieldset.table)
+        joined = []
+        for join in self.joins + list(joins):
+            if not any(join is other for other in joined):
+                query = query.join(join)
+                joined.append(join)
+        return query
+
+    def render(self, row):
+        values = row._mapping
+        out = {}
+        for key, nested in self.picked.items():
+            if nested:
+                out[key] = {subkey: values[f"{key}__{subkey}"] for subkey in nested}
+            else:
+                out[key] = self.fieldset.fields[key].output(key, values)
+        return out
+
+
+class Fieldset:
+    """
+    Fields of an API model that can be selected, and the columns behind them.
+
+    `nested` maps a field rendered as an object (like a tweet's user) to its
+    `(columns, join)`; selecting it alone selects all of its columns.
+    """
+
+    def __init__(self, model, table, columns, nested=None):
+        self.model = model
+        # api.model values may be field classes rather than instances
+        self.fields = {
+            key: field() if isinstance(field, type) else field
+            for key, field in model.items()
+        }
+        self.table = table
+        self.columns = columns
+        self.nested = nested or {}
+
+    @property
+    def names(self):
+        names = []
+        for key in self.model:
+            names.append(key)
+            if key in self.nested:
+                names.extend(f"{key}.{subkey}" for subkey in self.nested[key][0])
+        return names
+
+    def parse(self, value):
+        """Selection for a `fields` argument, None when absent; ValueError if invalid"""
+        if value is None:
+            return None
+        requested = {name.strip() for name in value.split(",") if name.strip()}
+        unknown = requested - set(self.names)
+        if not requested or unknown:
+            raise ValueError(
+                f"Unknown field(s) {', '.join(sorted(unknown)) or repr(value)}; "
+                f"choose from {', '.join(self.names)}"
+            )
+
+        picked = {}
+        for key in self.model:
+            if key in requested:
+                picked[key] = tuple(self.nested[key][0]) if key in self.nested else None
+            elif key in self.nested:
+                subkeys = tuple(
+                    subkey
+                    for subkey in self.nested[key][0]
+                    if f"{key}.{subkey}" in requested
+                )
+                if subkeys:
+                    picked[key] = subkeys
+        return Selection(self, picked)
+
+
+def with_fields(parser, fieldset):
+    """`parser` plus the `fields` argument of `fieldset`"""
+    parser = parser.copy() if parser is not None else reqparse.RequestParser()
+    parser.add_argument(
+        "fields",
+        location="args",
+        help=f"Comma-separated fields to return: {', '.join(fieldset.names)}",
+    )
+    return parser
@@ -0,0 +1,248 @@
+# pylint: disable=missing-docstring
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy.exc import (
+    DisconnectionError,
+    InterfaceError,
+    OperationalError,
+    SQLAlchemyError,
+)
+
+from app import db
+
+
+class QueueFull(Exception):
+    pass
+
+
+def is_transient(error):
+    """Whether `error` is about the database rather than the rows written"""
+    return isinstance(
+        error, (OperationalError, InterfaceError, DisconnectionError)
+    ) or getattr(error, "connection_invalidated", False)
+
+
+class DurableQueue:
+    """
+    File-backed FIFO shared by every worker process on the host.
+
+    Items are claimed with a lease rather than removed, and only deleted once
+    written, so a crashed writer's batch is picked up again after `lease` seconds.
+    """
+
+    def __init__(self, path, max_depth, lease=60):
+        self.path = path
+        self.max_depth = max_depth
+        self.lease = lease
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS queue ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, provisional_id TEXT, "
+                "payload TEXT, enqueued_at REAL, claimed_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letters ("
+                "provisional_id TEXT, payload TEXT, enqueued_at REAL, error TEXT)"
+            )
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def put(self, provisional_id, payload):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._depth(conn) >= self.max_depth:
+                raise QueueFull()
+            conn.execute(
+                "INSERT INTO queue (provisional_id, payload, enqueued_at) "
+                "VALUES (?, ?, ?)",
+                (provisional_id, json.dumps(payload), time.time()),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim(self, limit):
+        """Lease up to `limit` of the oldest items: [(seq, provisional_id, payload)]"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            items = conn.execute(
+                "SELECT seq, provisional_id, payload FROM queue "
+                "WHERE claimed_at IS NULL OR claimed_at < ? ORDER BY seq LIMIT ?",
+                (now - self.lease, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE queue SET claimed_at = ? WHERE seq = ?",
+                [(now, seq) for seq, _, _ in items],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return [(seq, pid, json.loads(payload)) for seq, pid, payload in items]
+
+    def ack(self, seqs, dead=()):
+        """Remove written items; `dead` is [(seq, error)] of items that never will be"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO dead_letters "
+                "SELECT provisional_id, payload, enqueued_at, ? "
+                "FROM queue WHERE seq = ?",
+                [(error, seq) for seq, error in dead],
+            )
+            conn.executemany(
+                "DELETE FROM queue WHERE seq = ?",
+                [(seq,) for seq in list(seqs) + [seq for seq, _ in dead]],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _depth(self, conn):
+        return conn.execute("SELECT count(*) FROM queue").fetchone()[0]
+
+    def stats(self):
+        conn = self._connect()
+        oldest = conn.execute("SELECT min(enqueued_at) FROM queue").fetchone()[0]
+        dead = conn.execute("SELECT count(*) FROM dead_letters").fetchone()[0]
+        return {
+            "depth": self._depth(conn),
+            "lag_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+            "dead_letters": dead,
+        }
+
+
+class BatchWriter(threading.Thread):
+    """
+    Drains a DurableQueue into the database, one transaction per batch.
+
+    `write(rows)` must insert and commit every row or raise; the rows of a
+    batch failing with a database error (a constraint, a value out of range...)
+    are then retried one by one, so that a single bad row only dead-letters
+    itself. Transient errors, like a lost connection, dead-letter nothing: the
+    unwritten rows are claimed again once their lease expires.
+
+    Rows are acked as soon as `write` returns, and only then is what it returned
+    handed to `publish`, e.g. to fan the rows out. A failure there is logged
+    rather than retried, as retrying would insert committed rows again.
+    """
+
+    def __init__(self, app, queue, write, publish=None):
+        super().__init__(name="tweet-batch-writer", daemon=True)
+        self.app = app
+        self.queue = queue
+        self.write = write
+        self.publish = publish
+        self.batch_size = app.config["INGEST_BATCH_SIZE"]
+        self.flush_interval = app.config["INGEST_FLUSH_INTERVAL"]
+        self.started_at = time.time()
+        self.written = self.failed = self.batches = 0
+        self.last_batch_ms = None
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                with self.app.app_context():
+                    count = self.flush()
+            except Exception:  # pylint: disable=broad-except
+                self.app.logger.exception("Tweet batch writer failed")
+                count = 0
+            # Keep draining while the queue is backed up
+            if count < self.batch_size:
+                self._stop_event.wait(self.flush_interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def flush(self):
+        items = self.queue.claim(self.batch_size)
+        if not items:
+            return 0
+
+        start = time.perf_counter()
+        written, dead = [], []
+        try:
+            written.append(self.write([payload for _, _, payload in items]))
+            self.queue.ack([seq for seq, _, _ in items])
+            done = len(items)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            if is_transient(e):
+                raise
+            done = 0
+            for seq, _, payload in items:
+                try:
+                    written.append(self.write([payload]))
+                except SQLAlchemyError as row_error:
+                    db.session.rollback()
+                    if is_transient(row_error):
+                        break
+                    dead.append((seq, str(getattr(row_error, "orig", row_error))))
+                    continue
+                self.queue.ack([seq])
+                done += 1
+            self.queue.ack([], dead)
+
+        self.last_batch_ms = round((time.perf_counter() - start) * 1000, 2)
+        self.written += done
+        self.failed += len(dead)
+        self.batches += 1
+        if self.publish is not None:
+            for result in written:
+                try:
+                    self.publish(result)
+                except Exception:  # pylint: disable=broad-except
+                    self.app.logger.exception("Publishing written tweets failed")
+        return len(items)
+
+    def stats(self):
+        uptime = time.time() - self.started_at
+        return {
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_batch_ms": self.last_batch_ms,
+            "rows_per_second": round(self.written / uptime, 1) if uptime else 0.0,
+        }
+
+
+_lock = threading.Lock()
+
+
+def ingest_queue(app, write, publish=None):
+    """
+    The app's durable queue, with its writer running in this process.
+
+    The writer is started lazily so that each gunicorn worker gets its own thread
+    after forking, rather than the master starting one that forks would lose.
+    """
+    with _lock:
+        state = app.extensions.get("ingest")
+        if state is None or state[0] != os.getpid():
+            queue = DurableQueue(
+                app.config["INGEST_QUEUE_PATH"], app.config["INGEST_MAX_DEPTH"]
+            )
+            writer = BatchWriter(app, queue, write, publish)
+            writer.start()
+            state = app.extensions["ingest"] = (os.getpid(), queue, writer)
+        return state[1], state[2]
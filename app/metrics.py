@@ -0,0 +1,201 @@
+# pylint: disable=missing-docstring
+
+"""
+Prometheus metrics for the WSGI app, served at /metrics.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR to an empty directory before the
+workers start: every worker then writes its samples to memory-mapped files
+there instead of taking a shared lock, and /metrics sums them across workers
+(see gunicorn.conf.py for the cleanup of exited workers).
+"""
+
+import os
+import time
+from functools import wraps
+
+from flask import Response, current_app, g, has_request_context, request
+from flask_restx import Namespace
+from flask_restx.representations import output_json
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+ROUTE_LABELS = ("namespace", "resource", "method")
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling a request, serialization included",
+    ROUTE_LABELS,
+)
+REQUESTS = Counter(
+    "http_requests", "Requests handled, by response status", ROUTE_LABELS + ("status",)
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests currently being handled",
+    ROUTE_LABELS,
+    multiprocess_mode="livesum",
+)
+SERIALIZATION = Histogram(
+    "http_serialization_duration_seconds",
+    "Time spent turning results into a response body, by stage (marshal or json)",
+    ROUTE_LABELS + ("stage",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+SQL_LATENCY = Histogram(
+    "sqlalchemy_statement_duration_seconds",
+    "Time spent executing one SQL statement",
+    ROUTE_LABELS,
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+SQL_PER_REQUEST = Histogram(
+    "sqlalchemy_statements_per_request",
+    "SQL statements executed while handling one request",
+    ROUTE_LABELS,
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+
+# Labels for statements run outside of a request, e.g. by the batch writer
+BACKGROUND_LABELS = ("", "background", "")
+
+
+def route_labels():
+    """(namespace, resource, method) of the current request's matched route"""
+    rule = request.url_rule
+    if rule is None:
+        return ("", "unmatched", request.method)
+    view = current_app.view_functions[rule.endpoint]
+    resource = getattr(view, "view_class", view).__name__
+    # flask-restx namespaces are mounted at /<namespace name>
+    namespace = rule.rule.split("/")[1] if hasattr(view, "view_class") else ""
+    return (namespace, resource, request.method)
+
+
+def current_labels():
+    if has_request_context() and "metric_labels" in g:
+        return g.metric_labels
+    return BACKGROUND_LABELS
+
+
+def observe_serialization(stage, started):
+    SERIALIZATION.labels(*current_labels(), stage).observe(
+        time.perf_counter() - started
+    )
+
+
+def timed_output_json(data, code, headers=None):
+    """flask-restx's JSON representation, timed as the "json" stage"""
+    started = time.perf_counter()
+    response = output_json(data, code, headers)
+    observe_serialization("json", started)
+    return response
+
+
+class InstrumentedNamespace(Namespace):
+    """
+    Namespace whose `marshal_with` also reports the time spent marshalling.
+
+    The handler is wrapped to note when it returns, so the time between that and
+    the decorated view returning is the marshalling alone.
+    """
+
+    def marshal_with(self, *args, **kwargs):
+        decorate = super().marshal_with(*args, **kwargs)
+
+        def wrapper(func):
+            @wraps(func)
+            def handler(*args, **kwargs):
+                result = func(*args, **kwargs)
+                g.handler_returned = time.perf_counter()
+                return result
+
+            marshalled = decorate(handler)
+
+            @wraps(marshalled)
+            def timed(*args, **kwargs):
+                result = marshalled(*args, **kwargs)
+                returned = g.pop("handler_returned", None)
+                if returned is not None:
+                    observe_serialization("marshal", returned)
+                return result
+
+            return timed
+
+        return wrapper
+
+
+def registry():
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected)
+        return collected
+    return REGISTRY
+
+
+class Metrics:
+    """Flask extension recording request, serialization and SQL metrics"""
+
+    def init_app(self, app, *engines):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+            event.listen(engine, "handle_error", self.handle_error)
+
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    @staticmethod
+    def before_request():
+        g.metric_labels = route_labels()
+        g.request_started = time.perf_counter()
+        g.sql_statements = 0
+        IN_FLIGHT.labels(*g.metric_labels).inc()
+
+    @staticmethod
+    def after_request(response):
+        if "metric_labels" in g:
+            REQUESTS.labels(*g.metric_labels, str(response.status_code)).inc()
+        return response
+
+    @staticmethod
+    def teardown_request(exc):  # pylint: disable=unused-argument
+        labels = g.pop("metric_labels", None)
+        if labels is None:
+            return
+        REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - g.request_started)
+        SQL_PER_REQUEST.labels(*labels).observe(g.sql_statements)
+        IN_FLIGHT.labels(*labels).dec()
+
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, params, context, many):
+        # A connection runs one statement at a time, so one start time will do;
+        # handle_error drops that of a failed statement
+        conn.info["query_started"] = time.perf_counter()
+
+    @staticmethod
+    def after_cursor_execute(conn, cursor, statement, params, context, many):
+        started = conn.info.pop("query_started")
+        labels = current_labels()
+        SQL_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+        if labels is not BACKGROUND_LABELS:
+            g.sql_statements += 1
+
+    @staticmethod
+    def handle_error(exception_context):
+        if exception_context.connection is not None:
+            exception_context.connection.info.pop("query_started", None)
+
+    @staticmethod
+    def metrics_view():
+        return Response(generate_latest(registry()), mimetype=CONTENT_TYPE_LATEST)
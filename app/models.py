@@ -1,14 +1,70 @@
 from datetime import datetime
+from sqlalchemy import and_, false, select
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from app import db
 
 
 class Tweet(db.Model):
     __tablename__ = "tweets"
+    __table_args__ = (
+        db.Index("ix_tweets_created_at_id", "created_at", "id"),
+        db.Index("ix_tweets_search_vector", "search_vector", postgresql_using="gin"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.String(280))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
-    user = db.relationship("User", back_populates="tweets")
+    # Partition key on PostgreSQL, where the primary key is (id, created_at)
+    # (see app.partitions): ids are unique through their sequence, but not
+    # enforced to be
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    # Deleting a user deletes their tweets in the database, without loading them
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    # Maintained by a trigger on PostgreSQL, unused elsewhere (see app.search)
+    search_vector = db.deferred(db.Column(TSVECTOR().with_variant(db.Text(), "sqlite")))
+    # Always serialized with its tweet (see JsonUser), so load it in the same query
+    user = db.relationship("User", back_populates="tweets", lazy="joined")
+
+    # Incremented by SQLAlchemy on every UPDATE
+    __mapper_args__ = {"version_id_col": version}
+
+    @property
+    def etag(self):
+        # The embedded author is part of the representation
+        user_version = self.user.version if self.user is not None else None
+        return self.make_etag(self.id, self.version, user_version)
+
+    @property
+    def last_modified(self):
+        user_updated_at = self.user.updated_at if self.user else None
+        return self.make_last_modified(self.updated_at, user_updated_at)
+
+    @staticmethod
+    def make_etag(tweet_id, version, user_version):
+        return f"{tweet_id}.{version}.{user_version}"
+
+    @staticmethod
+    def etag_clause(etag):
+        """SQL condition for a tweet to have `etag`, as made by make_etag"""
+        try:
+            tweet_id, version, user_version = (int(part) for part in etag.split("."))
+        except ValueError:
+            return false()
+        author_version = select(User.version).where(User.id == Tweet.user_id)
+        return and_(
+            Tweet.id == tweet_id,
+            Tweet.version == version,
+            author_version.scalar_subquery() == user_version,
+        )
+
+    @staticmethod
+    def make_last_modified(updated_at, user_updated_at):
+        stamps = [updated_at, user_updated_at]
+        return max((stamp for stamp in stamps if stamp is not None), default=None)
 
     def __repr__(self):
         return f"<Tweet #{self.id}>"
@@ -17,10 +73,106 @@ class Tweet(db.Model):
 class User(db.Model):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(50))
+    username = db.Column(db.String(50), index=True, unique=True)
     email = db.Column(db.String(150))
-    api_key = db.Column(db.String(30))
-    tweets = db.relationship("Tweet", cascade="all, delete", back_populates="user")
+    # SHA-256 digest of the user's API key (see app.auth), unique so that a key
+    # resolves to one user; the key itself is never stored
+    api_key = db.Column(db.String(64), index=True, unique=True)
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    # A query, not a list: paginate it rather than loading every tweet. Deletes
+    # cascade through tweets.user_id, so the ORM leaves the tweets to the database.
+    tweets = db.relationship(
+        "Tweet",
+        cascade="all, delete",
+        passive_deletes=True,
+        back_populates="user",
+        lazy="dynamic",
+    )
+
+    # Incremented by SQLAlchemy on every UPDATE
+    __mapper_args__ = {"version_id_col": version}
+
+    @property
+    def etag(self):
+        return self.make_etag(self.id, self.version)
+
+    @staticmethod
+    def make_etag(user_id, version):
+        return f"{user_id}.{version}"
+
+    @staticmethod
+    def etag_clause(etag):
+        """SQL condition for a user to have `etag`, as made by make_etag"""
+        try:
+            user_id, version = (int(part) for part in etag.split("."))
+        except ValueError:
+            return false()
+        return and_(User.id == user_id, User.version == version)
+
+    @property
+    def last_modified(self):
+        return self.updated_at
 
     def __repr__(self):
         return f"<User #{self.id}>"
+
+
+class Follow(db.Model):
+    __tablename__ = "follows"
+    # The primary key serves "who does X follow", this index "who follows X"
+    __table_args__ = (db.Index("ix_follows_followee_id", "followee_id"),)
+    follower_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    followee_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Follow {self.follower_id} -> {self.followee_id}>"
+
+
+# One create, update or delete of a tweet, for GET /tweets/stream
+class TweetChange(db.Model):
+    __tablename__ = "tweet_changes"
+    # Its id is the event id clients resume from
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: the changes of deleted tweets are kept. None for
+    # "user_deleted", which covers every tweet of the user.
+    tweet_id = db.Column(db.Integer, nullable=True)
+    # "created", "updated", "deleted" or "user_deleted"
+    action = db.Column(db.String(16), nullable=False)
+    # The JSON representation of the tweet, just its id once deleted, or
+    # {"user_id": ...} once its user is
+    payload = db.Column(db.Text, nullable=False)
+    # Serves the pruning of old changes
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<TweetChange #{self.id} {self.action} {self.tweet_id}>"
+
+
+class TweetChangePrune(db.Model):
+    __tablename__ = "tweet_change_prunes"
+    id = db.Column(db.Integer, primary_key=True)
+    # The last change deleted: clients resuming before it get 410 Gone. Ids
+    # have gaps, so the oldest change left can't tell.
+    through_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<TweetChangePrune #{self.id} through {self.through_id}>"
+
+
+# Serves GET /users/<id>/tweets, newest first
+db.Index(
+    "ix_tweets_user_id_created_at_id",
+    Tweet.user_id,
+    Tweet.created_at.desc(),
+    Tweet.id.desc(),
+)
@@ -0,0 +1,112 @@
+# pylint: disable=missing-docstring
+
+import base64
+import binascii
+from datetime import datetime
+
+from flask_restx import inputs, reqparse
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+page_parser = reqparse.RequestParser()
+page_parser.add_argument(
+    "limit",
+    type=inputs.int_range(1, MAX_PAGE_SIZE),
+    default=DEFAULT_PAGE_SIZE,
+    location="args",
+    help=f"Page size (1-{MAX_PAGE_SIZE})",
+)
+page_parser.add_argument(
+    "before",
+    location="args",
+    help="Cursor: return items older than this one, newest first",
+)
+page_parser.add_argument(
+    "after",
+    location="args",
+    help="Cursor: return items newer than this one, oldest first",
+)
+
+
+def _encode(*parts):
+    raw = "|".join(str(part) for part in parts).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        return raw.split("|")
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def encode_cursor(created_at, row_id):
+    return _encode(created_at.isoformat(), row_id)
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = _decode(cursor)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def encode_rank_cursor(rank, row_id):
+    """Cursor for results ordered by a relevance score, then id"""
+    return _encode(repr(float(rank)), row_id)
+
+
+def decode_rank_cursor(cursor):
+    try:
+        rank, row_id = _decode(cursor)
+        return float(rank), int(row_id)
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def keyset(query, created_at, row_id, limit, before=None, after=None):
+    """
+    Filter, order and limit `query` (a Query or a select()) for one page.
+
+    One extra row is fetched so that `page` can tell whether another page follows.
+    """
+    if before is not None and after is not None:
+        raise ValueError("Use either 'before' or 'after', not both")
+
+    # The created_at bounds are implied by the row comparisons, but unlike them
+    # let PostgreSQL skip the partitions of tweets that can't match
+    key = tuple_(created_at, row_id)
+    if after is not None:
+        cursor = decode_cursor(after)
+        query = query.filter(created_at >= cursor[0], key > tuple_(*cursor))
+        query = query.order_by(created_at.asc(), row_id.asc())
+    else:
+        if before is not None:
+            cursor = decode_cursor(before)
+            query = query.filter(created_at <= cursor[0], key < tuple_(*cursor))
+        query = query.order_by(created_at.desc(), row_id.desc())
+    return query.limit(limit + 1)
+
+
+def page(rows, limit):
+    """Trim the rows fetched by a `keyset` query to `(rows, next_cursor)`"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def paginate(query, created_at, row_id, limit, before=None, after=None):
+    """
+    Keyset pagination on ``(created_at, id)``.
+
+    Rows are returned newest first, or oldest first when paging with ``after``;
+    ``next_cursor`` continues in the same direction and is None on the last page.
+    Never uses OFFSET, so every page costs one index range scan.
+    """
+    rows = keyset(query, created_at, row_id, limit, before, after).all()
+    return page(rows, limit)
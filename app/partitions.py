@@ -0,0 +1,180 @@
+# pylint: disable=missing-docstring
+
+"""
+Monthly range partitions of the tweets table on PostgreSQL.
+
+Migration 7c3e9a1f5b20 makes `tweets` partitioned by range of created_at. The
+rows it held stay in `tweets_legacy`, one partition for everything before the
+cutover month, and each month after has a partition `tweets_YYYY_MM`. A
+`tweets_default` partition catches rows outside of them. This needs PostgreSQL
+13 or later.
+
+The primary key becomes (id, created_at), as a partitioned table's must include
+its partition key: tweet ids are unique only because they come from a sequence,
+and no constraint would stop a row inserted with an existing id.
+
+`manage.py partitions` keeps TWEET_PARTITION_MONTHS_AHEAD months of partitions
+created ahead. Partitions entirely older than TWEET_PARTITION_RETENTION_MONTHS
+are detached, and then either left as standalone tables, moved to the
+TWEET_PARTITION_ARCHIVE_SCHEMA schema (to be dumped and dropped at leisure), or
+dropped. Queries with a created_at bound, such as keyset pages, only read the
+partitions that bound can match.
+"""
+
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import text
+
+PARENT = "tweets"
+DEFAULT_PARTITION = "tweets_default"
+ARCHIVE_ACTIONS = ("detach", "archive", "drop")
+
+# One partition; `start` is None from MINVALUE, and both are None for DEFAULT
+Partition = namedtuple("Partition", "name start end")
+
+PARTITIONS_QUERY = """
+    SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+    FROM pg_inherits
+    JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = CAST(:parent AS regclass)
+"""
+BOUND = re.compile(r"FROM \((?:'([^']+)'|MINVALUE)\) TO \('([^']+)'\)")
+
+
+def month_start(moment, months=0):
+    """First instant of the month of `moment`, shifted by `months`"""
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(start):
+    return f"{PARENT}_{start:%Y_%m}"
+
+
+def parse_bound(name, bound):
+    if bound == "DEFAULT":
+        return Partition(name, None, None)
+    match = BOUND.search(bound)
+    if match is None:
+        raise ValueError(f"Unexpected bound of partition {name}: {bound}")
+    start, end = match.groups()
+    start = datetime.fromisoformat(start) if start else None
+    return Partition(name, start, datetime.fromisoformat(end))
+
+
+def list_partitions(connection):
+    """The partitions of tweets, oldest first and the default one last"""
+    rows = connection.execute(text(PARTITIONS_QUERY), {"parent": PARENT})
+    partitions = [parse_bound(name, bound) for name, bound in rows]
+    return sorted(
+        partitions,
+        key=lambda p: (p.end is None, p.start or datetime.min, p.end or datetime.max),
+    )
+
+
+def plan(partitions, now, months_ahead, retention_months):
+    """
+    `(starts, old)`: the months to create partitions for, and the partitions
+    to detach. Months already covered, e.g. by the legacy partition, are left
+    alone. A `retention_months` of 0 keeps every partition.
+    """
+    ranges = [p for p in partitions if p.end is not None]
+    starts = []
+    for offset in range(months_ahead + 1):
+        start = month_start(now, offset)
+        end = month_start(start, 1)
+        if not any(
+            (p.start is None or p.start < end) and start < p.end for p in ranges
+        ):
+            starts.append(start)
+
+    old = []
+    if retention_months:
+        horizon = month_start(now, -retention_months)
+        old = [p for p in ranges if p.end <= horizon]
+    return starts, old
+
+
+def literal(moment):
+    # Bounds are months computed here, never user input
+    return f"'{moment:%Y-%m-%d %H:%M:%S}'"
+
+
+def create_partition(connection, start):
+    """
+    Add the partition of the month starting at `start`.
+
+    Rows of that month that went to the default partition meanwhile are moved
+    into it first: PostgreSQL refuses new partitions for rows it already holds.
+    """
+    name, end = partition_name(start), month_start(start, 1)
+    bounds = f"created_at >= {literal(start)} AND created_at < {literal(end)}"
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {PARENT} INCLUDING DEFAULTS)"))
+    connection.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {bounds} "
+            f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"
+        )
+    )
+    # Indexes, the foreign key and the search trigger are cloned from the parent
+    connection.execute(
+        text(
+            f"ALTER TABLE {PARENT} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ({literal(start)}) TO ({literal(end)})"
+        )
+    )
+    return name
+
+
+def retire_partition(connection, partition, action, schema):
+    """Detach `partition`, then keep it as is, move it to `schema` or drop it"""
+    if action not in ARCHIVE_ACTIONS:
+        raise ValueError(f"Unknown action {action!r}")
+    # Not CONCURRENTLY, which a default partition rules out; without a scan to
+    # make, the lock on tweets is held only briefly either way
+    connection.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {partition.name}"))
+    if action == "archive":
+        connection.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+        connection.execute(text(f"ALTER TABLE {partition.name} SET SCHEMA {schema}"))
+    elif action == "drop":
+        connection.execute(text(f"DROP TABLE {partition.name}"))
+
+
+def maintain(engine, config, action=None, now=None, log=print):
+    """
+    Create the partitions due and retire the expired ones, one transaction each.
+
+    `action` defaults to TWEET_PARTITION_ARCHIVE_ACTION. Returns the names of
+    the partitions created and retired.
+    """
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("Partitioned tweets need PostgreSQL")
+    action = action or config["TWEET_PARTITION_ARCHIVE_ACTION"]
+    now = now or datetime.utcnow()
+
+    with engine.connect() as connection:
+        partitions = list_partitions(connection)
+    if not partitions:
+        raise RuntimeError(f"{PARENT} is not partitioned, run the migrations first")
+    starts, old = plan(
+        partitions,
+        now,
+        config["TWEET_PARTITION_MONTHS_AHEAD"],
+        config["TWEET_PARTITION_RETENTION_MONTHS"],
+    )
+
+    created, retired = [], []
+    for start in starts:
+        with engine.begin() as connection:
+            created.append(create_partition(connection, start))
+        log(f"created {created[-1]}")
+    for partition in old:
+        with engine.begin() as connection:
+            retire_partition(
+                connection, partition, action, config["TWEET_PARTITION_ARCHIVE_SCHEMA"]
+            )
+        retired.append(partition.name)
+        log(f"{action} {partition.name}")
+    return created, retired
@@ -0,0 +1,180 @@
+# pylint: disable=missing-docstring
+
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class PoolMetrics:
+    """Checkout latency, exhaustion and connection churn of one engine's pool"""
+
+    def __init__(self, max_overflow, window=1000):
+        self.max_overflow = max_overflow
+        self.checkouts = self.exhausted = self.timeouts = 0
+        self.connects = self.closes = self.invalidations = 0
+        self.max_wait_ms = 0.0
+        self.total_wait_ms = 0.0
+        self._waits = deque(maxlen=window)  # latest checkout waits, in ms
+        self._lock = threading.Lock()
+        self.pool = None
+
+    def record_checkout(self, wait_ms, exhausted, timed_out=False):
+        with self._lock:
+            self.exhausted += exhausted
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            self._waits.append(wait_ms)
+
+    def listen(self, engine):
+        def connect(dbapi_connection, connection_record):
+            self.connects += 1
+
+        def close(dbapi_connection, connection_record):
+            self.closes += 1
+
+        def invalidate(dbapi_connection, connection_record, exception):
+            self.invalidations += 1
+
+        event.listen(engine, "connect", connect)
+        event.listen(engine, "close", close)
+        event.listen(engine, "invalidate", invalidate)
+        event.listen(engine, "soft_invalidate", invalidate)
+        self.pool = engine.pool
+
+    def stats(self):
+        with self._lock:
+            waits = list(self._waits)
+        stats = {
+            "checkouts": self.checkouts,
+            "checkout_wait_ms": {
+                "mean": (
+                    round(self.total_wait_ms / self.checkouts, 3)
+                    if self.checkouts
+                    else None
+                ),
+                "p50": percentile(waits, 0.50),
+                "p95": percentile(waits, 0.95),
+                "p99": percentile(waits, 0.99),
+                "max": round(self.max_wait_ms, 3),
+            },
+            # Checkouts that found every connection, overflow included, in use
+            "exhausted": self.exhausted,
+            "timeouts": self.timeouts,
+            "connections_opened": self.connects,
+            "connections_closed": self.closes,
+            "invalidations": self.invalidations,
+        }
+        if isinstance(self.pool, QueuePool):
+            stats.update(
+                pool_size=self.pool.size(),
+                checked_in=self.pool.checkedin(),
+                checked_out=self.pool.checkedout(),
+                overflow=self.pool.overflow(),
+            )
+        return stats
+
+
+def instrumented_pool_class(metrics):
+    """
+    A QueuePool subclass timing every checkout into `metrics`.
+
+    The metrics live on the class rather than the instance because SQLAlchemy
+    rebuilds the pool with ``self.__class__`` after a disconnect.
+    """
+
+    class InstrumentedQueuePool(QueuePool):
+        def connect(self):
+            exhausted = (
+                self.checkedin() == 0 and self.overflow() >= metrics.max_overflow
+            )
+            start = time.perf_counter()
+            try:
+                connection = super().connect()
+            except PoolTimeout:
+                metrics.record_checkout(None, exhausted, timed_out=True)
+                raise
+            wait_ms = round((time.perf_counter() - start) * 1000, 3)
+            metrics.record_checkout(wait_ms, exhausted)
+            return connection
+
+    return InstrumentedQueuePool
+
+
+def engine_options(config, metrics):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for the DB_POOL_* and DB_STATEMENT_TIMEOUT settings.
+
+    In-memory SQLite keeps Flask-SQLAlchemy's single shared connection, which
+    has no pool to tune.
+    """
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    backend = url.get_backend_name()
+    if backend == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+
+    options = {
+        "poolclass": instrumented_pool_class(metrics),
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+    timeout = config["DB_STATEMENT_TIMEOUT_MS"]
+    if timeout and backend == "postgresql":
+        options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+    return options
+
+
+def enforce_foreign_keys(engine):
+    """
+    Make SQLite check foreign keys, and cascade deletes through them, as
+    PostgreSQL does; it doesn't by default.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    def connect(dbapi_connection, connection_record):
+        # Through a cursor, which async drivers' adapted connections also have
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.close()
+
+    event.listen(engine, "connect", connect)
+
+
+class PoolInstrumentation:
+    """
+    Flask extension applying the pool settings and recording pool metrics.
+
+    Must be initialised before `db`, whose engine is built from the options
+    set here.
+    """
+
+    def init_app(self, app):
+        metrics = PoolMetrics(app.config["DB_MAX_OVERFLOW"])
+        options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+        for key, value in engine_options(app.config, metrics).items():
+            options.setdefault(key, value)
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+        app.extensions["pool"] = metrics
+
+    def __getattr__(self, name):
+        return getattr(current_app.extensions["pool"], name)
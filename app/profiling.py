@@ -0,0 +1,233 @@
+# pylint: disable=missing-docstring
+
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+
+from flask import abort, current_app, jsonify, request, send_from_directory
+from sqlalchemy import event
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID = re.compile(r"^[0-9T]+-[0-9a-f]{8}$")
+
+# SQL statements of the request being profiled on this thread, if any
+_capture = threading.local()
+
+
+class ProfileStore:
+    """Directory keeping the `keep` most recent profiles, as .prof + .json pairs"""
+
+    def __init__(self, path, keep):
+        self.path = os.path.abspath(path)
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def save(self, profile, meta):
+        os.makedirs(self.path, exist_ok=True)
+        profile_id = time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+        profile.dump_stats(os.path.join(self.path, profile_id + ".prof"))
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(40)
+        meta = dict(meta, id=profile_id, stats=summary.getvalue())
+        with open(os.path.join(self.path, profile_id + ".json"), "w") as f:
+            json.dump(meta, f)
+
+        self._rotate()
+        return profile_id
+
+    def _rotate(self):
+        with self._lock:
+            for profile_id in self.ids()[self.keep :]:
+                for ext in (".json", ".prof"):
+                    try:
+                        os.remove(os.path.join(self.path, profile_id + ext))
+                    except FileNotFoundError:
+                        pass
+
+    def ids(self):
+        """Stored profile ids, newest first"""
+        if not os.path.isdir(self.path):
+            return []
+        stems = (os.path.splitext(name) for name in os.listdir(self.path))
+        ids = (stem for stem, ext in stems if ext == ".json" and PROFILE_ID.match(stem))
+        return sorted(ids, reverse=True)
+
+    def get(self, profile_id):
+        if not PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.path, profile_id + ".json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+class ProfilingMiddleware:
+    """
+    WSGI middleware profiling the requests picked by one of three triggers.
+
+    - "header": the X-Profile header carries PROFILE_ADMIN_KEY
+    - "sampled": a random PROFILE_SAMPLE_RATE fraction of requests
+    - "slow": requests slower than PROFILE_SLOW_MS; every request is profiled
+      while this is set, and only the slow ones are kept
+
+    Streamed bodies are produced after the app returns, so only the time up to
+    the first byte is profiled for them. Requests for /profiles are never profiled.
+    """
+
+    def __init__(self, wsgi_app, store, sample_rate=0.0, slow_ms=0, admin_key=None):
+        self.wsgi_app = wsgi_app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.admin_key = admin_key
+
+    def trigger(self, environ):
+        if environ.get("PATH_INFO", "").startswith("/profiles"):
+            return None
+        header = environ.get("HTTP_" + PROFILE_HEADER.upper().replace("-", "_"))
+        if self.admin_key and header and hmac.compare_digest(header, self.admin_key):
+            return "header"
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        if self.slow_ms:
+            return "slow"
+        return None
+
+    def __call__(self, environ, start_response):
+        trigger = self.trigger(environ)
+        if trigger is None:
+            return self.wsgi_app(environ, start_response)
+
+        status = []
+
+        def capture_status(code, headers, exc_info=None):
+            status.append(int(code.split()[0]))
+            return start_response(code, headers, exc_info)
+
+        profile = cProfile.Profile()
+        _capture.statements = []
+        started = time.perf_counter()
+        try:
+            profile.enable()
+            try:
+                return self.wsgi_app(environ, capture_status)
+            finally:
+                profile.disable()
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            statements, _capture.statements = _capture.statements, None
+            if trigger != "slow" or duration_ms >= self.slow_ms:
+                self.store.save(
+                    profile,
+                    {
+                        "trigger": trigger,
+                        "method": environ["REQUEST_METHOD"],
+                        "path": environ.get("PATH_INFO", ""),
+                        "query_string": environ.get("QUERY_STRING", ""),
+                        "status": status[0] if status else None,
+                        "duration_ms": round(duration_ms, 3),
+                        "created_at": time.strftime(
+                            "%Y-%m-%dT%H:%M:%SZ", time.gmtime()
+                        ),
+                        "sql": statements,
+                    },
+                )
+
+
+def before_cursor_execute(conn, cursor, statement, params, context, many):
+    # One statement runs at a time on a connection, as in app.metrics
+    if getattr(_capture, "statements", None) is not None:
+        conn.info["profile_started"] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, params, context, many):
+    started = conn.info.pop("profile_started", None)
+    statements = getattr(_capture, "statements", None)
+    if statements is None or started is None:
+        return
+    # Parameters are left out: profiles are kept on disk and may hold user data
+    duration_ms = (time.perf_counter() - started) * 1000
+    statements.append({"statement": statement, "duration_ms": round(duration_ms, 3)})
+
+
+def handle_error(exception_context):
+    if exception_context.connection is not None:
+        exception_context.connection.info.pop("profile_started", None)
+
+
+def require_admin_key():
+    admin_key = current_app.config["PROFILE_ADMIN_KEY"]
+    header = request.headers.get(PROFILE_HEADER, "")
+    if not admin_key or not hmac.compare_digest(header, admin_key):
+        abort(403)
+
+
+def list_profiles():
+    require_admin_key()
+    store = current_app.extensions["profiler"]
+    profiles = []
+    for profile_id in store.ids():
+        meta = store.get(profile_id)
+        if meta is not None:
+            meta.pop("stats")
+            meta["sql"] = len(meta["sql"])
+            profiles.append(meta)
+    return jsonify(profiles)
+
+
+def get_profile(profile_id):
+    require_admin_key()
+    meta = current_app.extensions["profiler"].get(profile_id)
+    if meta is None:
+        abort(404)
+    return jsonify(meta)
+
+
+def download_profile(profile_id):
+    require_admin_key()
+    store = current_app.extensions["profiler"]
+    if store.get(profile_id) is None:
+        abort(404)
+    return send_from_directory(store.path, profile_id + ".prof", as_attachment=True)
+
+
+class Profiler:
+    """
+    Flask extension wrapping the app in ProfilingMiddleware when any PROFILE_*
+    trigger is configured, and serving the stored profiles under /profiles.
+
+    The index and downloads need the X-Profile header set to PROFILE_ADMIN_KEY.
+    """
+
+    def init_app(self, app, engine):
+        config = app.config
+        store = ProfileStore(config["PROFILE_DIR"], config["PROFILE_KEEP"])
+        app.extensions["profiler"] = store
+
+        app.add_url_rule("/profiles", "profiles", list_profiles)
+        app.add_url_rule("/profiles/<profile_id>", "profile", get_profile)
+        app.add_url_rule(
+            "/profiles/<profile_id>/download", "profile-download", download_profile
+        )
+
+        sample_rate = config["PROFILE_SAMPLE_RATE"]
+        slow_ms = config["PROFILE_SLOW_MS"]
+        admin_key = config["PROFILE_ADMIN_KEY"]
+        if not (sample_rate or slow_ms or admin_key):
+            return
+        app.wsgi_app = ProfilingMiddleware(
+            app.wsgi_app, store, sample_rate, slow_ms, admin_key
+        )
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(engine, "handle_error", handle_error)
@@ -0,0 +1,140 @@
+# pylint: disable=missing-docstring
+
+"""
+Background deletion of users with too many tweets to delete in one request.
+
+DELETE /users/<id> removes the user's tweets by ON DELETE CASCADE, in the same
+statement and transaction. For an account with millions of tweets that is one
+long transaction holding its locks throughout, and a burst for replicas to
+replay. With `?purge=background` a PurgeJob deletes the tweets instead,
+USER_PURGE_CHUNK_SIZE per transaction, recording their deletion chunk by chunk
+for GET /tweets/stream, then deletes the user.
+
+Progress is kept in the response cache under `purge_key(user_id)`, so with
+CACHE_BACKEND=redis any worker can report it. It expires CACHE_TTL seconds
+after the last update.
+"""
+
+import json
+import threading
+import time
+
+from sqlalchemy import delete, func, select
+
+from app import cache, changes, db
+from app.change_log import record, record_deleted, user_deleted
+from app.models import Tweet, User
+
+
+def purge_key(user_id):
+    return f"purge:{user_id}"
+
+
+def purge_progress(user_id):
+    """Progress of the last purge of `user_id`, None if there is none"""
+    progress = cache.get(purge_key(user_id))
+    return json.loads(progress) if progress is not None else None
+
+
+def delete_tweets_chunk(user_id, chunk_size):
+    """Delete up to `chunk_size` tweets of `user_id` in one transaction"""
+    chunk = select(Tweet.id).where(Tweet.user_id == user_id).limit(chunk_size)
+    tweet_ids = db.session.scalars(
+        delete(Tweet)
+        .where(Tweet.id.in_(chunk))
+        .returning(Tweet.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    events = record_deleted(db.session, tweet_ids)
+    db.session.commit()
+    changes.publish(events)
+    return len(events)
+
+
+class PurgeJob(threading.Thread):
+    """
+    Deletes a user's tweets in chunks, then the user.
+
+    `on_deleted(user_id)` runs once the user is gone, e.g. to invalidate caches,
+    and `on_progress(progress)` after every update of the progress.
+    """
+
+    def __init__(self, app, user_id, on_deleted=None, on_progress=None):
+        super().__init__(name=f"user-purge-{user_id}", daemon=True)
+        self.app = app
+        self.user_id = user_id
+        self.on_deleted = on_deleted
+        self.on_progress = on_progress
+        self.chunk_size = app.config["USER_PURGE_CHUNK_SIZE"]
+        self.pause = app.config["USER_PURGE_PAUSE"]
+        self.progress = {
+            "user_id": user_id,
+            "status": "running",
+            "total": None,
+            "deleted": 0,
+            "chunks": 0,
+            "seconds": 0.0,
+            "error": None,
+        }
+
+    def run(self):
+        with self.app.app_context():
+            try:
+                self.purge()
+            except Exception as e:  # pylint: disable=broad-except
+                db.session.rollback()
+                self.app.logger.exception("Purge of user %s failed", self.user_id)
+                self.report(status="failed", error=str(e))
+            finally:
+                db.session.remove()
+
+    def purge(self):
+        started = time.perf_counter()
+        total = db.session.scalar(
+            select(func.count(Tweet.id)).where(Tweet.user_id == self.user_id)
+        )
+        self.report(total=total)
+
+        while True:
+            deleted = delete_tweets_chunk(self.user_id, self.chunk_size)
+            if not deleted:
+                break
+            self.report(
+                deleted=self.progress["deleted"] + deleted,
+                chunks=self.progress["chunks"] + 1,
+                seconds=round(time.perf_counter() - started, 3),
+            )
+            # Leaves room for other writes, and for replicas to keep up
+            time.sleep(self.pause)
+
+        # Tweets posted in the meantime go with the user, by cascade
+        db.session.execute(delete(User).where(User.id == self.user_id))
+        events = record(db.session, "user_deleted", user_deleted(self.user_id))
+        db.session.commit()
+        changes.publish(events)
+        if self.on_deleted is not None:
+            self.on_deleted(self.user_id)
+        self.report(status="done", seconds=round(time.perf_counter() - started, 3))
+
+    def report(self, **changes):
+        self.progress.update(changes)
+        cache.set(purge_key(self.user_id), json.dumps(self.progress))
+        if self.on_progress is not None:
+            self.on_progress(dict(self.progress))
+
+
+_lock = threading.Lock()
+
+
+def start_purge(app, user_id, on_deleted=None):
+    """The purge of `user_id` running in this process, started if there is none"""
+    with _lock:
+        jobs = app.extensions.setdefault("purges", {})
+        for done in [key for key, job in jobs.items() if not job.is_alive()]:
+            del jobs[done]
+        job = jobs.get(user_id)
+        if job is None:
+            job = jobs[user_id] = PurgeJob(app, user_id, on_deleted)
+            job.report()
+            job.start()
+        return job
@@ -0,0 +1,252 @@
+# pylint: disable=missing-docstring
+
+"""
+Read replicas for the GET handlers of the tweets and users namespaces.
+
+Each of DATABASE_REPLICA_URLS becomes a Flask-SQLAlchemy bind. The GET handlers
+pick one of them per request, and RoutingSession sends that request's SELECTs
+there; everything else, and every other request, uses the primary.
+
+Replicas are checked for health and replication lag every
+REPLICA_CHECK_INTERVAL seconds. A replica is used only while it is reachable and
+less than REPLICA_MAX_LAG_SECONDS behind, and otherwise reads fall back to the
+primary. A successful write also sets a cookie holding its time, and that
+client's reads stay on the primary for the next REPLICA_MAX_LAG_SECONDS, by
+which time every usable replica has replayed the write.
+
+Bodies read from a replica are not cached: one from behind a write could
+otherwise be filled after that write's invalidation, and served from the cache
+to every client, including the writer.
+"""
+
+import math
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import Select
+
+from app.pool import engine_options
+
+READ_METHODS = {"GET", "HEAD"}
+LAST_WRITE_COOKIE = "db_last_write"
+
+# Seconds a replica is behind. Caught up replicas of an idle primary have an old
+# replay timestamp, hence the comparison of received and replayed WAL first.
+LAG_QUERIES = {
+    "postgresql": """
+        SELECT CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END
+    """,
+}
+
+
+class Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.healthy = False
+        self.lag = None
+        self.error = None
+        self.reads = 0
+
+    def check(self):
+        query = LAG_QUERIES.get(self.engine.dialect.name, "SELECT 0")
+        try:
+            with self.engine.connect() as connection:
+                lag = connection.execute(text(query)).scalar()
+        except SQLAlchemyError as e:
+            self.healthy, self.lag = False, None
+            self.error = str(getattr(e, "orig", None) or e)
+            return
+        self.healthy, self.lag, self.error = True, float(lag or 0), None
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "url": self.engine.url.render_as_string(hide_password=True),
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "reads": self.reads,
+            "error": self.error,
+        }
+
+
+class ReplicaSet:
+    """The replicas of the current app, and which of them can serve a read"""
+
+    def __init__(self, replicas, max_lag, check_interval):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.fallbacks = 0
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Check the replicas if due; one request does it while others go on"""
+        now = time.monotonic()
+        if self.checked_at is not None and now - self.checked_at < self.check_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            for replica in self.replicas:
+                replica.check()
+            self.checked_at = time.monotonic()
+        finally:
+            self._lock.release()
+
+    def choose(self, since_write=None):
+        """
+        A replica for a read, or None for the primary.
+
+        `since_write` is how long ago the client last wrote. Lag is only known
+        as of the last check, so replicas count as having the write once no
+        usable replica can be behind it any more.
+        """
+        if not self.replicas or (
+            since_write is not None and since_write < self.max_lag
+        ):
+            return None
+        self.refresh()
+        usable = [r for r in self.replicas if r.healthy and r.lag < self.max_lag]
+        if not usable:
+            self.fallbacks += 1
+            return None
+        replica = random.choice(usable)
+        replica.reads += 1
+        return replica
+
+    def mark_down(self, replica, error):
+        replica.healthy, replica.error = False, str(error)
+
+    def stats(self):
+        return {
+            "replicas": [replica.stats() for replica in self.replicas],
+            # Reads sent to the primary because no replica was usable
+            "fallbacks": self.fallbacks,
+        }
+
+
+class RoutingSession(Session):
+    """
+    Session sending SELECTs to the replica chosen for the current request.
+
+    Flushes, DML, locking reads and requests without a replica use the bind
+    Flask-SQLAlchemy would have picked.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get("db_replica") if has_app_context() else None
+        if (
+            replica is not None
+            and bind is None
+            and not self._flushing
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+        ):
+            return replica.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def since_last_write():
+    """Seconds since this client's last write, None if it has no recent one"""
+    try:
+        return max(0.0, time.time() - float(request.cookies[LAST_WRITE_COOKIE]))
+    except (KeyError, ValueError):
+        return None
+
+
+def reading_replica():
+    """Whether this request's reads go to a replica, whose rows may be stale"""
+    return g.get("db_replica") is not None
+
+
+def route_reads(view):
+    """
+    Namespace decorator running GET handlers against a replica when one is usable.
+
+    Other methods use the primary, and successful writes set the cookie keeping
+    the client's next reads on it.
+    """
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        replicas = current_app.extensions["replicas"]
+        if not replicas.replicas:
+            return view(*args, **kwargs)
+
+        if request.method in READ_METHODS:
+            # Kept until teardown, which streamed responses reach once streamed
+            g.db_replica = replicas.choose(since_last_write())
+            return view(*args, **kwargs)
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code < 400:
+            response.set_cookie(
+                LAST_WRITE_COOKIE,
+                repr(time.time()),
+                max_age=math.ceil(replicas.max_lag),
+                httponly=True,
+            )
+        return response
+
+    return wrapper
+
+
+def clear_replica(exc):  # pylint: disable=unused-argument
+    g.pop("db_replica", None)
+
+
+class Replicas:
+    """
+    Flask extension adding a bind per replica and health checking them.
+
+    `init_app` must run before `db.init_app`, which builds the binds' engines,
+    and `listen` after it.
+    """
+
+    def init_app(self, app):
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        for index, url in enumerate(app.config["DATABASE_REPLICA_URLS"]):
+            # Same pool settings as the primary, without its checkout metrics
+            options = engine_options(
+                dict(app.config, SQLALCHEMY_DATABASE_URI=url), None
+            )
+            options.pop("poolclass", None)
+            binds[f"replica{index}"] = dict(options, url=url)
+        app.config["SQLALCHEMY_BINDS"] = binds
+
+    def listen(self, app, engines):
+        config = app.config
+        replicas = [
+            Replica(f"replica{index}", engines[f"replica{index}"])
+            for index in range(len(config["DATABASE_REPLICA_URLS"]))
+        ]
+        replica_set = ReplicaSet(
+            replicas,
+            config["REPLICA_MAX_LAG_SECONDS"],
+            config["REPLICA_CHECK_INTERVAL"],
+        )
+        for replica in replicas:
+            # Lost connections take a replica out until its next good check
+            def handle_error(context, replica=replica):
+                if context.is_disconnect:
+                    replica_set.mark_down(replica, context.original_exception)
+
+            event.listen(replica.engine, "handle_error", handle_error)
+        app.extensions["replicas"] = replica_set
+        app.teardown_request(clear_replica)
+        return [replica.engine for replica in replicas]
+
+    def __getattr__(self, name):
+        return getattr(current_app.extensions["replicas"], name)
@@ -0,0 +1,171 @@
+# pylint: disable=missing-docstring
+
+import heapq
+import json
+import math
+import re
+import threading
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import cast, func, select, tuple_
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+
+from app import db
+from app.change_log import latest_query, pruned_query
+from app.models import Tweet, TweetChange
+from app.pagination import decode_rank_cursor, encode_rank_cursor
+
+TOKEN = re.compile(r"\w+")
+# Must match the configuration used by the tweets_search_vector_update trigger
+TEXT_SEARCH_CONFIG = "pg_catalog.english"
+
+
+def tokenize(text):
+    return TOKEN.findall((text or "").lower())
+
+
+class InvertedIndex:
+    """Term -> {tweet id: term frequency} postings, ranked with tf-idf"""
+
+    def __init__(self):
+        self._postings = {}
+        self._terms = {}  # tweet id -> its term frequencies, to remove it
+
+    def add(self, tweet_id, text):
+        """Index `tweet_id`, replacing its previous text if any"""
+        self.remove(tweet_id)
+        counts = Counter(tokenize(text))
+        for term, count in counts.items():
+            self._postings.setdefault(term, {})[tweet_id] = count
+        self._terms[tweet_id] = counts
+
+    def remove(self, tweet_id):
+        for term in self._terms.pop(tweet_id, ()):
+            posting = self._postings[term]
+            del posting[tweet_id]
+            if not posting:
+                del self._postings[term]
+
+    def search(self, query, limit, after=None):
+        """Best `limit` (score, tweet id) pairs matching every term, below `after`"""
+        postings = [self._postings.get(term, {}) for term in set(tokenize(query))]
+        if not postings:
+            return []
+        postings.sort(key=len)
+        hits = []
+        for tweet_id in set(postings[0]).intersection(*postings[1:]):
+            score = sum(
+                posting[tweet_id] * math.log(1 + len(self._terms) / len(posting))
+                for posting in postings
+            )
+            if after is None or (score, tweet_id) < after:
+                hits.append((score, tweet_id))
+        return heapq.nlargest(limit, hits)
+
+
+class FallbackSearch:
+    """
+    Full-text search for databases without tsvector support, such as SQLite.
+
+    The index is built from the tweets table on the first search, then kept up
+    to date from the change log (app.change_log): each search first applies the
+    changes recorded since the last one, updating only the postings of the
+    tweets they name. It is rebuilt when a user was deleted, which is recorded
+    as one change for all their tweets, or when the changes it missed were
+    pruned. SQLite commits one writer at a time, so changes are committed in id
+    order and none is skipped.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.last_change_id = 0
+        self._lock = threading.Lock()
+
+    def search(self, query, limit, after=None):
+        with self._lock:
+            if self.index is None or not self.catch_up():
+                self.rebuild()
+            return self.index.search(query, limit, after)
+
+    def rebuild(self):
+        # Changes recorded while reading the table are applied again next time
+        self.last_change_id = db.session.scalar(latest_query()) or 0
+        index = InvertedIndex()
+        for tweet_id, text in db.session.query(Tweet.id, Tweet.text).yield_per(10000):
+            index.add(tweet_id, text)
+        self.index = index
+
+    def catch_up(self):
+        """Apply the changes since the last search; False if a rebuild is due"""
+        pruned = db.session.scalar(pruned_query())
+        if pruned is not None and pruned > self.last_change_id:
+            return False
+        changes = db.session.execute(
+            select(
+                TweetChange.id,
+                TweetChange.action,
+                TweetChange.tweet_id,
+                TweetChange.payload,
+            )
+            .where(TweetChange.id > self.last_change_id)
+            .order_by(TweetChange.id)
+        )
+        for change in changes:
+            if change.action == "user_deleted":
+                return False
+            if change.action == "deleted":
+                self.index.remove(change.tweet_id)
+            else:
+                self.index.add(change.tweet_id, json.loads(change.payload)["text"])
+            self.last_change_id = change.id
+        return True
+
+
+_fallback_lock = threading.Lock()
+
+
+def fallback_search():
+    with _fallback_lock:
+        fallback = current_app.extensions.get("search_fallback")
+        if fallback is None:
+            fallback = FallbackSearch()
+            current_app.extensions["search_fallback"] = fallback
+        return fallback
+
+
+def _search_postgresql(query, limit, after):
+    tsquery = func.plainto_tsquery(TEXT_SEARCH_CONFIG, query)
+    # ts_rank_cd returns a real: compared with the cursor's double, a rank that
+    # is not exactly representable as a real would skip the rows tied with it
+    rank = cast(func.ts_rank_cd(Tweet.search_vector, tsquery), DOUBLE_PRECISION)
+    rows = db.session.query(Tweet, rank).filter(Tweet.search_vector.op("@@")(tsquery))
+    if after is not None:
+        rows = rows.filter(tuple_(rank, Tweet.id) < tuple_(*after))
+    return rows.order_by(rank.desc(), Tweet.id.desc()).limit(limit).all()
+
+
+def _search_fallback(query, limit, after):
+    hits = fallback_search().search(query, limit, after)
+    ids = [tweet_id for _, tweet_id in hits]
+    tweets = {t.id: t for t in db.session.query(Tweet).filter(Tweet.id.in_(ids))}
+    return [(tweets[tweet_id], score) for score, tweet_id in hits if tweet_id in tweets]
+
+
+def search_tweets(query, limit, cursor=None):
+    """
+    Tweets matching every word of `query`, most relevant first.
+
+    Returns ``(tweets, next_cursor)``; pages are keyed on ``(rank, id)``.
+    """
+    after = decode_rank_cursor(cursor) if cursor else None
+    if db.session.get_bind().dialect.name == "postgresql":
+        rows = _search_postgresql(query, limit + 1, after)
+    else:
+        rows = _search_fallback(query, limit + 1, after)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_rank_cursor(rows[-1][1], rows[-1][0].id)
+    return [tweet for tweet, _ in rows], next_cursor
@@ -0,0 +1,32 @@
+# pylint: disable=missing-docstring
+
+import json
+
+from flask import Response, current_app, stream_with_context
+
+from app.serializers import serialize
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def ndjson_response(query, model):
+    """
+    Stream every row of `query` as newline-delimited JSON.
+
+    Rows are read through a server-side cursor `EXPORT_BATCH_SIZE` at a time and
+    written out one batch per chunk, so memory use does not depend on row count.
+    """
+    batch_size = current_app.config["EXPORT_BATCH_SIZE"]
+    rows = query.execution_options(stream_results=True).yield_per(batch_size)
+
+    def generate():
+        chunk = []
+        for row in rows:
+            chunk.append(json.dumps(serialize(row, model)))
+            if len(chunk) >= batch_size:
+                yield "\n".join(chunk) + "\n"
+                chunk = []
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,117 @@
+# pylint: disable=missing-docstring
+
+import threading
+from collections import deque
+
+from flask import current_app
+
+
+class MemoryTimelineStore:
+    """
+    Per-user lists of recent tweet ids, newest first, kept in process memory.
+
+    For a single process only: each worker would hold the lists and celebrities
+    of the tweets it wrote, and read partial timelines. Use RedisTimelineStore
+    with several workers.
+    """
+
+    def __init__(self, max_length=800):
+        self.max_length = max_length
+        self._timelines = {}
+        self._celebrities = set()
+        self._lock = threading.Lock()
+
+    def push(self, user_ids, tweet_id):
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                if timeline is None:
+                    timeline = self._timelines[user_id] = deque(maxlen=self.max_length)
+                timeline.appendleft(tweet_id)
+
+    def read(self, user_id, limit):
+        """The `limit` newest tweet ids, None when the list doesn't exist"""
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            return None if timeline is None else list(timeline)[:limit]
+
+    def rebuild(self, user_id, tweet_ids):
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                timeline = self._timelines[user_id] = deque(maxlen=self.max_length)
+            # Any pushed meanwhile are newer, and stay in front
+            pushed = set(timeline)
+            older = [tweet_id for tweet_id in tweet_ids if tweet_id not in pushed]
+            timeline.extend(older[: self.max_length - len(timeline)])
+
+    def mark_celebrity(self, user_id):
+        with self._lock:
+            self._celebrities.add(user_id)
+
+    def celebrities(self):
+        with self._lock:
+            return set(self._celebrities)
+
+
+class RedisTimelineStore:
+    """Same lists as MemoryTimelineStore, shared by every worker through Redis"""
+
+    def __init__(self, client, max_length=800, prefix="twitter-api:"):
+        self.client = client
+        self.max_length = max_length
+        self.prefix = prefix
+
+    def push(self, user_ids, tweet_id):
+        pipeline = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            key = f"{self.prefix}timeline:{user_id}"
+            pipeline.lpush(key, tweet_id)
+            pipeline.ltrim(key, 0, self.max_length - 1)
+        pipeline.execute()
+
+    def read(self, user_id, limit):
+        key = f"{self.prefix}timeline:{user_id}"
+        tweet_ids = self.client.lrange(key, 0, limit - 1)
+        # Redis drops empty lists, so an empty one is a missing one
+        return [int(tweet_id) for tweet_id in tweet_ids] or None
+
+    def rebuild(self, user_id, tweet_ids):
+        # Appended after any pushed meanwhile; ids pushed twice only take room
+        key = f"{self.prefix}timeline:{user_id}"
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.rpush(key, *tweet_ids)
+        pipeline.ltrim(key, 0, self.max_length - 1)
+        pipeline.execute()
+
+    def mark_celebrity(self, user_id):
+        self.client.sadd(f"{self.prefix}celebrities", user_id)
+
+    def celebrities(self):
+        return {
+            int(user_id)
+            for user_id in self.client.smembers(f"{self.prefix}celebrities")
+        }
+
+
+def make_timeline_store(config):
+    """Build the timeline store selected by TIMELINE_BACKEND in `config`"""
+    backend = config["TIMELINE_BACKEND"]
+    if backend == "memory":
+        return MemoryTimelineStore(config["TIMELINE_MAX_LENGTH"])
+    if backend == "redis":
+        import redis
+
+        client = redis.Redis.from_url(config["TIMELINE_REDIS_URL"])
+        return RedisTimelineStore(client, config["TIMELINE_MAX_LENGTH"])
+    raise ValueError(f"Unknown TIMELINE_BACKEND {backend!r}")
+
+
+class Timelines:
+    """Flask extension holding the configured home timeline store"""
+
+    def init_app(self, app):
+        app.extensions["timelines"] = make_timeline_store(app.config)
+
+    def __getattr__(self, name):
+        return getattr(current_app.extensions["timelines"], name)
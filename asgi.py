@@ -0,0 +1,7 @@
+from app.asgi import create_asgi_app
+
+application = create_asgi_app()
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(application)
@@ -0,0 +1,80 @@
+"""
+Bytes on the wire and CPU cost of each response encoding and level.
+
+Serializes a GET /tweets-like page of --tweets tweets (no database needed), then
+for every available codec and level reports the compressed size, the ratio and
+the median time to compress and decompress it.
+
+    DATABASE_URL=sqlite:// python benchmarks/compression.py --tweets 1000
+"""
+
+import argparse
+import gzip
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from app.apis.tweets import page_model  # noqa: E402
+from app.cache import dump_json  # noqa: E402
+from app.compression import CODECS  # noqa: E402
+from app.serializers import serialize  # noqa: E402
+from serialization import make_page  # noqa: E402
+
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 6, 9, 11), "zstd": (1, 3, 9, 19)}
+
+
+def decompressor(encoding):
+    if encoding == "br":
+        import brotli
+
+        return brotli.decompress
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress
+    return gzip.decompress
+
+
+def median_ms(function, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tweets", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        body = dump_json(serialize(make_page(args.tweets), page_model)).encode()
+
+    print(f"tweets={args.tweets} identity={len(body)} bytes")
+    print(
+        f"{'encoding':>8} {'level':>5} {'bytes':>9} {'ratio':>6} "
+        f"{'comp ms':>8} {'decomp ms':>9}"
+    )
+    for encoding, (compress, _) in CODECS.items():
+        decompress = decompressor(encoding)
+        for level in LEVELS[encoding]:
+            compressed = compress(body, level)
+            assert decompress(compressed) == body
+            print(
+                f"{encoding:>8} {level:>5} {len(compressed):>9} "
+                f"{len(body) / len(compressed):>6.1f} "
+                f"{median_ms(lambda d: compress(d, level), body, args.repeat):>8} "
+                f"{median_ms(decompress, compressed, args.repeat):>9}"
+            )
+
+
+if __name__ == "__main__":
+    main()
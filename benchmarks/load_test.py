@@ -0,0 +1,663 @@
+"""
+Seed a database, then load-test every tweets and users route against it.
+
+Bulk-loads --users users, --tweets tweets and --follows follows per new user
+(COPY on PostgreSQL, multi-row inserts elsewhere; existing rows are kept, so a
+rerun only tops the tables up). Then --concurrency workers send a weighted mix
+of requests for --duration seconds, through the app in-process or over HTTP to
+--url, e.g. a gunicorn started on the same database.
+
+Per route, reports throughput, p50/p95/p99 latency and SQL statements per
+request (read from /metrics, so PROMETHEUS_MULTIPROC_DIR must be set for a
+multi-worker gunicorn). --output writes the results as JSON; --compare prints
+the change from an earlier file and exits with 1 if a p95 regressed by more
+than --threshold percent.
+
+    DATABASE_URL=postgresql://localhost/twitter_api_bench \\
+        python benchmarks/load_test.py --users 100000 --tweets 10000000 \\
+        --url http://localhost:8000 --output results.json
+    DATABASE_URL=sqlite:///bench.sqlite3 \\
+        python benchmarks/load_test.py --compare results.json
+
+In-process runs share one GIL, so they compare commits rather than measure
+capacity. SQLite needs a file database there: workers run on their own threads.
+Whole-table routes (GET /users and the exports) have no weight by default; add
+one with e.g. `--weight "GET /users/export=1"`. With AUTH_MODE set, pass a
+seeded key with --api-key ("key<user id>") and mind the rate limits.
+"""
+
+import argparse
+import csv
+import http.client
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prometheus_client.parser import text_string_to_metric_families  # noqa: E402
+from sqlalchemy import func, insert, text  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.auth import hash_key  # noqa: E402
+from app.models import Follow, Tweet, User  # noqa: E402
+from search_latency import VOCABULARY, WEIGHTS  # noqa: E402
+
+# Rows generated and loaded at a time
+CHUNK_SIZE = 100000
+
+
+def chunks(rows, size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_load(table, columns, rows):
+    """Load the `rows` tuples into `table`, with COPY on PostgreSQL"""
+    loaded = 0
+    for chunk in chunks(rows):
+        if db.engine.dialect.name == "postgresql":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(chunk)
+            buffer.seek(0)
+            connection = db.engine.raw_connection()
+            try:
+                connection.cursor().copy_expert(
+                    f"COPY {table.name} ({', '.join(columns)}) "
+                    "FROM STDIN WITH (FORMAT csv)",
+                    buffer,
+                )
+                connection.commit()
+            finally:
+                connection.close()
+        else:
+            db.session.execute(
+                insert(table), [dict(zip(columns, row)) for row in chunk]
+            )
+            db.session.commit()
+        loaded += len(chunk)
+        print(f"{table.name}: loaded {loaded}", file=sys.stderr)
+
+
+def seed(users, tweets, follows):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    first_user = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+    missing = users - db.session.query(func.count(User.id)).scalar()
+    new_users = range(first_user, first_user + max(missing, 0))
+    bulk_load(
+        User.__table__,
+        ("id", "username", "email", "api_key", "updated_at", "version"),
+        (
+            (i, f"bench{i}", f"bench{i}@example.com", hash_key(f"key{i}"), now, 1)
+            for i in new_users
+        ),
+    )
+    user_ids = [user_id for (user_id,) in db.session.query(User.id)]
+
+    first_tweet = (db.session.query(func.max(Tweet.id)).scalar() or 0) + 1
+    missing = tweets - db.session.query(func.count(Tweet.id)).scalar()
+    missing = max(missing, 0)
+    # A year of tweets, in id order like real ones
+    start, step = now - timedelta(days=365), timedelta(days=365) / max(missing, 1)
+    bulk_load(
+        Tweet.__table__,
+        ("id", "text", "created_at", "updated_at", "version", "user_id"),
+        (
+            (
+                first_tweet + i,
+                " ".join(rng.choices(VOCABULARY, WEIGHTS, k=rng.randint(5, 25))),
+                start + step * i,
+                start + step * i,
+                1,
+                rng.choice(user_ids),
+            )
+            for i in range(missing)
+        ),
+    )
+
+    bulk_load(
+        Follow.__table__,
+        ("follower_id", "followee_id", "created_at"),
+        (
+            (follower_id, followee_id, now)
+            for follower_id in new_users
+            for followee_id in set(rng.sample(user_ids, min(follows, len(user_ids))))
+            if followee_id != follower_id
+        ),
+    )
+
+    if db.engine.dialect.name == "postgresql":
+        # COPY set the ids, so move the sequences past them
+        for table in ("users", "tweets"):
+            db.session.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"(SELECT coalesce(max(id), 1) FROM {table}))"
+                )
+            )
+        db.session.commit()
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT").execute(
+                text("ANALYZE")
+            )
+
+
+class State:
+    """What the scenarios pick their ids from, shared by all workers"""
+
+    def __init__(self, user_ids, tweet_ids):
+        self.user_ids = user_ids  # (min, max)
+        self.tweet_ids = tweet_ids
+        # Created during the run, so deleting them leaves the seeded rows alone
+        self.created_users = deque()
+        self.created_tweets = deque()
+
+    def user(self, rng):
+        return rng.randint(*self.user_ids)
+
+    def tweet(self, rng):
+        return rng.randint(*self.tweet_ids)
+
+
+def pop(ids):
+    try:
+        return ids.popleft()
+    except IndexError:
+        return None
+
+
+def tweet_body(rng, state):
+    text = " ".join(rng.choices(VOCABULARY, WEIGHTS, k=rng.randint(5, 25)))
+    return {"text": text, "user_id": state.user(rng)}
+
+
+def user_body():
+    name = f"load-{uuid.uuid4().hex[:12]}"
+    return {"username": name, "email": f"{name}@example.com"}
+
+
+def delete_created(path, ids):
+    """Build DELETE requests for ids created during the run"""
+
+    def build(rng):  # pylint: disable=unused-argument
+        row_id = pop(ids)
+        return None if row_id is None else ("DELETE", path.format(row_id), None)
+
+    return build
+
+
+def created(ids):
+    def remember(status, payload):
+        if status == 200 and payload and "id" in payload:
+            ids.append(payload["id"])
+
+    return remember
+
+
+def scenarios(state):
+    """
+    Name -> (weight, /metrics labels, build(rng) -> request or None, on_response).
+
+    A request is (method, path, JSON body); None skips the turn.
+    """
+    return {
+        "GET /tweets": (
+            10,
+            ("tweets", "TweetMain", "GET"),
+            lambda rng: ("GET", "/tweets?limit=20", None),
+            None,
+        ),
+        "POST /tweets": (
+            4,
+            ("tweets", "TweetMain", "POST"),
+            lambda rng: ("POST", "/tweets", tweet_body(rng, state)),
+            created(state.created_tweets),
+        ),
+        "POST /tweets/batch": (
+            1,
+            ("tweets", "TweetBatch", "POST"),
+            lambda rng: (
+                "POST",
+                "/tweets/batch",
+                [tweet_body(rng, state) for _ in range(50)],
+            ),
+            None,
+        ),
+        "GET /tweets/search": (
+            3,
+            ("tweets", "TweetSearch", "GET"),
+            lambda rng: (
+                "GET",
+                f"/tweets/search?q={rng.choices(VOCABULARY, WEIGHTS)[0]}",
+                None,
+            ),
+            None,
+        ),
+        "GET /tweets/ingest": (
+            1,
+            ("tweets", "TweetIngest", "GET"),
+            lambda rng: ("GET", "/tweets/ingest", None),
+            None,
+        ),
+        "GET /tweets/export": (
+            0,
+            ("tweets", "TweetExport", "GET"),
+            lambda rng: ("GET", "/tweets/export", None),
+            None,
+        ),
+        "GET /tweets/<id>": (
+            20,
+            ("tweets", "TweetById", "GET"),
+            lambda rng: ("GET", f"/tweets/{state.tweet(rng)}", None),
+            None,
+        ),
+        "PATCH /tweets/<id>": (
+            2,
+            ("tweets", "TweetById", "PATCH"),
+            lambda rng: (
+                "PATCH",
+                f"/tweets/{state.tweet(rng)}",
+                {"text": tweet_body(rng, state)["text"]},
+            ),
+            None,
+        ),
+        "DELETE /tweets/<id>": (
+            1,
+            ("tweets", "TweetById", "DELETE"),
+            delete_created("/tweets/{}", state.created_tweets),
+            None,
+        ),
+        "POST /users": (
+            1,
+            ("users", "UserMain", "POST"),
+            lambda rng: ("POST", "/users", user_body()),
+            created(state.created_users),
+        ),
+        "GET /users": (
+            0,
+            ("users", "UserMain", "GET"),
+            lambda rng: ("GET", "/users", None),
+            None,
+        ),
+        "POST /users/batch": (
+            1,
+            ("users", "UserBatch", "POST"),
+            lambda rng: ("POST", "/users/batch", [user_body() for _ in range(20)]),
+            None,
+        ),
+        "GET /users/export": (
+            0,
+            ("users", "UserExport", "GET"),
+            lambda rng: ("GET", "/users/export", None),
+            None,
+        ),
+        "GET /users/<id>": (
+            10,
+            ("users", "UserById", "GET"),
+            lambda rng: ("GET", f"/users/{state.user(rng)}", None),
+            None,
+        ),
+        "PATCH /users/<id>": (
+            1,
+            ("users", "UserById", "PATCH"),
+            lambda rng: (
+                "PATCH",
+                f"/users/{state.user(rng)}",
+                {"email": f"{uuid.uuid4().hex[:12]}@example.com"},
+            ),
+            None,
+        ),
+        "DELETE /users/<id>": (
+            1,
+            ("users", "UserById", "DELETE"),
+            delete_created("/users/{}", state.created_users),
+            None,
+        ),
+        "GET /users/<id>/tweets": (
+            8,
+            ("users", "UserTweets", "GET"),
+            lambda rng: ("GET", f"/users/{state.user(rng)}/tweets?limit=20", None),
+            None,
+        ),
+        "PUT /users/<id>/following/<id>": (
+            2,
+            ("users", "UserFollowing", "PUT"),
+            lambda rng: (
+                "PUT",
+                f"/users/{state.user(rng)}/following/{state.user(rng)}",
+                None,
+            ),
+            None,
+        ),
+        "DELETE /users/<id>/following/<id>": (
+            1,
+            ("users", "UserFollowing", "DELETE"),
+            lambda rng: (
+                "DELETE",
+                f"/users/{state.user(rng)}/following/{state.user(rng)}",
+                None,
+            ),
+            None,
+        ),
+        "GET /users/<id>/timeline": (
+            8,
+            ("users", "UserTimeline", "GET"),
+            lambda rng: ("GET", f"/users/{state.user(rng)}/timeline", None),
+            None,
+        ),
+    }
+
+
+class InProcessClient:
+    def __init__(self, app, headers):
+        self.client = app.test_client()
+        self.headers = headers
+
+    def request(self, method, path, body=None):
+        response = self.client.open(
+            path, method=method, json=body, headers=self.headers
+        )
+        return response.status_code, response.data
+
+    def close(self):
+        pass
+
+
+class HTTPClient:
+    """One keep-alive connection to --url"""
+
+    def __init__(self, url, headers):
+        url = urlsplit(url)
+        connection_class = (
+            http.client.HTTPSConnection
+            if url.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.connection = connection_class(url.hostname, url.port, timeout=60)
+        self.prefix = url.path.rstrip("/")
+        self.headers = headers
+
+    def request(self, method, path, body=None):
+        headers = dict(self.headers)
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        try:
+            self.connection.request(method, self.prefix + path, data, headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            raise
+
+    def close(self):
+        self.connection.close()
+
+
+def statements_per_request(client):
+    """(namespace, resource, method) -> (SQL statements, requests) so far"""
+    status, body = client.request("GET", "/metrics")
+    if status != 200:
+        return {}
+    totals = {}
+    for family in text_string_to_metric_families(body.decode()):
+        if family.name != "sqlalchemy_statements_per_request":
+            continue
+        for sample in family.samples:
+            labels = sample.labels
+            key = (labels["namespace"], labels["resource"], labels["method"])
+            statements, requests = totals.get(key, (0, 0))
+            if sample.name.endswith("_sum"):
+                statements += sample.value
+            elif sample.name.endswith("_count"):
+                requests += sample.value
+            totals[key] = (statements, requests)
+    return totals
+
+
+def work(client, routes, recording, deadline, seed, samples):
+    """Send requests until `deadline`, recording those sent after `recording`"""
+    rng = random.Random(seed)
+    names = [name for name, route in routes.items() if route[0] > 0]
+    weights = [routes[name][0] for name in names]
+    while time.perf_counter() < deadline:
+        name = rng.choices(names, weights)[0]
+        _, _, build, on_response = routes[name]
+        request = build(rng)
+        if request is None:
+            continue
+        started = time.perf_counter()
+        try:
+            status, body = client.request(*request)
+        except (OSError, http.client.HTTPException):
+            status, body = 0, b""
+        elapsed = time.perf_counter() - started
+        if started >= recording:
+            samples.setdefault(name, []).append((elapsed, status))
+        if on_response is not None and body:
+            try:
+                on_response(status, json.loads(body))
+            except ValueError:
+                pass
+    client.close()
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted `values`"""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(samples, seconds, queries=None):
+    latencies = sorted(elapsed * 1000 for elapsed, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, status in samples if status == 0 or status >= 500),
+        "statuses": dict(sorted(statuses.items())),
+        "throughput_rps": round(len(samples) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "queries_per_request": queries,
+    }
+
+
+def run(make_client, routes, concurrency, duration, warmup):
+    """Drive `routes` with `concurrency` workers; results per route, and in total"""
+    before = statements_per_request(make_client())
+    now = time.perf_counter()
+    recording, deadline = now + warmup, now + warmup + duration
+    per_worker = [{} for _ in range(concurrency)]
+    workers = [
+        threading.Thread(
+            target=work,
+            args=(make_client(), routes, recording, deadline, seed, per_worker[seed]),
+        )
+        for seed in range(concurrency)
+    ]
+    for worker in workers:
+        worker.start()
+    # Statement counts from the warmup are left out by reading them at its end
+    time.sleep(warmup)
+    before = statements_per_request(make_client()) or before
+    for worker in workers:
+        worker.join()
+    after = statements_per_request(make_client())
+
+    results, everything = {}, []
+    for name, (_, labels, _, _) in routes.items():
+        samples = [sample for worker in per_worker for sample in worker.get(name, ())]
+        if not samples:
+            continue
+        everything.extend(samples)
+        statements, requests = (
+            after.get(labels, (0, 0))[i] - before.get(labels, (0, 0))[i] for i in (0, 1)
+        )
+        queries = round(statements / requests, 2) if requests else None
+        results[name] = summarize(samples, duration, queries)
+    total = summarize(everything, duration) if everything else None
+    return results, total
+
+
+def git_commit():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=root,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=root,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def print_results(results, total):
+    print(
+        f"{'route':<36} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        f" {'SQL/req':>8} {'errors':>7}"
+    )
+    for name, result in list(results.items()) + [("total", total)]:
+        if result is None:
+            continue
+        queries = result["queries_per_request"]
+        print(
+            f"{name:<36} {result['throughput_rps']:>8} {result['p50_ms']:>8}"
+            f" {result['p95_ms']:>8} {result['p99_ms']:>8}"
+            f" {'-' if queries is None else queries:>8} {result['errors']:>7}"
+        )
+
+
+def compare(baseline, results, threshold):
+    """Print the change from `baseline`; True if a p95 got worse than `threshold`%"""
+    print(f"\nchange from {baseline.get('commit') or 'baseline'}:")
+    regressed = False
+    for name, result in results.items():
+        before = baseline["routes"].get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if before[key]:
+                changes.append(f"{key} {(result[key] / before[key] - 1) * 100:+.1f}%")
+        worse = before["p95_ms"] and result["p95_ms"] > before["p95_ms"] * (
+            1 + threshold / 100
+        )
+        regressed = regressed or bool(worse)
+        print(f"{name:<36} {'  '.join(changes)}{'  REGRESSED' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--tweets", type=int, default=1000000)
+    parser.add_argument("--follows", type=int, default=20, help="Per new user")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds")
+    parser.add_argument("--url", help="Load-test this server instead of in-process")
+    parser.add_argument("--api-key", help="Sent as X-API-Key")
+    parser.add_argument(
+        "--weight",
+        action="append",
+        default=[],
+        metavar="ROUTE=WEIGHT",
+        help='Change a route\'s share of requests, e.g. "GET /tweets=0"',
+    )
+    parser.add_argument("--skip-seed", action="store_true")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run")
+    parser.add_argument("--threshold", type=float, default=10, help="Percent")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            db.create_all()
+        if not args.skip_seed:
+            seed(args.users, args.tweets, args.follows)
+        user_ids = db.session.query(func.min(User.id), func.max(User.id)).one()
+        tweet_ids = db.session.query(func.min(Tweet.id), func.max(Tweet.id)).one()
+        counts = {
+            "users": db.session.query(func.count(User.id)).scalar(),
+            "tweets": db.session.query(func.count(Tweet.id)).scalar(),
+            "follows": db.session.query(func.count()).select_from(Follow).scalar(),
+        }
+        dialect = db.engine.dialect.name
+        db.session.remove()
+    if None in user_ids or None in tweet_ids:
+        parser.error("nothing to load-test: seed some users and tweets first")
+
+    routes = scenarios(State(tuple(user_ids), tuple(tweet_ids)))
+    for weight in args.weight:
+        name, _, value = weight.rpartition("=")
+        if name not in routes:
+            parser.error(f"unknown route {name!r}; choose from {', '.join(routes)}")
+        routes[name] = (int(value),) + routes[name][1:]
+    if not any(route[0] > 0 for route in routes.values()):
+        parser.error("every route has a weight of 0")
+
+    headers = {"X-API-Key": args.api_key} if args.api_key else {}
+    if args.url:
+        make_client = lambda: HTTPClient(args.url, headers)  # noqa: E731
+    else:
+        make_client = lambda: InProcessClient(app, headers)  # noqa: E731
+
+    results, total = run(
+        make_client, routes, args.concurrency, args.duration, args.warmup
+    )
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "target": args.url or "in-process",
+        "dialect": dialect,
+        "rows": counts,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "routes": results,
+        "total": total,
+    }
+    print(f"commit={report['commit']} target={report['target']} {dialect} {counts}")
+    print_results(results, total)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(json.load(f), results, args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Compare GET /tweets/search latency with a naive ILIKE '%q%' scan.
+
+Seeds the tweets table up to --rows rows of random text, then times both queries
+for a mix of frequent and rare words. On PostgreSQL, run the migrations first
+(`python manage.py db upgrade`) so the tsvector column, trigger and GIN index
+exist; on SQLite the in-process inverted index is measured instead.
+
+    DATABASE_URL=postgresql://localhost/twitter_api_bench \\
+        python benchmarks/search_latency.py --rows 1000000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, insert  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.models import Tweet, User  # noqa: E402
+from app.search import search_tweets  # noqa: E402
+
+VOCABULARY = [f"word{i}" for i in range(5000)]
+# Zipf-like weights, so a few words are very common and most are rare
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+def seed(rows, batch_size=10000):
+    existing = db.session.query(func.count(Tweet.id)).scalar()
+    if existing >= rows:
+        return
+    user = User(username=f"bench-{time.time()}", email="bench@test.com")
+    db.session.add(user)
+    db.session.commit()
+
+    rng = random.Random(42)
+    for start in range(existing, rows, batch_size):
+        batch = [
+            {
+                "text": " ".join(
+                    rng.choices(VOCABULARY, WEIGHTS, k=rng.randint(5, 25))
+                ),
+                "user_id": user.id,
+            }
+            for _ in range(min(batch_size, rows - start))
+        ]
+        db.session.execute(insert(Tweet), batch)
+        db.session.commit()
+        print(f"seeded {start + len(batch)}/{rows}", file=sys.stderr)
+
+
+def ilike_scan(word, limit):
+    return (
+        db.session.query(Tweet)
+        .filter(Tweet.text.ilike(f"%{word}%"))
+        .order_by(Tweet.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def measure(search, words, limit, repeat):
+    timings = []
+    for _ in range(repeat):
+        for word in words:
+            start = time.perf_counter()
+            search(word, limit)
+            timings.append((time.perf_counter() - start) * 1000)
+            db.session.rollback()
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 2),
+        "max_ms": round(timings[-1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            db.create_all()
+        seed(args.rows)
+        # Frequent words match many rows, rare ones force the scan to go far
+        words = ["word0", "word3", "word50", "word900", "word4999"]
+        # Warm up (builds the in-process index on SQLite)
+        search_tweets(words[0], args.limit)
+
+        print(f"dialect={db.engine.dialect.name} rows={args.rows}")
+        for name, search in (("full-text", search_tweets), ("ilike", ilike_scan)):
+            print(f"{name:>10}: {measure(search, words, args.limit, args.repeat)}")
+
+
+if __name__ == "__main__":
+    main()
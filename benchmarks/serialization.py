@@ -0,0 +1,89 @@
+"""
+Compare serializing a 10k-tweet page with flask-restx and the compiled serializer.
+
+Builds the tweets in memory (no database needed), checks that both paths produce
+the same bytes, then times marshal + json against the compiled serializer with
+the stdlib encoder and, when installed, orjson.
+
+    DATABASE_URL=sqlite:// python benchmarks/serialization.py --tweets 10000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_restx import marshal  # noqa: E402
+
+from app import create_app  # noqa: E402
+from app.apis.tweets import page_model  # noqa: E402
+from app.cache import dump_json  # noqa: E402
+from app.models import Tweet, User  # noqa: E402
+from app.serializers import serialize  # noqa: E402
+
+
+def make_page(count):
+    users = [
+        User(id=i, username=f"user{i}", email=f"user{i}@test.com") for i in range(100)
+    ]
+    start = datetime(2020, 10, 8, 14, 35)
+    tweets = [
+        Tweet(
+            id=i,
+            text=f"tweet number {i} " * 5,
+            created_at=start + timedelta(seconds=i, microseconds=i),
+            user=users[i % len(users)],
+        )
+        for i in range(count)
+    ]
+    return {"tweets": tweets, "next_cursor": "MjAyMC0xMC0wOFQxNDozNTowMHw5OTk5"}
+
+
+def measure(encode, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        encode(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(timings), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tweets", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app()
+    data = make_page(args.tweets)
+    with app.app_context():
+        restx = dump_json(marshal(data, page_model))
+        compiled = dump_json(serialize(data, page_model))
+        assert restx == compiled, "compiled serializer output differs"
+
+        results = {
+            "marshal+json": measure(
+                lambda d: dump_json(marshal(d, page_model)), data, args.repeat
+            ),
+            "compiled+json": measure(
+                lambda d: dump_json(serialize(d, page_model)), data, args.repeat
+            ),
+        }
+        app.config["JSON_ENCODER"] = "orjson"
+        if dump_json({"a": 1}) == '{"a":1}\n':
+            results["compiled+orjson"] = measure(
+                lambda d: dump_json(serialize(d, page_model)), data, args.repeat
+            )
+
+    baseline = results["marshal+json"]
+    print(f"tweets={args.tweets} bytes={len(restx)} (identical)")
+    for name, median_ms in results.items():
+        print(f"{name:>16}: {median_ms:8.2f} ms  x{baseline / median_ms:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Round trips per write: the ORM load-mutate-commit pattern vs single statements.
+
+Seeds 4 * --repeat users with a tweet each, then for each write (create, update
+and delete a tweet, update and delete a user) runs --repeat times both the
+former handler pattern (load by id, mutate, commit, reload to serialize) and the
+current handler through the test client. Reports the SQL statements per
+write and the median time spent in the database, measured around cursor
+executes so HTTP and serialization overheads don't count.
+
+    DATABASE_URL=postgresql://localhost/twitter_api_bench \\
+        python benchmarks/write_round_trips.py --repeat 200
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, insert  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from app.models import Tweet, User  # noqa: E402
+
+
+class StatementTimer:
+    """Count the statements run on `engine`, and the time spent executing them"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = 0
+        self.seconds = 0.0
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["bench_started"] = time.perf_counter()
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+        self.seconds += time.perf_counter() - conn.info.pop("bench_started")
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self.before)
+        event.listen(self.engine, "after_cursor_execute", self.after)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self.before)
+        event.remove(self.engine, "after_cursor_execute", self.after)
+
+
+def seed(users):
+    prefix = f"bench-{time.time()}"
+    user_ids = (
+        db.session.execute(
+            insert(User).returning(User.id),
+            [
+                {"username": f"{prefix}-{i}", "email": f"{i}@bench.test"}
+                for i in range(users)
+            ],
+        )
+        .scalars()
+        .all()
+    )
+    tweet_ids = (
+        db.session.execute(
+            insert(Tweet).returning(Tweet.id),
+            [{"text": "benchmark tweet", "user_id": user_id} for user_id in user_ids],
+        )
+        .scalars()
+        .all()
+    )
+    db.session.commit()
+    return prefix, user_ids, tweet_ids
+
+
+# The former handlers: load, check, mutate, commit, then touch the attributes
+# the response serializes, which expire_on_commit reloads
+
+
+def orm_create_tweet(user_id):
+    if db.session.get(User, user_id) is None:
+        raise LookupError(user_id)
+    tweet = Tweet(text="benchmark tweet", user_id=user_id)
+    db.session.add(tweet)
+    db.session.commit()
+    return tweet.id, tweet.user.username
+
+
+def orm_update_tweet(tweet_id):
+    tweet = db.session.get(Tweet, tweet_id)
+    tweet.text = "updated"
+    db.session.commit()
+    return tweet.text, tweet.user.username
+
+
+def orm_delete_tweet(tweet_id):
+    tweet = db.session.get(Tweet, tweet_id)
+    db.session.delete(tweet)
+    db.session.commit()
+
+
+def orm_update_user(user_id, username):
+    user = db.session.get(User, user_id)
+    user.username = username
+    db.session.commit()
+    return user.username, user.email
+
+
+def orm_delete_user(user_id):
+    user = db.session.get(User, user_id)
+    db.session.query(Tweet).filter(Tweet.user_id == user_id).delete()
+    db.session.delete(user)
+    db.session.commit()
+
+
+def measure(write, args_list):
+    """Statements per call and median database milliseconds of `write`"""
+    statements, timings = [], []
+    for args in args_list:
+        with StatementTimer(db.engine) as timer:
+            write(*args)
+        db.session.remove()
+        statements.append(timer.statements)
+        timings.append(timer.seconds * 1000)
+    return {
+        "statements": round(statistics.mean(statements), 2),
+        "db_p50_ms": round(statistics.median(timings), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    app = create_app()
+    client = app.test_client()
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            db.create_all()
+        # Each write gets 2 * repeat rows, half for each pattern; deletes use
+        # rows of their own, and run after the updates
+        prefix, user_ids, tweet_ids = seed(4 * args.repeat)
+        rows = 2 * args.repeat
+
+        def request(method, path, **kwargs):
+            response = client.open(path, method=method, **kwargs)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method} {path}: {response.status_code}")
+
+        writes = [
+            (
+                "POST /tweets",
+                orm_create_tweet,
+                lambda user_id: request(
+                    "POST",
+                    "/tweets",
+                    json={"text": "benchmark tweet", "user_id": user_id},
+                ),
+                [(user_id,) for user_id in user_ids[:rows]],
+            ),
+            (
+                "PATCH /tweets/<id>",
+                orm_update_tweet,
+                lambda tweet_id: request(
+                    "PATCH", f"/tweets/{tweet_id}", json={"text": "updated"}
+                ),
+                [(tweet_id,) for tweet_id in tweet_ids[:rows]],
+            ),
+            (
+                "DELETE /tweets/<id>",
+                orm_delete_tweet,
+                lambda tweet_id: request("DELETE", f"/tweets/{tweet_id}"),
+                [(tweet_id,) for tweet_id in tweet_ids[:rows]],
+            ),
+            (
+                "PATCH /users/<id>",
+                orm_update_user,
+                lambda user_id, username: request(
+                    "PATCH", f"/users/{user_id}", json={"username": username}
+                ),
+                [(user_id, f"{prefix}-u{user_id}") for user_id in user_ids[:rows]],
+            ),
+            (
+                "DELETE /users/<id>",
+                orm_delete_user,
+                lambda user_id: request("DELETE", f"/users/{user_id}"),
+                [(user_id,) for user_id in user_ids[rows:]],
+            ),
+        ]
+
+        print(f"dialect={db.engine.dialect.name} repeat={args.repeat}")
+        for name, orm_write, handler, args_list in writes:
+            middle = len(args_list) // 2
+            before = measure(orm_write, args_list[:middle])
+            after = measure(handler, args_list[middle:])
+            print(f"{name:>20}: before={before} after={after}")
+
+
+if __name__ == "__main__":
+    main()
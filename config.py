@@ -1,6 +1,157 @@
 import os
 
+# Connection pool defaults per APP_ENV; each can be overridden by its own env var.
+# Production sizes assume a few gunicorn workers sharing one PostgreSQL server.
+POOL_PROFILES = {
+    "development": {
+        "DB_POOL_SIZE": 2,
+        "DB_MAX_OVERFLOW": 2,
+        "DB_POOL_TIMEOUT": 10,
+        "DB_STATEMENT_TIMEOUT_MS": 0,
+    },
+    "testing": {
+        "DB_POOL_SIZE": 1,
+        "DB_MAX_OVERFLOW": 0,
+        "DB_POOL_TIMEOUT": 5,
+        "DB_STATEMENT_TIMEOUT_MS": 0,
+    },
+    "production": {
+        "DB_POOL_SIZE": 10,
+        "DB_MAX_OVERFLOW": 10,
+        "DB_POOL_TIMEOUT": 5,
+        "DB_STATEMENT_TIMEOUT_MS": 5000,
+    },
+}
+
 
 class Config(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = os.environ["DATABASE_URL"]
+    # Selects the POOL_PROFILES entry used for the DB_POOL_* defaults below
+    APP_ENV = os.environ.get("APP_ENV", "development")
+    _pool = POOL_PROFILES[APP_ENV]
+    # Persistent connections per process, plus bursts of up to DB_MAX_OVERFLOW
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", _pool["DB_POOL_SIZE"]))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", _pool["DB_MAX_OVERFLOW"]))
+    # Seconds a request waits for a free connection before failing
+    DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", _pool["DB_POOL_TIMEOUT"]))
+    # Reconnect after this many seconds, before server or proxy idle timeouts do
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    # Test connections on checkout so a restarted server doesn't fail requests
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") == "1"
+    # PostgreSQL statement_timeout for every connection; 0 disables it
+    DB_STATEMENT_TIMEOUT_MS = int(
+        os.environ.get("DB_STATEMENT_TIMEOUT_MS", _pool["DB_STATEMENT_TIMEOUT_MS"])
+    )
+    del _pool
+    # Read replicas for GET handlers, comma-separated (see app.replicas)
+    DATABASE_REPLICA_URLS = [
+        url.strip()
+        for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",")
+        if url.strip()
+    ]
+    # Replicas further behind are skipped. Also how long a client's reads stay on
+    # the primary after it writes, so it sees its own writes.
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 5))
+    # Seconds between health and lag checks of the replicas
+    REPLICA_CHECK_INTERVAL = float(os.environ.get("REPLICA_CHECK_INTERVAL", 10))
+    # Rows fetched per round trip (and written per chunk) by /export routes
+    EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+    # Largest array accepted by POST /tweets/batch
+    TWEET_BATCH_MAX_SIZE = int(os.environ.get("TWEET_BATCH_MAX_SIZE", 1000))
+    # Rows written per transaction by POST /users/batch
+    USER_IMPORT_CHUNK_SIZE = int(os.environ.get("USER_IMPORT_CHUNK_SIZE", 1000))
+    # DELETE /users/<id>?purge=background deletes this many tweets per transaction
+    USER_PURGE_CHUNK_SIZE = int(os.environ.get("USER_PURGE_CHUNK_SIZE", 5000))
+    # Seconds between those transactions
+    USER_PURGE_PAUSE = float(os.environ.get("USER_PURGE_PAUSE", 0.1))
+    # Monthly tweets partitions on PostgreSQL (see app.partitions): months
+    # created ahead by `manage.py partitions`, and months kept (0 keeps all)
+    TWEET_PARTITION_MONTHS_AHEAD = int(
+        os.environ.get("TWEET_PARTITION_MONTHS_AHEAD", 3)
+    )
+    TWEET_PARTITION_RETENTION_MONTHS = int(
+        os.environ.get("TWEET_PARTITION_RETENTION_MONTHS", 0)
+    )
+    # Older partitions are detached, then "detach" leaves them as tables,
+    # "archive" moves them to TWEET_PARTITION_ARCHIVE_SCHEMA and "drop" drops them
+    TWEET_PARTITION_ARCHIVE_ACTION = os.environ.get(
+        "TWEET_PARTITION_ARCHIVE_ACTION", "archive"
+    )
+    TWEET_PARTITION_ARCHIVE_SCHEMA = os.environ.get(
+        "TWEET_PARTITION_ARCHIVE_SCHEMA", "archive"
+    )
+    # GET /tweets/stream: "postgres" (LISTEN/NOTIFY, sees every worker's writes),
+    # "memory" (each worker's own writes) or "auto" (postgres on PostgreSQL)
+    TWEET_STREAM_BACKEND = os.environ.get("TWEET_STREAM_BACKEND", "auto")
+    # Events buffered per subscriber; a slower one is disconnected to catch up
+    TWEET_STREAM_BUFFER = int(os.environ.get("TWEET_STREAM_BUFFER", 1000))
+    # Clients further behind get 410 Gone, and reload GET /tweets instead
+    TWEET_STREAM_CATCHUP_MAX = int(os.environ.get("TWEET_STREAM_CATCHUP_MAX", 1000))
+    # Seconds between keepalive comments on idle streams
+    TWEET_STREAM_HEARTBEAT = float(os.environ.get("TWEET_STREAM_HEARTBEAT", 15))
+    # Catching up stops at changes younger than this: one with a lower id may
+    # still be committing. Transactions recording changes must commit within it.
+    TWEET_STREAM_SETTLE_SECONDS = float(
+        os.environ.get("TWEET_STREAM_SETTLE_SECONDS", 5)
+    )
+    # Milliseconds clients wait before reconnecting
+    TWEET_STREAM_RETRY_MS = int(os.environ.get("TWEET_STREAM_RETRY_MS", 3000))
+    # Changes older than this are deleted by `manage.py prune_changes`
+    TWEET_CHANGES_RETENTION_HOURS = int(
+        os.environ.get("TWEET_CHANGES_RETENTION_HOURS", 24)
+    )
+    # Serialized GET /tweets/<id> and GET /users/<id> bodies: "memory" or "redis"
+    CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+    CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+    CACHE_TTL = int(os.environ.get("CACHE_TTL", 300))
+    CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 10000))
+    # Precomputed home timelines: "memory" (a single process only) or "redis"
+    TIMELINE_BACKEND = os.environ.get("TIMELINE_BACKEND", "memory")
+    TIMELINE_REDIS_URL = os.environ.get("TIMELINE_REDIS_URL", CACHE_REDIS_URL)
+    TIMELINE_MAX_LENGTH = int(os.environ.get("TIMELINE_MAX_LENGTH", 800))
+    # Authors with more followers are merged in at read time instead
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get("TIMELINE_FANOUT_LIMIT", 10000))
+    # "async" makes POST /tweets queue the write and answer 202 (see app.ingest)
+    TWEET_INGEST_MODE = os.environ.get("TWEET_INGEST_MODE", "sync")
+    INGEST_QUEUE_PATH = os.environ.get("INGEST_QUEUE_PATH", "ingest-queue.sqlite3")
+    INGEST_MAX_DEPTH = int(os.environ.get("INGEST_MAX_DEPTH", 100000))
+    INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 500))
+    INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", 0.5))
+    # Request profiling (app.profiling): any of these enables it.
+    # Fraction of requests to profile, e.g. 0.001
+    PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+    # Keep a profile of every request slower than this; profiles all requests
+    PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 0))
+    # Profile requests whose X-Profile header holds this key; also guards /profiles
+    PROFILE_ADMIN_KEY = os.environ.get("PROFILE_ADMIN_KEY")
+    PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+    # Older profiles are deleted
+    PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+    # "json" (stdlib, byte-identical to flask-restx) or "orjson" (faster, compact;
+    # needs `pip install orjson`, falls back to "json" without it)
+    JSON_ENCODER = os.environ.get("JSON_ENCODER", "json")
+    # Response compression, in order of preference; br and zstd need the
+    # `brotli` and `zstandard` packages. Empty disables compression.
+    COMPRESSION_ENCODINGS = os.environ.get("COMPRESSION_ENCODINGS", "zstd,br,gzip")
+    # Smaller bodies gain little and cost a round of CPU
+    COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+    COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+    COMPRESSION_BR_LEVEL = int(os.environ.get("COMPRESSION_BR_LEVEL", 4))
+    COMPRESSION_ZSTD_LEVEL = int(os.environ.get("COMPRESSION_ZSTD_LEVEL", 3))
+    # API key authentication (X-API-Key header, see app.auth): "off", "writes"
+    # (POST, PUT, PATCH and DELETE need a key) or "all"
+    AUTH_MODE = os.environ.get("AUTH_MODE", "off")
+    # X-Admin-Key header issuing any user's key with POST /users/<id>/key; unset,
+    # users can only rotate their own
+    ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY")
+    # Seconds a resolved key is trusted without asking the database again
+    API_KEY_INDEX_TTL = int(os.environ.get("API_KEY_INDEX_TTL", 60))
+    API_KEY_INDEX_MAX_ENTRIES = int(os.environ.get("API_KEY_INDEX_MAX_ENTRIES", 10000))
+    # Per-key token bucket: requests per second, and the burst allowed above it.
+    # A rate of 0 disables rate limiting.
+    RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", 10))
+    RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 20))
+    # "memory" (one bucket per worker) or "redis" (shared by every worker)
+    RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+    RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", CACHE_REDIS_URL)
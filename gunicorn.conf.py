@@ -0,0 +1,10 @@
+# pylint: disable=missing-docstring
+
+# Read automatically by gunicorn from the working directory.
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    # Drop the live gauges of exited workers from the multi-process metrics
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,8 +1,14 @@
+from datetime import datetime, timedelta
+
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from wsgi import create_app
 from app import db
+from app.apis.users import invalidate_user
+from app.change_log import prune
+from app.partitions import ARCHIVE_ACTIONS, maintain
+from app.purge import PurgeJob
 
 application = create_app()
 
@@ -11,5 +17,36 @@ migrate = Migrate(application, db)
 manager = Manager(application)
 manager.add_command("db", MigrateCommand)
 
+
+@manager.command
+def purge_user(user_id):
+    """Delete a user and their tweets in chunks, printing progress"""
+    job = PurgeJob(
+        application, int(user_id), on_deleted=invalidate_user, on_progress=print
+    )
+    job.run()
+
+
+@manager.option(
+    "-a",
+    "--action",
+    dest="action",
+    choices=ARCHIVE_ACTIONS,
+    help="What to do with expired partitions (TWEET_PARTITION_ARCHIVE_ACTION)",
+)
+def partitions(action=None):
+    """Create upcoming tweets partitions and detach expired ones"""
+    maintain(db.engine, application.config, action)
+
+
+@manager.command
+def prune_changes():
+    """Delete changes older than TWEET_CHANGES_RETENTION_HOURS"""
+    hours = application.config["TWEET_CHANGES_RETENTION_HOURS"]
+    deleted = prune(db.session, datetime.utcnow() - timedelta(hours=hours))
+    db.session.commit()
+    print(f"deleted {deleted} changes")
+
+
 if __name__ == "__main__":
     manager.run()
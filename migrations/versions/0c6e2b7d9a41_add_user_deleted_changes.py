@@ -0,0 +1,46 @@
+"""Let tweet_changes hold user_deleted changes
+
+Revision ID: 0c6e2b7d9a41
+Revises: 775a401ccaac
+Create Date: 2026-10-19 16:20:48.905113
+
+A deleted user's tweets go by ON DELETE CASCADE, and a single "user_deleted"
+change, with no tweet_id, stands for all of them. Both changes only touch the
+catalog.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0c6e2b7d9a41"
+down_revision = "775a401ccaac"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column(
+        "tweet_changes",
+        "action",
+        existing_type=sa.String(length=10),
+        type_=sa.String(length=16),
+        existing_nullable=False,
+    )
+    op.alter_column(
+        "tweet_changes", "tweet_id", existing_type=sa.Integer(), nullable=True
+    )
+
+
+def downgrade():
+    op.execute("DELETE FROM tweet_changes WHERE action = 'user_deleted'")
+    op.alter_column(
+        "tweet_changes", "tweet_id", existing_type=sa.Integer(), nullable=False
+    )
+    op.alter_column(
+        "tweet_changes",
+        "action",
+        existing_type=sa.String(length=16),
+        type_=sa.String(length=10),
+        existing_nullable=False,
+    )
@@ -0,0 +1,59 @@
+"""Add tweet_changes table, notified to GET /tweets/stream
+
+Revision ID: 3a8d6f0c2e19
+Revises: 7c3e9a1f5b20
+Create Date: 2026-10-18 20:31:15.482067
+
+Each change is NOTIFYed on the tweet_changes channel when its transaction
+commits. A NOTIFY payload is limited to 8000 bytes, well above the
+representation of a 280 character tweet and its author.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3a8d6f0c2e19"
+down_revision = "7c3e9a1f5b20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "tweet_changes",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("tweet_id", sa.Integer(), nullable=False),
+        sa.Column("action", sa.String(length=10), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_tweet_changes_created_at", "tweet_changes", ["created_at"], unique=False
+    )
+    op.execute(
+        """
+        CREATE FUNCTION notify_tweet_change() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('tweet_changes', json_build_object(
+                'id', NEW.id, 'action', NEW.action, 'data', NEW.payload
+            )::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        "CREATE TRIGGER tweet_changes_notify "
+        "AFTER INSERT ON tweet_changes FOR EACH ROW EXECUTE PROCEDURE "
+        "notify_tweet_change()"
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER tweet_changes_notify ON tweet_changes")
+    op.execute("DROP FUNCTION notify_tweet_change()")
+    op.drop_index("ix_tweet_changes_created_at", table_name="tweet_changes")
+    op.drop_table("tweet_changes")
@@ -0,0 +1,39 @@
+"""Add tweet_change_prunes, the last change ids deleted by prune_changes
+
+Revision ID: 4b7e1d9c3a58
+Revises: 0c6e2b7d9a41
+Create Date: 2026-10-20 09:12:37.604219
+
+Whether changes after a cursor were pruned used to be told from the oldest
+change left, which ids skipped by the sequence make look pruned. Changes pruned
+before this migration are taken to be those before the oldest change left.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "4b7e1d9c3a58"
+down_revision = "0c6e2b7d9a41"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "tweet_change_prunes",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("through_id", sa.Integer(), nullable=False),
+        sa.Column("deleted", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute(
+        "INSERT INTO tweet_change_prunes (through_id, deleted, created_at) "
+        "SELECT min(id) - 1, 0, now() AT TIME ZONE 'UTC' FROM tweet_changes "
+        "HAVING min(id) > 1"
+    )
+
+
+def downgrade():
+    op.drop_table("tweet_change_prunes")
@@ -0,0 +1,32 @@
+"""Backfill users.updated_at, left NULL by 1b6d93e27f40
+
+Revision ID: 775a401ccaac
+Revises: 9e4b2f6a8c13
+Create Date: 2026-10-19 14:05:22.318940
+
+Users have no created_at to copy, as tweets did, so existing users are stamped
+with the time of this migration: they were last modified no later than that,
+which is all Last-Modified promises.
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "775a401ccaac"
+down_revision = "9e4b2f6a8c13"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # updated_at holds naive UTC times, as written by datetime.utcnow
+    op.execute(
+        "UPDATE users SET updated_at = now() AT TIME ZONE 'UTC' "
+        "WHERE updated_at IS NULL"
+    )
+
+
+def downgrade():
+    # Which rows were backfilled isn't recorded; leaving them stamped is harmless
+    pass
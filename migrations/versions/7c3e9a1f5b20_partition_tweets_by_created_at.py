@@ -0,0 +1,160 @@
+"""Partition tweets by month of created_at
+
+Revision ID: 7c3e9a1f5b20
+Revises: f1b9d4c2a736
+Create Date: 2026-10-18 19:48:03.117942
+
+The existing table is not copied: it becomes the partition of every row before
+the cutover month, so the migration works on a populated table. What scans it
+(validating the bound, indexing (id, created_at)) runs before the swap without
+blocking writes, and the swap itself only takes brief locks.
+
+The primary key of a partitioned table must include the partition key, so it
+becomes (id, created_at). Ids are no longer unique by constraint, only by
+being drawn from the tweets_id_seq sequence: rows inserted with explicit ids
+could repeat one. Run `manage.py partitions` periodically (e.g. daily) to
+create later months.
+
+Needs PostgreSQL 13 or later, the first to allow BEFORE row triggers, like the
+search trigger, on partitioned tables.
+"""
+
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7c3e9a1f5b20"
+down_revision = "f1b9d4c2a736"
+branch_labels = None
+depends_on = None
+
+# BEFORE row triggers on partitioned tables
+MIN_SERVER_VERSION = (13,)
+
+# Monthly partitions created after the cutover one
+MONTHS_AHEAD = 3
+
+COLUMNS = "id, text, created_at, updated_at, version, user_id, search_vector"
+# Indexes of the table, renamed to make way for those of the partitioned table
+INDEXES = {
+    "ix_tweets_created_at_id": "(created_at, id)",
+    "ix_tweets_user_id_created_at_id": "(user_id, created_at DESC, id DESC)",
+    "ix_tweets_search_vector": "USING gin (search_vector)",
+}
+SEARCH_TRIGGER = (
+    "CREATE TRIGGER tweets_search_vector_update "
+    "BEFORE INSERT OR UPDATE OF text ON {table} FOR EACH ROW EXECUTE PROCEDURE "
+    "tsvector_update_trigger(search_vector, 'pg_catalog.english', text)"
+)
+
+
+def month_start(moment, months=0):
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def literal(moment):
+    return f"'{moment:%Y-%m-%d %H:%M:%S}'"
+
+
+def upgrade():
+    version = op.get_bind().dialect.server_version_info
+    if version < MIN_SERVER_VERSION:
+        raise RuntimeError(
+            f"Partitioning tweets needs PostgreSQL 13 or later, not {version}"
+        )
+
+    # Rows keep going to the current table until the cutover; the extra month
+    # covers the inserts made while this migration runs
+    cutover = month_start(datetime.utcnow(), 2)
+
+    # 1. Make the current table fit the legacy partition's bound. The CHECK
+    # lets PostgreSQL skip scanning it when setting NOT NULL and attaching.
+    op.execute(
+        "UPDATE tweets SET created_at = coalesce(updated_at, now() AT TIME ZONE 'utc') "
+        "WHERE created_at IS NULL"
+    )
+    op.execute(
+        "ALTER TABLE tweets ADD CONSTRAINT tweets_legacy_bound "
+        f"CHECK (created_at IS NOT NULL AND created_at < {literal(cutover)}) NOT VALID"
+    )
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TABLE tweets VALIDATE CONSTRAINT tweets_legacy_bound")
+        # Becomes the legacy partition's part of the new primary key
+        op.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY tweets_legacy_id_created_at "
+            "ON tweets (id, created_at)"
+        )
+
+    # 2. The swap, in one short transaction
+    op.execute("ALTER TABLE tweets ALTER COLUMN created_at SET NOT NULL")
+    op.execute("DROP TRIGGER tweets_search_vector_update ON tweets")
+    op.execute("ALTER TABLE tweets RENAME TO tweets_legacy")
+    op.execute("ALTER INDEX tweets_pkey RENAME TO tweets_legacy_pkey")
+    for name in INDEXES:
+        op.execute(
+            f"ALTER INDEX {name} RENAME TO {name.replace('tweets', 'tweets_legacy', 1)}"
+        )
+    op.execute("ALTER TABLE tweets_legacy ALTER COLUMN id DROP DEFAULT")
+
+    op.execute(
+        """
+        CREATE TABLE tweets (
+            id INTEGER NOT NULL DEFAULT nextval('tweets_id_seq'),
+            text VARCHAR(280),
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITHOUT TIME ZONE,
+            version INTEGER NOT NULL DEFAULT 1,
+            user_id INTEGER NOT NULL,
+            search_vector TSVECTOR,
+            CONSTRAINT tweets_pkey PRIMARY KEY (id, created_at),
+            CONSTRAINT tweets_user_id_fkey FOREIGN KEY (user_id)
+                REFERENCES users (id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute("ALTER SEQUENCE tweets_id_seq OWNED BY tweets.id")
+    # Reuses the unique index and the foreign key the table already has
+    op.execute(
+        "ALTER TABLE tweets ATTACH PARTITION tweets_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ({literal(cutover)})"
+    )
+    for offset in range(MONTHS_AHEAD + 1):
+        start = month_start(cutover, offset)
+        op.execute(
+            f"CREATE TABLE tweets_{start:%Y_%m} PARTITION OF tweets "
+            f"FOR VALUES FROM ({literal(start)}) TO ({literal(month_start(start, 1))})"
+        )
+    op.execute("CREATE TABLE tweets_default PARTITION OF tweets DEFAULT")
+
+    # The legacy partition's matching indexes are attached, not rebuilt
+    for name, definition in INDEXES.items():
+        op.execute(f"CREATE INDEX {name} ON tweets {definition}")
+    op.execute(SEARCH_TRIGGER.format(table="tweets"))
+
+
+def downgrade():
+    # Rows of the monthly partitions are copied back into the legacy table;
+    # partitions archived by `manage.py partitions` are not restored
+    op.execute("DROP TRIGGER tweets_search_vector_update ON tweets")
+    op.execute("ALTER TABLE tweets DETACH PARTITION tweets_legacy")
+    op.execute("ALTER TABLE tweets_legacy DROP CONSTRAINT tweets_legacy_bound")
+    op.execute(f"INSERT INTO tweets_legacy ({COLUMNS}) SELECT {COLUMNS} FROM tweets")
+    op.execute("ALTER SEQUENCE tweets_id_seq OWNED BY tweets_legacy.id")
+    op.execute("DROP TABLE tweets")
+
+    op.execute("ALTER TABLE tweets_legacy RENAME TO tweets")
+    op.execute("ALTER INDEX tweets_legacy_pkey RENAME TO tweets_pkey")
+    for name in INDEXES:
+        op.execute(
+            f"ALTER INDEX {name.replace('tweets', 'tweets_legacy', 1)} RENAME TO {name}"
+        )
+    op.execute("DROP INDEX tweets_legacy_id_created_at")
+    op.execute(
+        "ALTER TABLE tweets ALTER COLUMN id SET DEFAULT nextval('tweets_id_seq')"
+    )
+    op.execute("ALTER TABLE tweets ALTER COLUMN created_at DROP NOT NULL")
+    op.execute(SEARCH_TRIGGER.format(table="tweets"))
@@ -0,0 +1,60 @@
+"""Store users' API keys as unique SHA-256 digests
+
+Revision ID: 9e4b2f6a8c13
+Revises: 3a8d6f0c2e19
+Create Date: 2026-10-19 09:12:37.604518
+
+Existing keys keep working: they are replaced by their digests, which is what
+app.auth looks up. Keys shared by several users identified none of them, so
+they are cleared; those users, and users without a key, have no key until one
+is issued. Needs PostgreSQL 11+ for sha256().
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "9e4b2f6a8c13"
+down_revision = "3a8d6f0c2e19"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index("ix_users_api_key", table_name="users")
+    op.alter_column(
+        "users",
+        "api_key",
+        existing_type=sa.String(length=30),
+        type_=sa.String(length=64),
+    )
+    op.execute("UPDATE users SET api_key = NULL WHERE api_key = ''")
+    op.execute(
+        """
+        UPDATE users SET api_key = NULL WHERE api_key IN (
+            SELECT api_key FROM users GROUP BY api_key HAVING count(*) > 1
+        )
+        """
+    )
+    op.execute(
+        "UPDATE users SET api_key = encode(sha256(convert_to(api_key, 'UTF8')), 'hex') "
+        "WHERE api_key IS NOT NULL"
+    )
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY ix_users_api_key ON users (api_key)"
+        )
+
+
+def downgrade():
+    # Digests can't be turned back into keys: every key is revoked
+    op.drop_index("ix_users_api_key", table_name="users")
+    op.execute("UPDATE users SET api_key = NULL")
+    op.alter_column(
+        "users",
+        "api_key",
+        existing_type=sa.String(length=64),
+        type_=sa.String(length=30),
+    )
+    op.create_index("ix_users_api_key", "users", ["api_key"], unique=False)
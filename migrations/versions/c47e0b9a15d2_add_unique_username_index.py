@@ -0,0 +1,48 @@
+"""Add unique index on users.username
+
+Revision ID: c47e0b9a15d2
+Revises: 8f2a41c6d9b3
+Create Date: 2026-10-18 11:03:57.218640
+
+Usernames were not unique until now. All but the oldest user of a taken
+username are renamed to `<username>-<id>`, shortened to fit 50 characters, and
+keep their ids and keys. The index is then built without blocking writes.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c47e0b9a15d2"
+down_revision = "8f2a41c6d9b3"
+branch_labels = None
+depends_on = None
+
+DEDUPLICATE = """
+    UPDATE users SET username = left(username, 49 - length(id::text)) || '-' || id
+    FROM (
+        SELECT id AS duplicate_id, row_number() OVER (
+            PARTITION BY username ORDER BY id
+        ) AS rank
+        FROM users
+        WHERE username IS NOT NULL
+    ) AS ranked
+    WHERE users.id = ranked.duplicate_id AND ranked.rank > 1
+    """
+
+
+def upgrade():
+    op.execute(DEDUPLICATE)
+    # CONCURRENTLY can't run in a transaction. A failed build leaves an invalid
+    # index behind, dropped when upgrading again.
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_users_username")
+        op.execute(
+            "CREATE UNIQUE INDEX CONCURRENTLY ix_users_username ON users (username)"
+        )
+
+
+def downgrade():
+    # Renamed duplicates keep their new usernames
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY ix_users_username")
@@ -0,0 +1,46 @@
+"""Add full-text search vector on tweets
+
+Revision ID: d2c7a8e4b615
+Revises: a93f5b1e6c27
+Create Date: 2026-10-18 18:47:30.725913
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "d2c7a8e4b615"
+down_revision = "a93f5b1e6c27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "tweets", sa.Column("search_vector", postgresql.TSVECTOR(), nullable=True)
+    )
+    op.execute(
+        "UPDATE tweets "
+        "SET search_vector = to_tsvector('pg_catalog.english', coalesce(text, ''))"
+    )
+    op.create_index(
+        "ix_tweets_search_vector",
+        "tweets",
+        ["search_vector"],
+        unique=False,
+        postgresql_using="gin",
+    )
+    op.execute(
+        "CREATE TRIGGER tweets_search_vector_update "
+        "BEFORE INSERT OR UPDATE OF text ON tweets FOR EACH ROW EXECUTE PROCEDURE "
+        "tsvector_update_trigger(search_vector, 'pg_catalog.english', text)"
+    )
+
+
+def downgrade():
+    op.execute("DROP TRIGGER tweets_search_vector_update ON tweets")
+    op.drop_index("ix_tweets_search_vector", table_name="tweets")
+    op.drop_column("tweets", "search_vector")
@@ -0,0 +1,45 @@
+"""Cascade deletes of users to their tweets
+
+Revision ID: f1b9d4c2a736
+Revises: e5a0c3f7b812
+Create Date: 2026-10-18 19:12:44.306519
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f1b9d4c2a736"
+down_revision = "e5a0c3f7b812"
+branch_labels = None
+depends_on = None
+
+# The name PostgreSQL gave the unnamed constraint of de098a1c7f3a
+CONSTRAINT = "tweets_user_id_fkey"
+
+
+def replace_foreign_key(ondelete):
+    # NOT VALID skips checking existing rows while the table is locked; they are
+    # checked afterwards, in their own transaction, without blocking writes
+    op.drop_constraint(CONSTRAINT, "tweets", type_="foreignkey")
+    op.create_foreign_key(
+        CONSTRAINT,
+        "tweets",
+        "users",
+        ["user_id"],
+        ["id"],
+        ondelete=ondelete,
+        postgresql_not_valid=True,
+    )
+    with op.get_context().autocommit_block():
+        op.execute(f"ALTER TABLE tweets VALIDATE CONSTRAINT {CONSTRAINT}")
+
+
+def upgrade():
+    replace_foreign_key("CASCADE")
+
+
+def downgrade():
+    replace_foreign_key(None)
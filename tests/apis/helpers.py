@@ -0,0 +1,24 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import db
+from config import Config
+
+
+class SQLiteConfig(Config):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+
+
+@contextmanager
+def assert_num_queries(testcase, expected):
+    """Fail `testcase` unless exactly `expected` SQL statements run in the block"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+    testcase.assertEqual(len(statements), expected, "\n\n".join(statements))
@@ -0,0 +1,370 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from sqlalchemy import create_engine
+from starlette.testclient import TestClient
+from app import create_app, db
+from app.asgi import create_asgi_app
+from .helpers import SQLiteConfig
+
+
+class FileConfig(SQLiteConfig):
+    # Both entry points must see the same database, so it can't be in-memory
+    SQLALCHEMY_DATABASE_URI = None
+    TWEET_STREAM_CATCHUP_MAX = 2
+    TWEET_STREAM_HEARTBEAT = 0.05
+    TWEET_STREAM_SETTLE_SECONDS = 0
+
+
+class EntryPointContract:
+    """
+    Behaviour both the WSGI and the ASGI app must share.
+
+    Subclasses provide `request(method, path, **kwargs)`, returning
+    `(status_code, body, headers)` with the body decoded from JSON.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmpdir.name, "api.sqlite3")
+        self.config = type(
+            "Config", (FileConfig,), {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}"}
+        )
+        engine = create_engine(self.config.SQLALCHEMY_DATABASE_URI)
+        db.metadata.create_all(engine)
+        engine.dispose()
+        self.start()
+
+    def tearDown(self):
+        self.stop()
+        self.tmpdir.cleanup()
+
+    def restart(self, **settings):
+        self.stop()
+        self.config = type("Config", (self.config,), settings)
+        self.start()
+
+    def create_user(self, username="alice"):
+        payload = {"username": username, "email": f"{username}@test.com"}
+        status, user, _ = self.request("POST", "/users", json=payload)
+        self.assertEqual(status, 200)
+        return user
+
+    def create_tweet(self, user_id, text="hello"):
+        payload = {"text": text, "user_id": user_id}
+        status, tweet, _ = self.request("POST", "/tweets", json=payload)
+        self.assertEqual(status, 200)
+        return tweet
+
+    def test_create_and_get_tweet(self):
+        user = self.create_user()
+        tweet = self.create_tweet(user["id"])
+        self.assertEqual(tweet["text"], "hello")
+        self.assertEqual(
+            tweet["user"],
+            {"username": "alice", "email": "alice@test.com", "id": user["id"]},
+        )
+
+        status, body, headers = self.request("GET", f"/tweets/{tweet['id']}")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, tweet)
+        self.assertEqual(headers["ETag"], f'"{tweet["id"]}.1.1"')
+
+        status, _, _ = self.request(
+            "GET", f"/tweets/{tweet['id']}", headers={"If-None-Match": headers["ETag"]}
+        )
+        self.assertEqual(status, 304)
+
+    def test_create_tweet_errors(self):
+        status, body, _ = self.request("POST", "/tweets", json={"text": "hi"})
+        self.assertEqual(status, 400)
+        self.assertEqual(
+            body["errors"], {"user_id": "'user_id' is a required property"}
+        )
+
+        status, _, _ = self.request(
+            "POST", "/tweets", json={"text": "hi", "user_id": 9}
+        )
+        self.assertEqual(status, 400)
+
+    def test_get_missing_tweet(self):
+        status, body, _ = self.request("GET", "/tweets/1")
+        self.assertEqual(status, 404)
+        self.assertIn("message", body)
+
+    def test_list_tweets_paginates(self):
+        user = self.create_user()
+        created = [self.create_tweet(user["id"], f"tweet {i}") for i in range(3)]
+
+        status, body, _ = self.request("GET", "/tweets?limit=2")
+        self.assertEqual(status, 200)
+        self.assertEqual([t["id"] for t in body["tweets"]], [3, 2])
+        cursor = body["next_cursor"]
+
+        status, body, _ = self.request("GET", f"/tweets?limit=2&before={cursor}")
+        self.assertEqual(body, {"tweets": [created[0]], "next_cursor": None})
+
+        status, _, _ = self.request("GET", "/tweets?before=!!!")
+        self.assertEqual(status, 400)
+        status, _, _ = self.request("GET", "/tweets?limit=0")
+        self.assertEqual(status, 400)
+
+    def test_patch_and_delete_tweet_with_if_match(self):
+        user = self.create_user()
+        tweet = self.create_tweet(user["id"])
+        path = f"/tweets/{tweet['id']}"
+
+        status, _, _ = self.request(
+            "PATCH", path, json={"text": "edited"}, headers={"If-Match": '"1.0.1"'}
+        )
+        self.assertEqual(status, 412)
+
+        status, body, headers = self.request(
+            "PATCH", path, json={"text": "edited"}, headers={"If-Match": '"1.1.1"'}
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(body["text"], "edited")
+        self.assertEqual(headers["ETag"], '"1.2.1"')
+
+        status, _, _ = self.request("DELETE", path, headers={"If-Match": '"1.1.1"'})
+        self.assertEqual(status, 412)
+        status, _, _ = self.request("DELETE", path, headers={"If-Match": '"1.2.1"'})
+        self.assertEqual(status, 204)
+        status, _, _ = self.request("GET", path)
+        self.assertEqual(status, 404)
+
+    def test_users(self):
+        user = self.create_user()
+        # The key is only shown when the user is created
+        api_key = user.pop("api_key")
+        self.assertEqual(len(api_key), 32)
+        status, body, _ = self.request("GET", "/users")
+        self.assertEqual(status, 200)
+        self.assertEqual(body, [user])
+
+        path = f"/users/{user['id']}"
+        status, body, _ = self.request("GET", path)
+        self.assertEqual(body, user)
+
+        status, body, headers = self.request("PATCH", path, json={"email": "a@b.c"})
+        self.assertEqual(status, 200)
+        self.assertEqual(body["email"], "a@b.c")
+        self.assertEqual(headers["ETag"], '"1.2"')
+
+        self.create_tweet(user["id"])
+        status, _, _ = self.request("DELETE", path)
+        self.assertEqual(status, 204)
+        status, _, _ = self.request("GET", path)
+        self.assertEqual(status, 404)
+        status, body, _ = self.request("GET", "/tweets")
+        self.assertEqual(body["tweets"], [])
+
+    def test_authentication(self):
+        self.restart(
+            AUTH_MODE="all",
+            RATE_LIMIT_BACKEND="memory",
+            RATE_LIMIT_RATE=0.001,
+            RATE_LIMIT_BURST=2,
+        )
+        user = self.create_user()
+        payload = {"text": "hello", "user_id": user["id"]}
+        status, body, _ = self.request("POST", "/tweets", json=payload)
+        self.assertEqual(status, 401)
+        self.assertEqual(body, {"message": "A valid X-API-Key header is required"})
+        status, _, _ = self.request("GET", "/users", headers={"X-API-Key": "wrong"})
+        self.assertEqual(status, 401)
+
+        headers = {"X-API-Key": user["api_key"]}
+        status, _, response_headers = self.request(
+            "POST", "/tweets", json=payload, headers=headers
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(response_headers["X-RateLimit-Remaining"], "1")
+        status, _, _ = self.request("GET", "/tweets", headers=headers)
+        self.assertEqual(status, 200)
+        status, body, response_headers = self.request("GET", "/tweets", headers=headers)
+        self.assertEqual(status, 429)
+        self.assertEqual(body, {"message": "API key rate limit exceeded"})
+        self.assertIn("Retry-After", response_headers)
+
+    def test_duplicate_username(self):
+        self.create_user()
+        payload = {"username": "alice", "email": "other@test.com"}
+        status, body, _ = self.request("POST", "/users", json=payload)
+        self.assertEqual(status, 400)
+        self.assertEqual(body, {"message": "Username alice is taken"})
+
+    def test_patch_conflicts(self):
+        alice, bob = self.create_user(), self.create_user("bob")
+        tweet = self.create_tweet(alice["id"])
+        payload = {"user_id": 9}
+        status, body, _ = self.request("PATCH", f"/tweets/{tweet['id']}", json=payload)
+        self.assertEqual(status, 400)
+        self.assertEqual(body, {"message": "User 9 does not exist"})
+        payload = {"username": "alice"}
+        status, body, _ = self.request("PATCH", f"/users/{bob['id']}", json=payload)
+        self.assertEqual(status, 400)
+        self.assertEqual(body, {"message": "Username alice is taken"})
+
+    def test_sparse_fieldsets(self):
+        user = self.create_user()
+        tweet = self.create_tweet(user["id"])
+        status, body, headers = self.request(
+            "GET", f"/tweets/{tweet['id']}?fields=text,user.username"
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(body, {"text": "hello", "user": {"username": "alice"}})
+        self.assertEqual(headers["ETag"], '"1.1.1"')
+        status, body, _ = self.request("GET", "/tweets?fields=id")
+        self.assertEqual(body, {"tweets": [{"id": 1}], "next_cursor": None})
+        status, body, _ = self.request("GET", "/users?fields=username")
+        self.assertEqual(body, [{"username": "alice"}])
+        status, body, _ = self.request("GET", "/users/1?fields=email")
+        self.assertEqual(body, {"email": "alice@test.com"})
+        status, body, _ = self.request("GET", "/users/1?fields=api_key")
+        self.assertEqual(status, 400)
+        self.assertIn("Unknown field(s) api_key", body["message"])
+
+    def test_compression(self):
+        self.restart(COMPRESSION_ENCODINGS="gzip", COMPRESSION_MIN_SIZE=0)
+        user = self.create_user()
+        tweet = self.create_tweet(user["id"])
+        accept = {"Accept-Encoding": "gzip"}
+        for path in (f"/tweets/{tweet['id']}", "/tweets?fields=text"):
+            status, body, headers = self.request("GET", path, headers=accept)
+            self.assertEqual(status, 200)
+            self.assertEqual(headers["Content-Encoding"], "gzip")
+            self.assertEqual(headers["Vary"], "Accept-Encoding")
+        self.assertEqual(body, {"tweets": [{"text": "hello"}], "next_cursor": None})
+        status, _, headers = self.request("GET", "/users/1", headers=accept)
+        self.assertEqual(headers["ETag"], '"1.1-gzip"')
+        status, _, _ = self.request(
+            "GET", "/users/1", headers={**accept, "If-None-Match": headers["ETag"]}
+        )
+        self.assertEqual(status, 304)
+        status, _, headers = self.request(
+            "GET", "/users/1", headers={"Accept-Encoding": "identity"}
+        )
+        self.assertNotIn("Content-Encoding", headers)
+
+    def test_stream_errors(self):
+        user = self.create_user()
+        for _ in range(3):
+            self.create_tweet(user["id"])
+        status, _, _ = self.request("GET", "/tweets/stream?since=x")
+        self.assertEqual(status, 400)
+        # More changes than TWEET_STREAM_CATCHUP_MAX
+        status, body, _ = self.request("GET", "/tweets/stream?since=0")
+        self.assertEqual(status, 410)
+        self.assertIn("reload GET /tweets", body["message"])
+
+
+class TestWSGIEntryPoint(EntryPointContract, unittest.TestCase):
+    def start(self):
+        self.app = create_app(self.config)
+        self.app.config["TESTING"] = True
+        self.client = self.app.test_client()
+
+    def stop(self):
+        with self.app.app_context():
+            db.engine.dispose()
+
+    def request(self, method, path, **kwargs):
+        response = self.client.open(path, method=method, **kwargs)
+        data = response.data
+        if response.headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        body = json.loads(data) if data else None
+        return response.status_code, body, response.headers
+
+
+class TestASGIEntryPoint(EntryPointContract, unittest.TestCase):
+    def start(self):
+        self.client = TestClient(create_asgi_app(self.config))
+        self.client.__enter__()
+
+    def stop(self):
+        self.client.__exit__(None, None, None)
+
+    def request(self, method, path, **kwargs):
+        response = self.client.request(method, path, **kwargs)
+        body = response.json() if response.content else None
+        return response.status_code, body, response.headers
+
+    def test_unsupported_settings_are_rejected(self):
+        for settings in (
+            {"TWEET_INGEST_MODE": "async"},
+            {"DATABASE_REPLICA_URLS": ["sqlite://"]},
+        ):
+            config = type("Config", (self.config,), settings)
+            with self.assertRaises(ValueError):
+                create_asgi_app(config)
+
+    def test_cache_is_called_off_the_event_loop(self):
+        user = self.create_user()
+        on_loop = []
+
+        def get(key):  # pylint: disable=unused-argument
+            try:
+                asyncio.get_running_loop()
+                on_loop.append(True)
+            except RuntimeError:
+                on_loop.append(False)
+
+        self.client.app.state.cache.get = get
+        status, _, _ = self.request("GET", f"/users/{user['id']}")
+        self.assertEqual(status, 200)
+        self.assertEqual(on_loop, [False])
+
+    def read_stream(self, since):
+        """The stream never ends, so read it until it idles and hang up"""
+
+        async def read():
+            app = create_asgi_app(self.config)
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": "/tweets/stream",
+                "query_string": f"since={since}".encode(),
+                "headers": [],
+            }
+            body, done = [], asyncio.Event()
+
+            async def receive():
+                await asyncio.sleep(60)
+
+            async def send(message):
+                body.append(message.get("body", b""))
+                if b": keepalive" in b"".join(body):
+                    done.set()
+
+            task = asyncio.create_task(app(scope, receive, send))
+            await asyncio.wait_for(done.wait(), 5)
+            task.cancel()
+            return b"".join(body).decode()
+
+        return asyncio.run(read())
+
+    def test_stream_catch_up(self):
+        user = self.create_user()
+        tweet = self.create_tweet(user["id"])
+        self.request("DELETE", f"/tweets/{tweet['id']}")
+
+        body = self.read_stream(0)
+        self.assertTrue(body.startswith("retry: 3000\n\n"))
+        self.assertIn(f"id: 1\nevent: created\ndata: {json.dumps(tweet)}\n\n", body)
+        self.assertIn(f'id: 2\nevent: deleted\ndata: {{"id": {tweet["id"]}}}\n\n', body)
+        self.assertIn(": keepalive\n\n", body)
+
+    def test_stream_user_deletion(self):
+        user = self.create_user()
+        self.create_tweet(user["id"])
+        self.request("DELETE", f"/users/{user['id']}")
+
+        body = self.read_stream(1)
+        self.assertIn(
+            f'id: 2\nevent: user_deleted\ndata: {{"user_id": {user["id"]}}}', body
+        )
@@ -1,12 +1,18 @@
+import json
+import tempfile
+import time
+from datetime import datetime
 from flask_testing import TestCase
 from app import create_app, db
 from app.models import Tweet, User
+from app.pagination import decode_cursor, encode_cursor
 from unittest.mock import patch
+from .helpers import SQLiteConfig, assert_num_queries
 
 
 # Used to get a sample for tests
 def get_sample_tweet():
-    t = Tweet(text="test", id=1)
+    t = Tweet(text="test", id=1, version=1, updated_at=datetime(2020, 10, 8, 14, 35))
     return t
 
 def get_sample_user():
@@ -36,15 +42,113 @@ class TestTweetGetMethod(TestCase):
 
     def test_get_all_tweets(self, session_mock):
         # Mock DB
-        session_mock.query.return_value.all.return_value = [get_sample_tweet()]
+        query = session_mock.query.return_value.order_by.return_value
+        query.limit.return_value.all.return_value = [get_sample_tweet()]
         # Query
         response = self.client.get("/tweets")
-        response_list = response.json
+        response_page = response.json
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertIsInstance(response_page["tweets"], list)
+        self.assertEqual(len(response_page["tweets"]), 1)
+        self.assertIsNone(response_page["next_cursor"])
+        query.limit.assert_called_once_with(21)
+
+    def test_get_tweets_next_cursor(self, session_mock):
+        # Mock DB: one row more than the page size means there is a next page
+        tweets = [get_sample_tweet(), get_sample_tweet()]
+        tweets[0].created_at = datetime(2020, 10, 8, 14, 35)
+        query = session_mock.query.return_value.order_by.return_value
+        query.limit.return_value.all.return_value = tweets
+        # Query
+        response = self.client.get("/tweets?limit=1")
+        response_page = response.json
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response_page["tweets"]), 1)
+        self.assertEqual(
+            decode_cursor(response_page["next_cursor"]),
+            (datetime(2020, 10, 8, 14, 35), 1),
+        )
+
+    def test_get_tweets_before_cursor(self, session_mock):
+        # Mock DB
+        cursor = encode_cursor(datetime(2020, 10, 8, 14, 35), 1)
+        query = session_mock.query.return_value.filter.return_value.order_by
+        query.return_value.limit.return_value.all.return_value = []
+        # Query
+        response = self.client.get(f"/tweets?before={cursor}")
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["tweets"], [])
+        session_mock.query.return_value.filter.assert_called_once()
+
+    def test_get_tweets_invalid_cursor(self, session_mock):
+        response = self.client.get("/tweets?before=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_tweets_invalid_limit(self, session_mock):
+        response = self.client.get("/tweets?limit=1000")
+        self.assertEqual(response.status_code, 400)
+        session_mock.query.return_value.order_by.assert_not_called()
+
+    def test_export_tweets(self, session_mock):
+        # Mock DB
+        query = session_mock.query.return_value.order_by.return_value
+        rows = query.execution_options.return_value.yield_per
+        rows.return_value = [get_sample_tweet(), get_sample_tweet()]
+        # Query
+        response = self.client.get("/tweets/export")
+        lines = response.get_data(as_text=True).splitlines()
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])["text"], "test")
+        query.execution_options.assert_called_once_with(stream_results=True)
+        rows.assert_called_once_with(1000)
+
+    def test_get_one_tweet_cached(self, session_mock):
+        # Mock DB
+        session_mock.query.return_value.get.return_value = get_sample_tweet()
+        # Query twice
+        self.client.get("/tweets/1")
+        response = self.client.get("/tweets/1")
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["text"], "test")
+        session_mock.query.return_value.get.assert_called_once_with(1)
+
+    def test_get_one_tweet_validators(self, session_mock):
+        # Mock DB
+        session_mock.query.return_value.get.return_value = get_sample_tweet()
+        # Query
+        response = self.client.get("/tweets/1")
+        # Check
+        self.assertEqual(response.headers["ETag"], '"1.1.None"')
+        self.assertEqual(
+            response.headers["Last-Modified"], "Thu, 08 Oct 2020 14:35:00 GMT"
+        )
+
+    def test_get_one_tweet_not_modified(self, session_mock):
+        # Mock DB
+        session_mock.query.return_value.get.return_value = get_sample_tweet()
+        # Query, on a cache miss and then on a hit
+        headers = {"If-None-Match": '"1.1.None"'}
+        responses = [self.client.get("/tweets/1", headers=headers) for _ in range(2)]
+        # Check
+        for response in responses:
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b"")
+
+    def test_get_one_tweet_modified_since(self, session_mock):
+        # Mock DB
+        session_mock.query.return_value.get.return_value = get_sample_tweet()
+        # Query
+        headers = {"If-Modified-Since": "Thu, 08 Oct 2020 14:00:00 GMT"}
+        response = self.client.get("/tweets/1", headers=headers)
         # Check
         self.assertEqual(response.status_code, 200)
-        self.assertIsInstance(response_list, list)
-        self.assertEqual(len(response_list), 1)
-        session_mock.query.return_value.all.assert_called_once()
 
     def test_get_one_invalid_tweet(self, session_mock):
         session_mock.query.return_value.get.return_value = None
@@ -52,137 +156,516 @@ class TestTweetGetMethod(TestCase):
         self.assertEqual(response.status_code, 404)
         session_mock.query.return_value.get.assert_called_once_with(1)
 
+# TESTS query count, against a real database
+class TestTweetQueryCount(TestCase):
+    # SETUP
+    def create_app(self):
+        app = create_app(SQLiteConfig)
+        app.config["TESTING"] = True
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for i in range(3):
+            user = User(username=f"user{i}", email=f"user{i}@test.com")
+            user.tweets.append(Tweet(text=f"tweet by user{i}"))
+            db.session.add(user)
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_get_all_tweets_loads_users_in_one_query(self):
+        with assert_num_queries(self, 1):
+            response = self.client.get("/tweets")
+        self.assertEqual(response.status_code, 200)
+        users = [tweet["user"]["username"] for tweet in response.json["tweets"]]
+        self.assertEqual(sorted(users), ["user0", "user1", "user2"])
+
+    def test_get_one_tweet_loads_user_in_one_query(self):
+        with assert_num_queries(self, 1):
+            response = self.client.get("/tweets/1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["user"]["username"], "user0")
+
+# TESTS sparse fieldsets, against a real database
+class TestTweetFields(TestCase):
+    # SETUP
+    def create_app(self):
+        app = create_app(SQLiteConfig)
+        app.config["TESTING"] = True
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for i in range(3):
+            user = User(username=f"user{i}", email=f"user{i}@test.com")
+            user.tweets.append(Tweet(text=f"tweet by user{i}"))
+            db.session.add(user)
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_list_selects_only_requested_columns(self):
+        with assert_num_queries(self, 1) as statements:
+            response = self.client.get("/tweets?fields=text,id&limit=2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json["tweets"],
+            [{"id": 3, "text": "tweet by user2"}, {"id": 2, "text": "tweet by user1"}],
+        )
+        self.assertNotIn("users", statements[0])
+        self.assertNotIn("updated_at", statements[0])
+
+        cursor = response.json["next_cursor"]
+        response = self.client.get(f"/tweets?fields=id&limit=2&before={cursor}")
+        self.assertEqual(response.json, {"tweets": [{"id": 1}], "next_cursor": None})
+
+    def test_list_with_nested_user_fields(self):
+        response = self.client.get("/tweets?fields=id,user.username&limit=1")
+        self.assertEqual(
+            response.json["tweets"], [{"id": 3, "user": {"username": "user2"}}]
+        )
+        response = self.client.get("/tweets?fields=user&limit=1")
+        self.assertEqual(
+            response.json["tweets"],
+            [{"user": {"username": "user2", "email": "user2@test.com", "id": 3}}],
+        )
+
+    def test_one_tweet(self):
+        full = self.client.get("/tweets/1")
+        with assert_num_queries(self, 1):
+            response = self.client.get("/tweets/1?fields=created_at,text")
+        self.assertEqual(
+            response.json,
+            {"text": "tweet by user0", "created_at": full.json["created_at"]},
+        )
+        self.assertEqual(response.headers["ETag"], full.headers["ETag"])
+
+        headers = {"If-None-Match": response.headers["ETag"]}
+        response = self.client.get("/tweets/1?fields=text", headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get("/tweets/9?fields=text")
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_field(self):
+        response = self.client.get("/tweets?fields=id,password")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("password", response.json["message"])
+        response = self.client.get("/tweets/1?fields=")
+        self.assertEqual(response.status_code, 400)
+
+# TESTS search, against a real database (in-process index on SQLite)
+class TestTweetSearch(TestCase):
+    # SETUP
+    def create_app(self):
+        app = create_app(SQLiteConfig)
+        app.config["TESTING"] = True
+        return app
+
+    def setUp(self):
+        db.create_all()
+        user = User(username="testuser", email="testuser@test.com")
+        for text in ("red fox", "red red fox", "blue fox", "red hen"):
+            user.tweets.append(Tweet(text=text))
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def search(self, query):
+        response = self.client.get(query)
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def test_search_ranks_matches(self):
+        page = self.search("/tweets/search?q=Red+fox")
+        texts = [tweet["text"] for tweet in page["tweets"]]
+        self.assertEqual(texts, ["red red fox", "red fox"])
+        self.assertIsNone(page["next_cursor"])
+
+    def test_search_pagination(self):
+        first = self.search("/tweets/search?q=fox&limit=2")
+        cursor = first["next_cursor"]
+        second = self.search(f"/tweets/search?q=fox&limit=2&cursor={cursor}")
+        texts = [tweet["text"] for tweet in first["tweets"] + second["tweets"]]
+        self.assertEqual(sorted(texts), ["blue fox", "red fox", "red red fox"])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_search_pagination_with_tied_ranks(self):
+        # "red fox" and "blue fox" rank the same for "fox"
+        texts, cursor = [], ""
+        for _ in range(3):
+            page = self.search(f"/tweets/search?q=fox&limit=1{cursor}")
+            texts += [tweet["text"] for tweet in page["tweets"]]
+            cursor = f"&cursor={page['next_cursor']}"
+        self.assertEqual(sorted(texts), ["blue fox", "red fox", "red red fox"])
+        self.assertIsNone(page["next_cursor"])
+
+    def test_search_sees_new_tweets(self):
+        self.search("/tweets/search?q=hen")
+        self.client.post("/tweets", json={"text": "brown hen", "user_id": 1})
+        page = self.search("/tweets/search?q=hen")
+        self.assertEqual(len(page["tweets"]), 2)
+
+    def test_search_follows_updates_and_deletes(self):
+        self.search("/tweets/search?q=hen")
+        fallback = self.app.extensions["search_fallback"]
+        # Only the postings of the changed tweets are updated
+        with patch.object(fallback, "rebuild") as rebuild:
+            self.client.patch("/tweets/4", json={"text": "red fox"})
+            self.client.delete("/tweets/1")
+            self.assertEqual(self.search("/tweets/search?q=hen")["tweets"], [])
+            page = self.search("/tweets/search?q=fox")
+        rebuild.assert_not_called()
+        texts = [tweet["text"] for tweet in page["tweets"]]
+        self.assertEqual(sorted(texts), ["blue fox", "red fox", "red red fox"])
+
+    def test_search_drops_deleted_users_tweets(self):
+        self.search("/tweets/search?q=fox")
+        self.client.delete("/users/1")
+        self.assertEqual(self.search("/tweets/search?q=fox")["tweets"], [])
+
+    def test_search_invalid_cursor(self):
+        response = self.client.get("/tweets/search?q=fox&cursor=nope")
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_requires_query(self):
+        self.assertEqual(self.client.get("/tweets/search").status_code, 400)
+
 # TESTS 'POST'
-@patch("app.db.session")
+# TESTS 'POST', against a real database
 class TestTweetPostMethod(TestCase):
     # SETUP
     def create_app(self):
-        app = create_app()
+        app = create_app(SQLiteConfig)
         app.config["TESTING"] = True
         return app
 
-    def test_create_one_valid_tweet(self, session_mock):
-        # Mock DB
-        session_mock.query.return_value.get.return_value = [get_sample_user(), get_sample_tweet()]
+    def setUp(self):
+        db.create_all()
+        db.session.add(User(username="testuser", email="testuser@test.com"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_create_one_valid_tweet(self):
         # Payload
         payload = {
             "text": "This is a test",
             "user_id": 1,
         }
-        # Query
-        response = self.client.post("/tweets", json=payload)
+        # Query: the INSERT ... RETURNING, its change for GET /tweets/stream,
+        # then the followers to fan out to
+        with assert_num_queries(self, 3) as statements:
+            response = self.client.post("/tweets", json=payload)
         response_tweet = response.json
         # Check
         self.assertEqual(response.status_code, 200)
+        self.assertIn("RETURNING", statements[0])
+        self.assertTrue(statements[1].startswith("INSERT INTO tweet_changes"))
         self.assertEqual(response_tweet["text"], payload["text"])
-        session_mock.add.assert_called_once()
-        session_mock.query.return_value.get.assert_called()
-        session_mock.commit.assert_called_once()
+        self.assertEqual(response_tweet["id"], 1)
+        self.assertEqual(
+            response_tweet["user"],
+            {"username": "testuser", "email": "testuser@test.com", "id": 1},
+        )
+        self.assertEqual(response_tweet, self.client.get("/tweets/1").json)
 
-    def test_create_one_tweet_invalid_payload(self, session_mock):
+    def test_create_one_tweet_invalid_payload(self):
         # Payload
         payload = {"name": "This is a test"}
         # Query
         response = self.client.post("/tweets", json=payload)
         # Check
         self.assertEqual(response.status_code, 400)
-        session_mock.add.assert_not_called()
-        session_mock.commit.assert_not_called()
+        self.assertEqual(db.session.query(Tweet).count(), 0)
 
-    def test_create_one_tweet_no_payload(self, session_mock):
+    def test_create_one_tweet_no_payload(self):
         # Query
         response = self.client.post("/tweets")
         # Check
         self.assertEqual(response.status_code, 400)
-        session_mock.add.assert_not_called()
-        session_mock.commit.assert_not_called()
+        self.assertEqual(db.session.query(Tweet).count(), 0)
 
-    def test_create_one_tweet_invalid_user(self, session_mock):
-        # Mock
-        session_mock.query.return_value.get.return_value = None
+    def test_create_one_tweet_invalid_user(self):
         # payload
         payload = {
             "text": "This is a test",
-            "user_id": 1,
+            "user_id": 2,
         }
-        # Query
-        response = self.client.post("/tweets", json=payload)
+        # Query: the foreign key rejects the INSERT
+        with assert_num_queries(self, 1):
+            response = self.client.post("/tweets", json=payload)
         # Check
         self.assertEqual(response.status_code, 400)
-        session_mock.add.assert_not_called()
-        session_mock.query.return_value.get.assert_called_once_with(1)
-        session_mock.commit.assert_not_called()
+        self.assertEqual(db.session.query(Tweet).count(), 0)
 
-# TESTS 'DELETE'
+# TESTS 'POST' batch
 @patch("app.db.session")
-class TestTweetDeleteMethod(TestCase):
+class TestTweetBatchPostMethod(TestCase):
     # SETUP
     def create_app(self):
         app = create_app()
         app.config["TESTING"] = True
         return app
 
-    def test_delete_one_tweet(self, session_mock):
-        # Mock
-        t = get_sample_tweet()
-        session_mock.query.return_value.get.return_value = t
+    def test_create_tweet_batch(self, session_mock):
+        # Mock DB: user 1 exists, user 2 does not
+        session_mock.query.return_value.filter.return_value.all.return_value = [(1,)]
+        session_mock.execute.return_value.fetchall.return_value = [(10,), (11,)]
+        # Payload
+        payload = [
+            {"text": "first", "user_id": 1},
+            {"text": "second", "user_id": 2},
+            {"text": "third", "user_id": 1},
+        ]
         # Query
-        response = self.client.delete("/tweets/1")
+        response = self.client.post("/tweets/batch", json=payload)
+        response_batch = response.json
         # Check
-        self.assertEqual(response.status_code, 204)
-        session_mock.query.return_value.get.assert_called_once_with(1)
-        session_mock.delete.assert_called_once_with(t)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response_batch["created"], 2)
+        self.assertEqual(response_batch["failed"], 1)
+        self.assertEqual(
+            [(r["index"], r["status"], r["id"]) for r in response_batch["results"]],
+            [(0, 200, 10), (1, 400, None), (2, 200, 11)],
+        )
+        session_mock.query.assert_any_call(User.id)
+        # The INSERT, then reading the created tweets for GET /tweets/stream
+        self.assertEqual(session_mock.execute.call_count, 2)
         session_mock.commit.assert_called_once()
 
-    def test_delete_one_invalid_tweet(self, session_mock):
-        # Mock
-        session_mock.query.return_value.get.return_value = None
+    def test_create_tweet_batch_unknown_users(self, session_mock):
+        # Mock DB
+        session_mock.query.return_value.filter.return_value.all.return_value = []
         # Query
-        response = self.client.delete("/tweets/1")
+        response = self.client.post("/tweets/batch", json=[{"text": "a", "user_id": 1}])
         # Check
-        self.assertEqual(response.status_code, 404)
-        session_mock.query.return_value.get.assert_called_once_with(1)
-        session_mock.delete.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["created"], 0)
+        self.assertEqual(response.json["failed"], 1)
+        session_mock.execute.assert_not_called()
         session_mock.commit.assert_not_called()
 
-# TESTS 'PATCH'
-@patch("app.db.session")
-class TestTweetPatchMethod(TestCase):
+    def test_create_tweet_batch_invalid_payload(self, session_mock):
+        # Query
+        response = self.client.post("/tweets/batch", json=[{"text": "no user"}])
+        # Check
+        self.assertEqual(response.status_code, 400)
+        session_mock.execute.assert_not_called()
+
+    def test_create_tweet_batch_too_large(self, session_mock):
+        # Query
+        payload = [{"text": "a", "user_id": 1}] * 1001
+        response = self.client.post("/tweets/batch", json=payload)
+        # Check
+        self.assertEqual(response.status_code, 400)
+        session_mock.query.assert_not_called()
+
+# TESTS 'POST' in async ingestion mode, against a real database
+class TestTweetAsyncPostMethod(TestCase):
     # SETUP
     def create_app(self):
-        app = create_app()
+        self.directory = tempfile.TemporaryDirectory()
+
+        # A file database, since the writer thread uses its own connection
+        class AsyncConfig(SQLiteConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{self.directory.name}/db.sqlite3"
+            TWEET_INGEST_MODE = "async"
+
+        app = create_app(AsyncConfig)
         app.config["TESTING"] = True
+        app.config["INGEST_FLUSH_INTERVAL"] = 0.01
+        app.config["INGEST_QUEUE_PATH"] = f"{self.directory.name}/queue.sqlite3"
         return app
 
-    def test_update_one_valid_tweet(self, session_mock):
-        # Mock
-        session_mock.query.return_value.get.return_value = get_sample_tweet()
+    def setUp(self):
+        db.create_all()
+        db.session.add(User(username="testuser", email="testuser@test.com"))
+        db.session.commit()
+
+    def tearDown(self):
+        self.app.extensions["ingest"][2].stop()
+        db.session.remove()
+        db.drop_all()
+        self.directory.cleanup()
+
+    def test_create_tweet_queued(self):
+        # Query
+        response = self.client.post("/tweets", json={"text": "later", "user_id": 1})
+        # Check
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json["status"], "queued")
+        for _ in range(500):
+            if self.client.get("/tweets/ingest").json["written"]:
+                break
+            time.sleep(0.01)
+        metrics = self.client.get("/tweets/ingest").json
+        self.assertEqual(metrics["depth"], 0)
+        self.assertEqual(metrics["written"], 1)
+        self.assertEqual(self.client.get("/tweets/1").json["text"], "later")
+
+    def test_fan_out_failure_writes_once(self):
+        with patch("app.apis.tweets.fan_out", side_effect=RuntimeError("down")):
+            self.client.post("/tweets", json={"text": "later", "user_id": 1})
+            for _ in range(500):
+                if self.client.get("/tweets/ingest").json["written"]:
+                    break
+                time.sleep(0.01)
+        self.client.post("/tweets", json={"text": "after", "user_id": 1})
+        for _ in range(500):
+            if self.client.get("/tweets/ingest").json["written"] == 2:
+                break
+            time.sleep(0.01)
+        texts = [text for (text,) in db.session.query(Tweet.text).order_by(Tweet.id)]
+        self.assertEqual(texts, ["later", "after"])
+
+    def test_create_tweet_queue_full(self):
+        self.app.config["INGEST_MAX_DEPTH"] = 0
+        response = self.client.post("/tweets", json={"text": "later", "user_id": 1})
+        self.assertEqual(response.status_code, 503)
+
+# TESTS 'DELETE'
+# TESTS 'DELETE' and 'PATCH', against a real database
+class WriteTestCase(TestCase):
+    # SETUP
+    def create_app(self):
+        app = create_app(SQLiteConfig)
+        app.config["TESTING"] = True
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for name in ("testuser", "other"):
+            user = User(username=name, email=f"{name}@test.com")
+            user.tweets.append(Tweet(text=f"tweet by {name}"))
+            db.session.add(user)
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+
+class TestTweetDeleteMethod(WriteTestCase):
+    def test_delete_one_tweet(self):
+        # Query: the DELETE, and its change for GET /tweets/stream
+        with assert_num_queries(self, 2) as statements:
+            response = self.client.delete("/tweets/1")
+        # Check
+        self.assertEqual(response.status_code, 204)
+        self.assertTrue(statements[0].startswith("DELETE FROM tweets"))
+        self.assertTrue(statements[1].startswith("INSERT INTO tweet_changes"))
+        self.assertIsNone(db.session.get(Tweet, 1))
+
+    def test_delete_one_tweet_if_match(self):
+        # Query
+        response = self.client.delete("/tweets/1", headers={"If-Match": '"1.1.1"'})
+        # Check
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(db.session.get(Tweet, 1))
+
+    def test_delete_one_tweet_etag_mismatch(self):
+        # Query
+        with assert_num_queries(self, 2):
+            response = self.client.delete(
+                "/tweets/1", headers={"If-Match": '"1.0.1", "junk"'}
+            )
+        # Check
+        self.assertEqual(response.status_code, 412)
+        self.assertIsNotNone(db.session.get(Tweet, 1))
+
+    def test_delete_one_invalid_tweet(self):
+        # Query
+        with assert_num_queries(self, 1):
+            response = self.client.delete("/tweets/9")
+        # Check
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(db.session.query(Tweet).count(), 2)
+
+
+class TestTweetPatchMethod(WriteTestCase):
+    def test_update_one_valid_tweet(self):
+        before = self.client.get("/tweets/1")
         # Payload
         payload = {"text": "New text"}
-        # Query
-        response = self.client.patch("/tweets/1", json=payload)
+        # Query: the UPDATE, and its change for GET /tweets/stream
+        with assert_num_queries(self, 2) as statements:
+            response = self.client.patch("/tweets/1", json=payload)
         response_tweet = response.json
         # Check
         self.assertEqual(response.status_code, 200)
+        self.assertTrue(statements[0].startswith("UPDATE tweets"))
+        self.assertTrue(statements[1].startswith("INSERT INTO tweet_changes"))
         self.assertEqual(response_tweet["text"], payload["text"])
         self.assertEqual(response_tweet["id"], 1)
-        session_mock.query.return_value.get.assert_called_once_with(1)
-        session_mock.commit.assert_called_once()
+        self.assertEqual(response_tweet["user"]["username"], "testuser")
+        self.assertEqual(response.headers["ETag"], '"1.2.1"')
+        tweet = db.session.get(Tweet, 1)
+        self.assertEqual((tweet.text, tweet.version), ("New text", 2))
+        self.assertGreater(tweet.updated_at.isoformat(), before.json["created_at"])
 
-    def test_update_one_tweet_no_payload(self, session_mock):
+    def test_update_one_tweet_invalidates_cache(self):
+        self.client.get("/tweets/1")
+        # Query
+        self.client.patch("/tweets/1", json={"text": "New text"})
+        response = self.client.get("/tweets/1")
+        # Check
+        self.assertEqual(response.json["text"], "New text")
+        self.assertEqual(response.headers["ETag"], '"1.2.1"')
+
+    def test_update_one_tweet_author(self):
+        # Query
+        response = self.client.patch("/tweets/1", json={"user_id": 2})
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["user"]["username"], "other")
+        self.assertEqual(response.headers["ETag"], '"1.2.1"')
+
+    def test_update_one_tweet_unknown_author(self):
+        # Query
+        response = self.client.patch("/tweets/1", json={"user_id": 9})
+        # Check
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(db.session.get(Tweet, 1).user_id, 1)
+
+    def test_update_one_tweet_if_match(self):
+        # Query
+        headers = {"If-Match": '"1.1.1"'}
+        response = self.client.patch("/tweets/1", json={"text": "a"}, headers=headers)
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["ETag"], '"1.2.1"')
+
+    def test_update_one_tweet_etag_mismatch(self):
+        # Query
+        headers = {"If-Match": '"1.0.1"'}
+        response = self.client.patch("/tweets/1", json={"text": "a"}, headers=headers)
+        # Check
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(db.session.get(Tweet, 1).text, "tweet by testuser")
+
+    def test_update_one_tweet_no_payload(self):
         # Query
         response = self.client.patch("/tweets/1")
         # Check
         self.assertEqual(response.status_code, 400)
-        session_mock.query.return_value.get.assert_not_called()
-        session_mock.commit.assert_not_called()
 
-    def test_update_one_invalid_tweet(self, session_mock):
-        # Mock
-        session_mock.query.return_value.get.return_value = None
+    def test_update_one_invalid_tweet(self):
         # Query
-        response = self.client.patch("/tweets/1", json={"text": "test"})
+        with assert_num_queries(self, 1):
+            response = self.client.patch("/tweets/9", json={"text": "test"})
         # Check
         self.assertEqual(response.status_code, 404)
-        session_mock.query.return_value.get.assert_called_once_with(1)
-        session_mock.commit.assert_not_called()
@@ -1,20 +1,23 @@
+import json
 from flask_testing import TestCase
 from app import create_app, db
-from app.models import User
+from app.models import Tweet, User
 from unittest.mock import patch
+from .helpers import SQLiteConfig, assert_num_queries
+
 
 # Used to get a sample for tests
 def get_sample_user():
     u = User(username="testuser", id=1, email="testuser@test.com")
     return u
 
-
     def test_get_one_invalid_tweet(self, session_mock):
         session_mock.query.return_value.get.return_value = None
         response = self.client.get("/tweets/1")
         self.assertEqual(response.status_code, 404)
         session_mock.query.return_value.get.assert_called_once_with(1)
 
+
 # TESTS 'GET'
 @patch("app.db.session")
 class TestUserGetMethod(TestCase):
@@ -49,6 +52,57 @@ class TestUserGetMethod(TestCase):
         self.assertEqual(len(response_list), 1)
         session_mock.query.return_value.all.assert_called_once()
 
+    def test_export_users(self, session_mock):
+        # Mock
+        query = session_mock.query.return_value.order_by.return_value
+        rows = query.execution_options.return_value.yield_per
+        rows.return_value = [get_sample_user()]
+        # Query
+        response = self.client.get("/users/export")
+        lines = response.get_data(as_text=True).splitlines()
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["username"], "testuser")
+        query.execution_options.assert_called_once_with(stream_results=True)
+
+    def test_get_one_user_not_modified(self, session_mock):
+        # Mock
+        user = get_sample_user()
+        user.version = 3
+        session_mock.query.return_value.get.return_value = user
+        # Query
+        response = self.client.get("/users/1", headers={"If-None-Match": '"1.3"'})
+        # Check
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], '"1.3"')
+
+    def test_get_user_tweets(self, session_mock):
+        # Mock
+        session_mock.query.return_value.get.return_value = get_sample_user()
+        query = session_mock.query.return_value.filter.return_value.order_by
+        query.return_value.limit.return_value.all.return_value = [
+            Tweet(text="test", id=1, user_id=1)
+        ]
+        # Query
+        response = self.client.get("/users/1/tweets?limit=5")
+        response_page = response.json
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response_page["tweets"]), 1)
+        self.assertIsNone(response_page["next_cursor"])
+        query.return_value.limit.assert_called_once_with(6)
+
+    def test_get_invalid_user_tweets(self, session_mock):
+        # Mock
+        session_mock.query.return_value.get.return_value = None
+        # Query
+        response = self.client.get("/users/1/tweets")
+        # Check
+        self.assertEqual(response.status_code, 404)
+        session_mock.query.return_value.filter.assert_not_called()
+
     def test_get_one_invalid_user(self, session_mock):
         # Mock
         session_mock.query.return_value.get.return_value = None
@@ -58,6 +112,7 @@ class TestUserGetMethod(TestCase):
         self.assertEqual(response.status_code, 404)
         session_mock.query.return_value.get.assert_called_once_with(1)
 
+
 # TESTS 'POST'
 @patch("app.db.session")
 class TestUserPostMethod(TestCase):
@@ -101,69 +156,304 @@ class TestUserPostMethod(TestCase):
         session_mock.add.assert_not_called()
         session_mock.commit.assert_not_called()
 
-# TESTS 'DELETE'
+
+# TESTS 'POST' batch
 @patch("app.db.session")
-class TestUserDeleteMethod(TestCase):
+class TestUserBatchPostMethod(TestCase):
     # SETUP
     def create_app(self):
         app = create_app()
         app.config["TESTING"] = True
         return app
 
-    def test_delete_one_user(self, session_mock):
-        # mock
-        session_mock.query.return_value.get.return_value = get_sample_user()
+    def test_import_users_json(self, session_mock):
+        # Payload
+        payload = [
+            {"username": "a", "email": "a@test.com"},
+            {"username": "b"},
+            {"username": "c", "email": "c@test.com"},
+        ]
         # Query
-        response = self.client.delete("/users/1")
+        response = self.client.post("/users/batch?chunk_size=2", json=payload)
+        summary = response.json
         # Check
-        self.assertEqual(response.status_code, 204)
-        session_mock.query.return_value.get.assert_called_once_with(1)
-        session_mock.delete.assert_called_once()
-        session_mock.commit.assert_called_once()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(summary["received"], 3)
+        self.assertEqual(summary["imported"], 2)
+        self.assertEqual(summary["failed"], 1)
+        self.assertEqual(summary["chunks"], 2)
+        self.assertEqual(session_mock.execute.call_count, 2)
+        self.assertEqual(session_mock.commit.call_count, 2)
 
-    def test_delete_one_invalid_user(self, session_mock):
+    def test_import_users_ndjson_upsert(self, session_mock):
         # Mock
-        session_mock.query.return_value.get.return_value = None
+        session_mock.get_bind.return_value.dialect.name = "postgresql"
+        # Payload
+        lines = [
+            json.dumps({"username": "a", "email": "a@test.com"}),
+            "not json",
+            json.dumps({"username": "a", "email": "new-a@test.com"}),
+        ]
         # Query
-        response = self.client.delete("/users/1")
+        response = self.client.post(
+            "/users/batch?upsert=true",
+            data="\n".join(lines),
+            content_type="application/x-ndjson",
+        )
+        summary = response.json
         # Check
-        self.assertEqual(response.status_code, 404)
-        session_mock.query.return_value.get.assert_called_once_with(1)
-        session_mock.delete.assert_not_called()
-        session_mock.commit.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(summary["received"], 3)
+        self.assertEqual(summary["failed"], 1)
+        statement = str(session_mock.execute.call_args[0][0])
+        self.assertIn("ON CONFLICT (username) DO UPDATE", statement)
+        session_mock.commit.assert_called_once()
 
-# TESTS 'DELETE'
-@patch("app.db.session")
-class TestUserPatchMethod(TestCase):
+    def test_import_users_not_an_array(self, session_mock):
+        # Query
+        response = self.client.post("/users/batch", json={"username": "a"})
+        # Check
+        self.assertEqual(response.status_code, 400)
+        session_mock.execute.assert_not_called()
+
+
+# TESTS 'DELETE' and 'PATCH', against a real database
+class UserWriteTestCase(TestCase):
     # SETUP
     def create_app(self):
-        app = create_app()
+        app = create_app(SQLiteConfig)
         app.config["TESTING"] = True
         return app
 
-    def test_update_one_valid_user(self, session_mock):
-        # Mock
-        session_mock.query.return_value.get.return_value = get_sample_user()
+    def setUp(self):
+        db.create_all()
+        for name in ("testuser", "other"):
+            user = User(username=name, email=f"{name}@test.com")
+            user.tweets.append(Tweet(text=f"tweet by {name}"))
+            db.session.add(user)
+        db.session.commit()
+        db.session.expunge_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+
+class TestUserDeleteMethod(UserWriteTestCase):
+    def test_delete_one_user(self):
+        # Queries: the database deletes the tweets along; one change stands for them
+        with assert_num_queries(self, 2):
+            response = self.client.delete("/users/1")
+        # Check
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(db.session.get(User, 1))
+        self.assertEqual(db.session.query(Tweet.user_id).all(), [(2,)])
+
+    def test_delete_one_user_etag_mismatch(self):
+        # Query
+        response = self.client.delete("/users/1", headers={"If-Match": '"1.7"'})
+        # Check
+        self.assertEqual(response.status_code, 412)
+        self.assertIsNotNone(db.session.get(User, 1))
+        self.assertEqual(db.session.query(Tweet).count(), 2)
+
+    def test_delete_one_invalid_user(self):
+        # Query
+        response = self.client.delete("/users/9")
+        # Check
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(db.session.query(User).count(), 2)
+
+
+class TestUserPatchMethod(UserWriteTestCase):
+    def test_update_one_valid_user(self):
         # Payload
         payload = {
             "username": "new-user",
             "email": "new-user@new-email.com",
         }
         # Query
-        response = self.client.patch("/users/1", json=payload)
+        with assert_num_queries(self, 1) as statements:
+            response = self.client.patch("/users/1", json=payload)
         response_user = response.json
         # Check
         self.assertEqual(response.status_code, 200)
+        self.assertTrue(statements[0].startswith("UPDATE users"))
         self.assertEqual(response_user["username"], payload["username"])
         self.assertEqual(response_user["id"], 1)
         self.assertEqual(response_user["email"], payload["email"])
-        session_mock.query.return_value.get.assert_called_once_with(1)
-        session_mock.commit.assert_called_once()
+        self.assertEqual(response.headers["ETag"], '"1.2"')
+        self.assertEqual(db.session.get(User, 1).username, "new-user")
+
+    def test_update_one_user_invalidates_cache(self):
+        self.client.get("/tweets/1")
+        self.client.get("/users/1")
+        # Query
+        self.client.patch("/users/1", json={"username": "new-user"})
+        response = self.client.get("/tweets/1")
+        # Check
+        self.assertEqual(response.json["user"]["username"], "new-user")
+        self.assertEqual(self.client.get("/users/1").json["username"], "new-user")
+
+    def test_update_one_user_if_match(self):
+        # Query
+        mismatch = self.client.patch(
+            "/users/1", json={"username": "a"}, headers={"If-Match": '"1.7"'}
+        )
+        match = self.client.patch(
+            "/users/1", json={"username": "b"}, headers={"If-Match": '"1.1"'}
+        )
+        # Check
+        self.assertEqual(mismatch.status_code, 412)
+        self.assertEqual(match.status_code, 200)
+        self.assertEqual(db.session.get(User, 1).username, "b")
+
+    def test_update_one_user_username_taken(self):
+        # Query
+        response = self.client.patch("/users/1", json={"username": "other"})
+        # Check
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(db.session.get(User, 1).username, "testuser")
+
+    def test_update_one_invalid_user(self):
+        # Query
+        response = self.client.patch("/users/9", json={"username": "test"})
+        # Check
+        self.assertEqual(response.status_code, 404)
 
-    def test_update_one_tweet_no_payload(self, session_mock):
+    def test_update_one_tweet_no_payload(self):
         # Query
         response = self.client.patch("/users/1")
         # Check
         self.assertEqual(response.status_code, 400)
-        session_mock.query.return_value.get.assert_not_called()
-        session_mock.commit.assert_not_called()
+
+
+# TESTS 'POST' with taken usernames, against a real database
+class TestUserConflicts(UserWriteTestCase):
+    def test_create_taken_username(self):
+        # Payload
+        payload = {"username": "testuser", "email": "again@test.com"}
+        # Query
+        response = self.client.post("/users", json=payload)
+        # Check
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["message"], "Username testuser is taken")
+
+    def test_import_with_taken_username(self):
+        # Payload: one taken username among valid ones, and an invalid item
+        payload = [
+            {"username": f"new{i}", "email": f"new{i}@test.com"} for i in range(5)
+        ]
+        payload.insert(3, {"username": "other", "email": "other@test.com"})
+        payload.append({"username": "no email"})
+        # Query
+        response = self.client.post("/users/batch?chunk_size=4", json=payload)
+        summary = response.json
+        # Check
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((summary["imported"], summary["failed"]), (5, 2))
+        self.assertEqual(
+            summary["errors"],
+            [
+                {"index": 3, "error": "Username other is taken"},
+                {"index": 6, "error": "Expected an object with username and email"},
+            ],
+        )
+        self.assertEqual(db.session.query(User).count(), 7)
+
+
+# TESTS follows and home timeline, against a real database
+class TestUserTimeline(TestCase):
+    # SETUP
+    def create_app(self):
+        app = create_app(SQLiteConfig)
+        app.config["TESTING"] = True
+        app.config["TIMELINE_FANOUT_LIMIT"] = 1
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for name in ("reader", "friend", "celebrity", "fan"):
+            db.session.add(User(username=name, email=f"{name}@test.com"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_follow_user(self):
+        self.assertEqual(self.client.put("/users/1/following/2").status_code, 204)
+        self.assertEqual(self.client.put("/users/1/following/2").status_code, 204)
+        self.assertEqual(self.client.put("/users/1/following/1").status_code, 400)
+        self.assertEqual(self.client.put("/users/1/following/9").status_code, 404)
+        self.assertEqual(self.client.delete("/users/1/following/2").status_code, 204)
+
+    def test_home_timeline(self):
+        # "celebrity" has more followers than TIMELINE_FANOUT_LIMIT
+        for follower, followee in ((1, 2), (1, 3), (4, 3)):
+            self.client.put(f"/users/{follower}/following/{followee}")
+        self.client.post("/tweets", json={"text": "by friend", "user_id": 2})
+        self.client.post("/tweets", json={"text": "by celebrity", "user_id": 3})
+        self.client.post("/tweets", json={"text": "by fan", "user_id": 4})
+        # Query
+        response = self.client.get("/users/1/timeline")
+        # Check
+        self.assertEqual(response.status_code, 200)
+        texts = [tweet["text"] for tweet in response.json["tweets"]]
+        self.assertEqual(texts, ["by celebrity", "by friend"])
+
+    def test_missing_timeline_is_rebuilt(self):
+        self.client.post("/tweets", json={"text": "before following", "user_id": 2})
+        self.client.put("/users/1/following/2")
+        db.session.add(Tweet(text="not fanned out", user_id=2))
+        db.session.commit()
+        # Query: user 1 has no timeline in the store yet
+        response = self.client.get("/users/1/timeline")
+        # Check
+        texts = [tweet["text"] for tweet in response.json["tweets"]]
+        self.assertEqual(texts, ["not fanned out", "before following"])
+        self.assertEqual(len(self.app.extensions["timelines"].read(1, 10)), 2)
+
+    def test_invalid_user_timeline(self):
+        self.assertEqual(self.client.get("/users/9/timeline").status_code, 404)
+
+# TESTS sparse fieldsets, against a real database
+class TestUserFields(TestCase):
+    # SETUP
+    def create_app(self):
+        app = create_app(SQLiteConfig)
+        app.config["TESTING"] = True
+        return app
+
+    def setUp(self):
+        db.create_all()
+        user = User(username="alice", email="alice@test.com")
+        user.tweets.append(Tweet(text="hello"))
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_list_users(self):
+        response = self.client.get("/users?fields=username")
+        self.assertEqual(response.json, [{"username": "alice"}])
+        response = self.client.get("/users?fields=tweets")
+        self.assertEqual(response.status_code, 400)
+
+    def test_one_user(self):
+        full = self.client.get("/users/1")
+        response = self.client.get("/users/1?fields=email,id")
+        self.assertEqual(response.json, {"id": 1, "email": "alice@test.com"})
+        self.assertEqual(response.headers["ETag"], full.headers["ETag"])
+        self.assertEqual(self.client.get("/users/2?fields=id").status_code, 404)
+
+    def test_user_tweets(self):
+        response = self.client.get("/users/1/tweets?fields=text")
+        self.assertEqual(
+            response.json, {"tweets": [{"text": "hello"}], "next_cursor": None}
+        )
+        self.assertEqual(
+            self.client.get("/users/2/tweets?fields=text").status_code, 404
+        )
@@ -0,0 +1,211 @@
+import sys
+import unittest
+from unittest.mock import Mock, patch
+from app import create_app, db
+from app.auth import KeyIndex, MemoryRateLimiter, RedisRateLimiter, hash_key
+from app.models import User
+from tests.apis.helpers import SQLiteConfig
+
+
+class AuthConfig(SQLiteConfig):
+    AUTH_MODE = "writes"
+    RATE_LIMIT_BACKEND = "memory"
+    RATE_LIMIT_RATE = 1
+    RATE_LIMIT_BURST = 3
+    ADMIN_API_KEY = "admin"
+
+
+class TestKeyIndex(unittest.TestCase):
+    def test_resolves_once_per_ttl(self):
+        lookup = Mock(return_value=7)
+        index = KeyIndex(lookup, ttl=10)
+        with patch("time.monotonic", return_value=100):
+            self.assertEqual(index.resolve("secret"), 7)
+            self.assertEqual(index.resolve("secret"), 7)
+        self.assertEqual(lookup.call_count, 1)
+        with patch("time.monotonic", return_value=111):
+            self.assertEqual(index.resolve("secret"), 7)
+        self.assertEqual(lookup.call_count, 2)
+
+    def test_holds_digests_only(self):
+        index = KeyIndex(Mock(return_value=7))
+        index.resolve("secret")
+        self.assertEqual(list(index._entries), [hash_key("secret")])
+
+    def test_invalidate_user(self):
+        lookup = Mock(return_value=7)
+        index = KeyIndex(lookup)
+        index.resolve("secret")
+        index.invalidate_user(7)
+        lookup.return_value = None
+        self.assertIsNone(index.resolve("secret"))
+        self.assertEqual(index.stats()["entries"], 1)
+
+    def test_unknown_keys_expire_sooner(self):
+        lookup = Mock(return_value=None)
+        index = KeyIndex(lookup, ttl=60, miss_ttl=5)
+        with patch("time.monotonic", return_value=100):
+            self.assertIsNone(index.resolve("secret"))
+        lookup.return_value = 7
+        with patch("time.monotonic", return_value=104):
+            self.assertIsNone(index.resolve("secret"))
+        with patch("time.monotonic", return_value=106):
+            self.assertEqual(index.resolve("secret"), 7)
+
+    def test_forget(self):
+        lookup = Mock(return_value=None)
+        index = KeyIndex(lookup)
+        index.resolve("secret")
+        lookup.return_value = 7
+        index.forget("secret")
+        self.assertEqual(index.resolve("secret"), 7)
+
+
+class TestRateLimiters(unittest.TestCase):
+    def test_memory_bucket_refills(self):
+        limiter = MemoryRateLimiter(rate=2, burst=2)
+        with patch("time.monotonic", return_value=100):
+            self.assertEqual(limiter.take("user:1"), (True, 1))
+            self.assertEqual(limiter.take("user:1"), (True, 0))
+            self.assertEqual(limiter.take("user:1"), (False, 0))
+            self.assertTrue(limiter.take("user:2")[0])
+        with patch("time.monotonic", return_value=100.5):
+            self.assertEqual(limiter.take("user:1"), (True, 0))
+
+    def test_redis_bucket_runs_script(self):
+        client = Mock()
+        client.register_script.return_value.return_value = [0, b"0.25"]
+        limiter = RedisRateLimiter(client, rate=1, burst=3)
+        self.assertEqual(limiter.take("user:1"), (False, 0.25))
+        client.register_script.return_value.assert_called_once_with(
+            keys=["twitter-api:ratelimit:user:1"], args=[1, 3]
+        )
+
+
+class TestAuthentication(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(AuthConfig)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        db.session.add(
+            User(username="alice", email="alice@test.com", api_key=hash_key("k1"))
+        )
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def post_tweet(self, api_key=None):
+        headers = {"X-API-Key": api_key} if api_key else {}
+        return self.client.post(
+            "/tweets", json={"text": "hello", "user_id": 1}, headers=headers
+        )
+
+    def test_writes_need_a_key(self):
+        self.assertEqual(self.post_tweet().status_code, 401)
+        self.assertEqual(self.post_tweet("wrong").status_code, 401)
+        response = self.post_tweet("k1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-RateLimit-Remaining"], "2")
+
+    def test_reads_and_sign_up_are_open(self):
+        self.assertEqual(self.client.get("/tweets").status_code, 200)
+        response = self.client.post(
+            "/users", json={"username": "bob", "email": "bob@test.com"}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_sign_up_issues_a_key(self):
+        response = self.client.post(
+            "/users", json={"username": "bob", "email": "bob@test.com"}
+        )
+        api_key = response.json["api_key"]
+        user = db.session.get(User, response.json["id"])
+        self.assertEqual(user.api_key, hash_key(api_key))
+        response = self.client.post(
+            "/tweets",
+            json={"text": "hi", "user_id": user.id},
+            headers={"X-API-Key": api_key},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_keys_are_not_shown(self):
+        self.assertNotIn("api_key", self.client.get("/users").json[0])
+        self.assertNotIn("api_key", self.client.get("/users/1").json)
+        response = self.client.get("/users?fields=api_key")
+        self.assertEqual(response.status_code, 400)
+
+    def test_key_is_resolved_from_the_index(self):
+        self.post_tweet("k1")
+        # Not patch("app.auth..."): app.auth also names the extension
+        with patch.object(sys.modules["app.auth"], "find_user_id") as lookup:
+            self.assertEqual(self.post_tweet("k1").status_code, 200)
+        lookup.assert_not_called()
+
+    def test_deleted_user_key_is_rejected(self):
+        self.post_tweet("k1")
+        response = self.client.delete("/users/1", headers={"X-API-Key": "k1"})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.post_tweet("k1").status_code, 401)
+
+    def test_rate_limited(self):
+        for _ in range(3):
+            self.assertEqual(self.post_tweet("k1").status_code, 200)
+        response = self.post_tweet("k1")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "1")
+        self.assertEqual(response.headers["X-RateLimit-Remaining"], "0")
+
+    def test_rotate_own_key(self):
+        self.post_tweet("k1")
+        response = self.client.post("/users/1/key", headers={"X-API-Key": "k1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["username"], "alice")
+        api_key = response.json["api_key"]
+        self.assertEqual(db.session.get(User, 1).api_key, hash_key(api_key))
+        self.assertEqual(self.post_tweet("k1").status_code, 401)
+        self.assertEqual(self.post_tweet(api_key).status_code, 200)
+
+    def test_admin_issues_keys(self):
+        db.session.add(User(username="bob", email="bob@test.com"))
+        db.session.commit()
+        response = self.client.post("/users/2/key", headers={"X-Admin-Key": "admin"})
+        self.assertEqual(response.status_code, 200)
+        tweet = {"text": "hi", "user_id": 2}
+        headers = {"X-API-Key": response.json["api_key"]}
+        response = self.client.post("/tweets", json=tweet, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post("/users/9/key", headers={"X-Admin-Key": "admin"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_issuing_keys_needs_the_owner_or_an_admin(self):
+        db.session.add(User(username="bob", email="bob@test.com"))
+        db.session.commit()
+        self.assertEqual(self.client.post("/users/2/key").status_code, 401)
+        headers = {"X-Admin-Key": "wrong"}
+        self.assertEqual(
+            self.client.post("/users/2/key", headers=headers).status_code, 401
+        )
+        headers = {"X-API-Key": "k1"}
+        self.assertEqual(
+            self.client.post("/users/2/key", headers=headers).status_code, 403
+        )
+
+    def test_stats_follow_auth_mode(self):
+        self.assertEqual(self.client.get("/cache/stats").status_code, 200)
+        self.app.config["AUTH_MODE"] = "all"
+        for path in (
+            "/cache/stats",
+            "/db/pool",
+            "/db/replicas",
+            "/tweets/stream/stats",
+        ):
+            self.assertEqual(self.client.get(path).status_code, 401)
+            response = self.client.get(path, headers={"X-Admin-Key": "admin"})
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get("/db/pool", headers={"X-API-Key": "k1"})
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch
+from app.cache import LRUCache, RedisCache
+
+
+class FakeRedis:
+    """Local stand-in for the few redis-py commands RedisCache uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(member.encode())
+
+    def smembers(self, key):
+        return self.data.get(key, set())
+
+    def expire(self, key, seconds):
+        pass
+
+    def info(self, section):
+        return {"evicted_keys": 0}
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = LRUCache()
+        self.assertIsNone(cache.get("tweet:1"))
+        cache.set("tweet:1", "{}")
+        self.assertEqual(cache.get("tweet:1"), "{}")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expires_after_ttl(self):
+        cache = LRUCache(ttl=10)
+        with patch("time.monotonic", return_value=100):
+            cache.set("a", "1")
+        with patch("time.monotonic", return_value=111):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_invalidate_tag(self):
+        cache = LRUCache()
+        cache.set("tweet:1", "1", tags=["user:1:tweets"])
+        cache.set("tweet:2", "2", tags=["user:2:tweets"])
+        cache.invalidate_tag("user:1:tweets")
+        self.assertIsNone(cache.get("tweet:1"))
+        self.assertEqual(cache.get("tweet:2"), "2")
+
+
+class TestRedisCache(unittest.TestCase):
+    def test_get_set_delete(self):
+        cache = RedisCache(FakeRedis())
+        cache.set("user:1", "{}")
+        self.assertEqual(cache.get("user:1"), "{}")
+        cache.delete("user:1")
+        self.assertIsNone(cache.get("user:1"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_invalidate_tag(self):
+        cache = RedisCache(FakeRedis())
+        cache.set("tweet:1", "1", tags=["user:1:tweets"])
+        cache.set("tweet:2", "2", tags=["user:2:tweets"])
+        cache.invalidate_tag("user:1:tweets")
+        self.assertIsNone(cache.get("tweet:1"))
+        self.assertEqual(cache.get("tweet:2"), "2")
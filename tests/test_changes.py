@@ -0,0 +1,229 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+from app import create_app, db
+from app.change_log import StreamGap, check_catch_up, prune
+from app.changes import (
+    ChangeFeed,
+    Subscription,
+    format_event,
+    parse_since,
+    unseen,
+)
+from app.models import TweetChange, User
+from tests.apis.helpers import SQLiteConfig
+
+
+class StreamConfig(SQLiteConfig):
+    TWEET_STREAM_BUFFER = 3
+    TWEET_STREAM_CATCHUP_MAX = 3
+    TWEET_STREAM_HEARTBEAT = 0.05
+    TWEET_STREAM_SETTLE_SECONDS = 0
+
+
+def parse_events(body):
+    """The (id, event, data) of each event of an SSE body"""
+    events = []
+    for block in body.split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        if "id" in lines:
+            events.append((int(lines["id"]), lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class TestChangeFeed(unittest.TestCase):
+    def test_subscription_closes_when_full(self):
+        wake = Mock()
+        subscription = Subscription(2, wake)
+        for event_id in range(3):
+            subscription.put({"id": event_id})
+        self.assertTrue(subscription.closed)
+        self.assertEqual(subscription.drain(), [{"id": 0}, {"id": 1}])
+        self.assertEqual(wake.call_count, 3)
+
+    def test_publish_delivers_to_subscribers(self):
+        feed = ChangeFeed(10)
+        first, second = feed.subscribe(Mock()), feed.subscribe(Mock())
+        feed.publish([{"id": 1}, {"id": 2}])
+        feed.unsubscribe(second)
+        feed.publish([{"id": 3}])
+        self.assertEqual([e["id"] for e in first.drain()], [1, 2, 3])
+        self.assertEqual([e["id"] for e in second.drain()], [1, 2])
+        self.assertEqual(feed.stats()["subscribers"], 1)
+
+    def test_publish_is_left_to_the_listener(self):
+        feed = ChangeFeed(10, listener=Mock())
+        feed._listener_pid = -1
+        subscription = Subscription(10, Mock())
+        feed._subscribers.add(subscription)
+        feed.publish([{"id": 1}])
+        self.assertEqual(subscription.drain(), [])
+        feed.deliver([{"id": 1}])
+        self.assertEqual(subscription.drain(), [{"id": 1}])
+
+    def test_disconnects_are_counted(self):
+        feed = ChangeFeed(1)
+        subscription = feed.subscribe(Mock())
+        feed.publish([{"id": 1}, {"id": 2}])
+        feed.unsubscribe(subscription)
+        self.assertEqual(feed.stats()["disconnected"], 1)
+
+    def test_format_event(self):
+        event = {"id": 7, "action": "deleted", "data": '{"id": 3}'}
+        self.assertEqual(
+            format_event(event), 'id: 7\nevent: deleted\ndata: {"id": 3}\n\n'
+        )
+
+    def test_parse_since(self):
+        self.assertIsNone(parse_since(None, None))
+        self.assertEqual(parse_since("5", "9"), 5)
+        self.assertEqual(parse_since(None, "9"), 9)
+        with self.assertRaises(ValueError):
+            parse_since("x", None)
+
+    def test_unseen(self):
+        # 4 was caught up on, 3 committed after it
+        seen = {2, 4}
+        events = [{"id": 4}, {"id": 3}, {"id": 5}]
+        self.assertEqual(list(unseen(events, seen)), [{"id": 3}, {"id": 5}])
+        self.assertEqual(seen, {2})
+
+    def test_check_catch_up(self):
+        check_catch_up(0, None, [], 2)
+        check_catch_up(4, 4, [{}, {}], 2)
+        with self.assertRaises(StreamGap):
+            check_catch_up(3, 4, [], 2)
+        with self.assertRaises(StreamGap):
+            check_catch_up(4, 4, [{}, {}, {}], 2)
+
+
+class TestTweetStream(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(StreamConfig)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        db.session.add(User(username="ben", email="ben@test.com"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def write(self):
+        """Create, update and delete a tweet"""
+        created = self.client.post("/tweets", json={"text": "hi", "user_id": 1})
+        tweet_id = created.json["id"]
+        self.client.patch(f"/tweets/{tweet_id}", json={"text": "bye"})
+        self.client.delete(f"/tweets/{tweet_id}")
+        return created.json
+
+    def test_writes_are_recorded(self):
+        tweet = self.write()
+        changes = db.session.query(TweetChange).order_by(TweetChange.id).all()
+        self.assertEqual(
+            [(c.tweet_id, c.action) for c in changes],
+            [
+                (tweet["id"], "created"),
+                (tweet["id"], "updated"),
+                (tweet["id"], "deleted"),
+            ],
+        )
+        self.assertEqual(json.loads(changes[0].payload), tweet)
+
+    def test_user_deletion_is_recorded(self):
+        tweet = self.client.post("/tweets", json={"text": "hi", "user_id": 1}).json
+        self.assertEqual(self.client.delete("/users/1").status_code, 204)
+        response = self.client.get("/tweets/stream?since=1")
+        events = parse_events(response.get_data(as_text=True))
+        self.assertEqual(
+            events, [(2, "user_deleted", {"user_id": tweet["user"]["id"]})]
+        )
+
+    def test_catch_up(self):
+        tweet = self.write()
+        response = self.client.get("/tweets/stream?since=0")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/event-stream")
+        self.assertEqual(response.headers["Cache-Control"], "no-cache")
+        body = response.get_data(as_text=True)
+        self.assertTrue(body.startswith("retry: 3000\n\n"))
+        self.assertEqual(
+            parse_events(body),
+            [
+                (1, "created", tweet),
+                (2, "updated", dict(tweet, text="bye")),
+                (3, "deleted", {"id": tweet["id"]}),
+            ],
+        )
+
+    def test_last_event_id(self):
+        self.write()
+        response = self.client.get("/tweets/stream", headers={"Last-Event-ID": "2"})
+        events = parse_events(response.get_data(as_text=True))
+        self.assertEqual([event[:2] for event in events], [(3, "deleted")])
+
+    def test_cursor(self):
+        self.assertEqual(
+            self.client.get("/tweets/stream").get_data(), b"retry: 3000\n\nid: 0\n\n"
+        )
+        self.write()
+        response = self.client.get("/tweets/stream")
+        self.assertEqual(response.get_data(), b"retry: 3000\n\nid: 3\n\n")
+        self.assertEqual(self.app.extensions["changes"].stats()["subscribers"], 0)
+
+    def test_poll(self):
+        self.write()
+        response = self.client.get("/tweets/stream", headers={"Last-Event-ID": "3"})
+        self.assertEqual(response.get_data(), b"retry: 3000\n\n")
+        tweet = self.write()
+        response = self.client.get("/tweets/stream", headers={"Last-Event-ID": "3"})
+        events = parse_events(response.get_data(as_text=True))
+        self.assertEqual(events[0], (4, "created", tweet))
+
+    def test_too_far_behind(self):
+        self.write()
+        self.write()
+        response = self.client.get("/tweets/stream?since=1")
+        self.assertEqual(response.status_code, 410)
+
+    def test_pruned(self):
+        self.write()
+        self.write()
+        db.session.query(TweetChange).filter(TweetChange.id <= 3).update(
+            {"created_at": datetime(2020, 1, 1)}
+        )
+        self.assertEqual(prune(db.session, datetime(2020, 1, 2)), 3)
+        db.session.commit()
+        self.assertEqual(self.client.get("/tweets/stream?since=2").status_code, 410)
+        response = self.client.get("/tweets/stream?since=3")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([event[0] for event in parse_events(response.text)], [4, 5, 6])
+
+    def test_gaps_are_not_pruned(self):
+        self.write()
+        db.session.query(TweetChange).filter(TweetChange.id < 3).delete()
+        db.session.commit()
+        self.assertEqual(self.client.get("/tweets/stream?since=1").status_code, 200)
+
+    def test_unsettled_changes_are_held_back(self):
+        self.app.config["TWEET_STREAM_SETTLE_SECONDS"] = 60
+        self.write()
+        # Change 2 was just committed: 3 could have had its id first
+        old = datetime.utcnow() - timedelta(minutes=5)
+        db.session.query(TweetChange).filter(TweetChange.id != 2).update(
+            {"created_at": old}
+        )
+        db.session.commit()
+        response = self.client.get("/tweets/stream?since=0")
+        self.assertEqual([event[0] for event in parse_events(response.text)], [1])
+        response = self.client.get("/tweets/stream")
+        self.assertEqual(response.get_data(), b"retry: 3000\n\nid: 1\n\n")
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/tweets/stream?since=abc")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.app.extensions["changes"].stats()["subscribers"], 0)
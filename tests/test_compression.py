@@ -0,0 +1,108 @@
+import gzip
+import unittest
+from unittest.mock import Mock, patch
+from app import create_app, db
+from app.compression import CODECS
+from app.models import Tweet, User
+from tests.apis.helpers import SQLiteConfig
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(SQLiteConfig)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        user = User(username="alice", email="alice@test.com")
+        for i in range(30):
+            user.tweets.append(Tweet(text=f"tweet number {i}"))
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def get(self, path, encoding):
+        return self.client.get(path, headers={"Accept-Encoding": encoding})
+
+    def test_gzip(self):
+        plain = self.get("/tweets?limit=30", "identity")
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.headers["Vary"], "Accept-Encoding")
+
+        response = self.get("/tweets?limit=30", "gzip")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+
+    def test_preference_and_quality(self):
+        self.app.config["COMPRESSION_ENCODINGS"] = "gzip"
+        response = self.get("/tweets?limit=30", "br, gzip;q=0.5")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        response = self.get("/tweets?limit=30", "gzip;q=0")
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    @unittest.skipUnless("br" in CODECS, "brotli is not installed")
+    def test_brotli(self):
+        import brotli
+
+        plain = self.get("/tweets?limit=30", "identity")
+        response = self.get("/tweets?limit=30", "br, gzip")
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.data), plain.data)
+
+    @unittest.skipUnless("zstd" in CODECS, "zstandard is not installed")
+    def test_zstd(self):
+        import zstandard
+
+        plain = self.get("/tweets?limit=30", "identity")
+        response = self.get("/tweets?limit=30", "gzip, zstd")
+        self.assertEqual(response.headers["Content-Encoding"], "zstd")
+        self.assertEqual(
+            zstandard.ZstdDecompressor().decompress(response.data), plain.data
+        )
+
+    def test_small_bodies_are_sent_as_is(self):
+        response = self.get("/tweets?limit=1", "gzip")
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_cached_bodies_are_compressed_once(self):
+        self.app.config["COMPRESSION_MIN_SIZE"] = 1
+        gzip_codec, level_key = CODECS["gzip"]
+        compress = Mock(wraps=gzip_codec)
+        with patch.dict(CODECS, {"gzip": (compress, level_key)}):
+            first = self.get("/tweets/1", "gzip")
+            second = self.get("/tweets/1", "gzip")
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first.headers["Content-Encoding"], "gzip")
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers["ETag"], second.headers["ETag"])
+
+        # Each encoding is its own representation
+        identity = self.get("/tweets/1", "identity").headers["ETag"]
+        self.assertEqual(first.headers["ETag"], identity[:-1] + '-gzip"')
+
+        # A new version of the entry gets compressed again
+        self.client.patch("/tweets/1", json={"text": "edited"})
+        response = self.get("/tweets/1", "gzip")
+        self.assertIn(b"edited", gzip.decompress(response.data))
+
+    def test_compressed_etags_validate(self):
+        self.app.config["COMPRESSION_MIN_SIZE"] = 1
+        etag = self.get("/tweets/1", "gzip").headers["ETag"]
+        response = self.client.get(
+            "/tweets/1", headers={"Accept-Encoding": "gzip", "If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        response = self.client.patch(
+            "/tweets/1", json={"text": "edited"}, headers={"If-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(
+            "/tweets/1", json={"text": "again"}, headers={"If-Match": etag}
+        )
+        self.assertEqual(response.status_code, 412)
@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError
+from app.ingest import BatchWriter, DurableQueue, QueueFull
+
+
+class TestDurableQueue(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "queue.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_put_claim_ack(self):
+        queue = DurableQueue(self.path, max_depth=10)
+        queue.put("a", {"text": "first"})
+        queue.put("b", {"text": "second"})
+        items = queue.claim(10)
+        self.assertEqual([pid for _, pid, _ in items], ["a", "b"])
+        self.assertEqual(items[0][2], {"text": "first"})
+        # Claimed items are leased, not handed out twice
+        self.assertEqual(queue.claim(10), [])
+        queue.ack([items[0][0]], dead=[(items[1][0], "bad row")])
+        self.assertEqual(queue.stats()["depth"], 0)
+        self.assertEqual(queue.stats()["dead_letters"], 1)
+
+    def test_expired_lease_is_reclaimed(self):
+        queue = DurableQueue(self.path, max_depth=10, lease=0)
+        queue.put("a", {})
+        queue.claim(10)
+        self.assertEqual(
+            len(DurableQueue(self.path, max_depth=10, lease=-1).claim(10)), 1
+        )
+
+    def test_queue_full(self):
+        queue = DurableQueue(self.path, max_depth=1)
+        queue.put("a", {})
+        with self.assertRaises(QueueFull):
+            queue.put("b", {})
+
+
+@patch("app.db.session")
+class TestBatchWriter(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.queue = DurableQueue(os.path.join(self.directory.name, "q"), 10)
+        self.app = MagicMock()
+        self.app.config = {"INGEST_BATCH_SIZE": 10, "INGEST_FLUSH_INTERVAL": 1}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_flush_writes_one_batch(self, session_mock):
+        write = MagicMock()
+        for i in range(3):
+            self.queue.put(str(i), {"text": str(i)})
+        writer = BatchWriter(self.app, self.queue, write)
+        self.assertEqual(writer.flush(), 3)
+        write.assert_called_once_with([{"text": "0"}, {"text": "1"}, {"text": "2"}])
+        self.assertEqual(self.queue.stats()["depth"], 0)
+        self.assertEqual(writer.stats()["written"], 3)
+
+    def test_flush_isolates_bad_rows(self, session_mock):
+        def write(rows):
+            if len(rows) > 1 or rows[0]["text"] == "bad":
+                raise IntegrityError("INSERT", {}, Exception("fk"))
+
+        for text in ("good", "bad", "good"):
+            self.queue.put(text, {"text": text})
+        writer = BatchWriter(self.app, self.queue, write)
+        writer.flush()
+        self.assertEqual(writer.stats()["written"], 2)
+        self.assertEqual(writer.stats()["failed"], 1)
+        self.assertEqual(self.queue.stats()["dead_letters"], 1)
+
+    def test_unwritable_rows_do_not_block_the_queue(self, session_mock):
+        def write(rows):
+            if any(row["text"] == "too long" for row in rows):
+                raise DataError("INSERT", {}, Exception("value too long"))
+
+        for text in ("too long", "good"):
+            self.queue.put(text, {"text": text})
+        writer = BatchWriter(self.app, self.queue, write)
+        writer.flush()
+        self.assertEqual(writer.stats()["written"], 1)
+        self.assertEqual(self.queue.stats()["depth"], 0)
+        self.assertEqual(self.queue.stats()["dead_letters"], 1)
+        # The next items are written
+        self.queue.put("later", {"text": "later"})
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual(writer.stats()["written"], 2)
+
+    def test_publish_failure_writes_rows_once(self, session_mock):
+        # Reclaimable at once, were the batch left un-acked
+        self.queue.lease = -1
+        write = MagicMock(side_effect=lambda rows: len(rows))
+        publish = MagicMock(side_effect=[RuntimeError("timeline store down"), None])
+        for text in ("a", "b"):
+            self.queue.put(text, {"text": text})
+        writer = BatchWriter(self.app, self.queue, write, publish)
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(writer.flush(), 0)
+        write.assert_called_once_with([{"text": "a"}, {"text": "b"}])
+        publish.assert_called_once_with(2)
+        self.app.logger.exception.assert_called_once()
+        self.assertEqual(self.queue.stats()["depth"], 0)
+
+    def test_bad_rows_are_published_one_by_one(self, session_mock):
+        def write(rows):
+            if len(rows) > 1 or rows[0]["text"] == "bad":
+                raise IntegrityError("INSERT", {}, Exception("fk"))
+            return rows[0]["text"]
+
+        publish = MagicMock()
+        for text in ("good", "bad", "fine"):
+            self.queue.put(text, {"text": text})
+        BatchWriter(self.app, self.queue, write, publish).flush()
+        self.assertEqual(
+            [c.args for c in publish.call_args_list], [("good",), ("fine",)]
+        )
+
+    def test_transient_errors_dead_letter_nothing(self, session_mock):
+        write = MagicMock(side_effect=OperationalError("INSERT", {}, Exception("gone")))
+        self.queue.put("a", {"text": "a"})
+        writer = BatchWriter(self.app, self.queue, write)
+        with self.assertRaises(OperationalError):
+            writer.flush()
+        self.assertEqual(self.queue.stats()["depth"], 1)
+        self.assertEqual(self.queue.stats()["dead_letters"], 0)
@@ -0,0 +1,82 @@
+import unittest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from app import create_app, db
+from app.models import Tweet, User
+from tests.apis.helpers import SQLiteConfig
+
+TWEET_MAIN = {"namespace": "tweets", "resource": "TweetMain", "method": "GET"}
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(SQLiteConfig)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        user = User(username="alice", email="alice@test.com")
+        db.session.add(user)
+        db.session.add(Tweet(text="hello", user=user))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_request_latency_and_sql_per_route(self):
+        requests = sample("http_request_duration_seconds_count", **TWEET_MAIN)
+        statements = sample("sqlalchemy_statements_per_request_sum", **TWEET_MAIN)
+        marshal = sample(
+            "http_serialization_duration_seconds_count", stage="marshal", **TWEET_MAIN
+        )
+        encode = sample(
+            "http_serialization_duration_seconds_count", stage="json", **TWEET_MAIN
+        )
+
+        self.assertEqual(self.client.get("/tweets").status_code, 200)
+
+        self.assertEqual(
+            sample("http_request_duration_seconds_count", **TWEET_MAIN), requests + 1
+        )
+        self.assertEqual(
+            sample("sqlalchemy_statements_per_request_sum", **TWEET_MAIN),
+            statements + 1,
+        )
+        self.assertEqual(
+            sample(
+                "http_serialization_duration_seconds_count",
+                stage="marshal",
+                **TWEET_MAIN,
+            ),
+            marshal + 1,
+        )
+        self.assertEqual(
+            sample(
+                "http_serialization_duration_seconds_count", stage="json", **TWEET_MAIN
+            ),
+            encode + 1,
+        )
+        self.assertEqual(sample("http_requests_in_flight", **TWEET_MAIN), 0)
+        self.assertGreater(sample("http_requests_total", status="200", **TWEET_MAIN), 0)
+
+    def test_metrics_endpoint(self):
+        self.client.get("/tweets/1")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"http_request_duration_seconds_bucket", response.data)
+        self.assertIn(b'resource="TweetById"', response.data)
+        self.assertIn(b"sqlalchemy_statement_duration_seconds", response.data)
+
+    def test_failed_statements_are_not_left_timed(self):
+        connection = db.session.connection()
+        for _ in range(3):
+            with self.assertRaises(OperationalError):
+                connection.execute(text("SELECT * FROM missing"))
+        self.assertNotIn("query_started", connection.info)
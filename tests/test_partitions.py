@@ -0,0 +1,82 @@
+import unittest
+from datetime import datetime
+from unittest.mock import Mock
+from app.partitions import (
+    Partition,
+    create_partition,
+    month_start,
+    parse_bound,
+    plan,
+)
+
+
+class TestPartitionPlanning(unittest.TestCase):
+    def test_month_start(self):
+        moment = datetime(2026, 11, 17, 8, 30)
+        self.assertEqual(month_start(moment), datetime(2026, 11, 1))
+        self.assertEqual(month_start(moment, 2), datetime(2027, 1, 1))
+        self.assertEqual(month_start(moment, -11), datetime(2025, 12, 1))
+
+    def test_parse_bound(self):
+        self.assertEqual(
+            parse_bound(
+                "tweets_legacy", "FOR VALUES FROM (MINVALUE) TO ('2026-12-01 00:00:00')"
+            ),
+            Partition("tweets_legacy", None, datetime(2026, 12, 1)),
+        )
+        self.assertEqual(
+            parse_bound(
+                "tweets_2026_12",
+                "FOR VALUES FROM ('2026-12-01 00:00:00') TO ('2027-01-01 00:00:00')",
+            ),
+            Partition("tweets_2026_12", datetime(2026, 12, 1), datetime(2027, 1, 1)),
+        )
+        self.assertEqual(
+            parse_bound("tweets_default", "DEFAULT"),
+            Partition("tweets_default", None, None),
+        )
+        with self.assertRaises(ValueError):
+            parse_bound("tweets_x", "FOR VALUES IN (1)")
+
+    def test_plan_creates_missing_months(self):
+        partitions = [
+            Partition("tweets_legacy", None, datetime(2026, 12, 1)),
+            Partition("tweets_2026_12", datetime(2026, 12, 1), datetime(2027, 1, 1)),
+            Partition("tweets_default", None, None),
+        ]
+        starts, old = plan(partitions, datetime(2026, 11, 17), 3, 0)
+        # November is in the legacy partition, December exists
+        self.assertEqual(starts, [datetime(2027, 1, 1), datetime(2027, 2, 1)])
+        self.assertEqual(old, [])
+
+    def test_plan_retires_expired_partitions(self):
+        partitions = [
+            Partition("tweets_legacy", None, datetime(2026, 1, 1)),
+            Partition("tweets_2026_01", datetime(2026, 1, 1), datetime(2026, 2, 1)),
+            Partition("tweets_2026_02", datetime(2026, 2, 1), datetime(2026, 3, 1)),
+            Partition("tweets_default", None, None),
+        ]
+        _, old = plan(partitions, datetime(2027, 2, 10), 0, 12)
+        self.assertEqual([p.name for p in old], ["tweets_legacy", "tweets_2026_01"])
+
+
+class TestCreatePartition(unittest.TestCase):
+    def test_moves_rows_out_of_the_default_partition(self):
+        connection = Mock()
+        name = create_partition(connection, datetime(2027, 1, 1))
+        self.assertEqual(name, "tweets_2027_01")
+        statements = [str(call.args[0]) for call in connection.execute.call_args_list]
+        self.assertEqual(len(statements), 3)
+        self.assertTrue(statements[0].startswith("CREATE TABLE tweets_2027_01"))
+        # The month's rows leave the default partition before attaching
+        self.assertIn(
+            "DELETE FROM tweets_default WHERE created_at >= '2027-01-01 00:00:00' "
+            "AND created_at < '2027-02-01 00:00:00' RETURNING *",
+            statements[1],
+        )
+        self.assertIn("INSERT INTO tweets_2027_01 SELECT * FROM moved", statements[1])
+        self.assertTrue(
+            statements[2].startswith(
+                "ALTER TABLE tweets ATTACH PARTITION tweets_2027_01"
+            )
+        )
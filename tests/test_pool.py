@@ -0,0 +1,89 @@
+import os
+import tempfile
+import unittest
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from app import create_app, db
+from app.pool import PoolMetrics, engine_options
+from tests.apis.helpers import SQLiteConfig
+
+
+class TestEngineOptions(unittest.TestCase):
+    def config(self, uri, **overrides):
+        config = {
+            key: getattr(SQLiteConfig, key)
+            for key in dir(SQLiteConfig)
+            if key.isupper()
+        }
+        config.update(SQLALCHEMY_DATABASE_URI=uri, **overrides)
+        return config
+
+    def test_in_memory_sqlite_is_left_alone(self):
+        options = engine_options(self.config("sqlite://"), PoolMetrics(0))
+        self.assertEqual(options, {})
+
+    def test_pool_settings(self):
+        config = self.config(
+            "postgresql://localhost/twitter",
+            DB_POOL_SIZE=7,
+            DB_MAX_OVERFLOW=3,
+            DB_POOL_RECYCLE=60,
+            DB_POOL_PRE_PING=True,
+            DB_STATEMENT_TIMEOUT_MS=2500,
+        )
+        options = engine_options(config, PoolMetrics(3))
+        self.assertEqual(options["pool_size"], 7)
+        self.assertEqual(options["max_overflow"], 3)
+        self.assertEqual(options["pool_recycle"], 60)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(
+            options["connect_args"], {"options": "-c statement_timeout=2500"}
+        )
+
+    def test_statement_timeout_is_postgresql_only(self):
+        config = self.config("sqlite:///twitter.db", DB_STATEMENT_TIMEOUT_MS=2500)
+        self.assertNotIn("connect_args", engine_options(config, PoolMetrics(0)))
+
+
+class TestPoolInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmpdir.name, "pool.sqlite3")
+
+        class PoolConfig(SQLiteConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{path}"
+            DB_POOL_SIZE = 1
+            DB_MAX_OVERFLOW = 0
+            DB_POOL_TIMEOUT = 0.05
+
+        self.app = create_app(PoolConfig)
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.engine.dispose()
+        self.context.pop()
+        self.tmpdir.cleanup()
+
+    def test_checkouts_and_churn_are_recorded(self):
+        with db.engine.connect():
+            pass
+        with db.engine.connect():
+            pass
+
+        stats = self.app.test_client().get("/db/pool").json
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["connections_opened"], 1)
+        self.assertEqual(stats["exhausted"], 0)
+        self.assertEqual(stats["pool_size"], 1)
+        self.assertEqual(stats["checked_in"], 1)
+        self.assertIsNotNone(stats["checkout_wait_ms"]["p95"])
+
+    def test_exhaustion_and_timeouts_are_recorded(self):
+        with db.engine.connect():
+            with self.assertRaises(PoolTimeout):
+                db.engine.connect()
+
+        stats = self.app.test_client().get("/db/pool").json
+        self.assertEqual(stats["checkouts"], 1)
+        self.assertEqual(stats["exhausted"], 1)
+        self.assertEqual(stats["timeouts"], 1)
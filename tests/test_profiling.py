@@ -0,0 +1,79 @@
+import tempfile
+import unittest
+from app import create_app, db
+from app.models import User
+from tests.apis.helpers import SQLiteConfig
+
+
+class TestProfiling(unittest.TestCase):
+    def make_app(self, **settings):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        config = type(
+            "ProfileConfig",
+            (SQLiteConfig,),
+            dict(PROFILE_DIR=self.tmpdir.name, **settings),
+        )
+        app = create_app(config)
+        with app.app_context():
+            db.create_all()
+            db.session.add(User(username="alice", email="alice@test.com"))
+            db.session.commit()
+        return app.test_client()
+
+    def profiles(self, client):
+        response = client.get("/profiles", headers={"X-Profile": "secret"})
+        self.assertEqual(response.status_code, 200)
+        return response.json
+
+    def test_header_trigger(self):
+        client = self.make_app(PROFILE_ADMIN_KEY="secret")
+        client.get("/users")
+        client.get("/users", headers={"X-Profile": "wrong"})
+        self.assertEqual(self.profiles(client), [])
+
+        client.get("/users/1", headers={"X-Profile": "secret"})
+        (profile,) = self.profiles(client)
+        self.assertEqual(profile["trigger"], "header")
+        self.assertEqual(profile["path"], "/users/1")
+        self.assertEqual(profile["status"], 200)
+        self.assertEqual(profile["sql"], 1)
+
+        headers = {"X-Profile": "secret"}
+        detail = client.get(f"/profiles/{profile['id']}", headers=headers).json
+        self.assertIn("FROM users", detail["sql"][0]["statement"])
+        self.assertIn("cumulative", detail["stats"])
+
+        response = client.get(f"/profiles/{profile['id']}/download", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(response.data), 0)
+
+    def test_slow_trigger_and_rotation(self):
+        client = self.make_app(
+            PROFILE_ADMIN_KEY="secret", PROFILE_SLOW_MS=0.001, PROFILE_KEEP=2
+        )
+        for _ in range(3):
+            client.get("/users/1")
+        profiles = self.profiles(client)
+        self.assertEqual(len(profiles), 2)
+        self.assertEqual({p["trigger"] for p in profiles}, {"slow"})
+
+    def test_sampling(self):
+        client = self.make_app(PROFILE_ADMIN_KEY="secret", PROFILE_SAMPLE_RATE=1.0)
+        client.get("/users/1")
+        self.assertEqual(self.profiles(client)[0]["trigger"], "sampled")
+
+    def test_index_needs_admin_key(self):
+        client = self.make_app(PROFILE_SAMPLE_RATE=1.0)
+        self.assertEqual(client.get("/profiles").status_code, 403)
+        self.assertEqual(
+            client.get("/profiles/20200101T000000-0123abcd").status_code, 403
+        )
+
+    def test_unknown_profile(self):
+        client = self.make_app(PROFILE_ADMIN_KEY="secret")
+        headers = {"X-Profile": "secret"}
+        response = client.get("/profiles/20200101T000000-0123abcd", headers=headers)
+        self.assertEqual(response.status_code, 404)
+        response = client.get("/profiles/..%2Fconfig/download", headers=headers)
+        self.assertEqual(response.status_code, 404)
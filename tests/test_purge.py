@@ -0,0 +1,88 @@
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+from app import create_app, db
+from app.models import Follow, Tweet, TweetChange, User
+from app.purge import PurgeJob, purge_progress
+from tests.apis.helpers import SQLiteConfig
+
+
+class TestPurge(unittest.TestCase):
+    """A SQLite file, as the job's thread needs connections of its own"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        class PurgeConfig(SQLiteConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{self.directory}/purge.db"
+            USER_PURGE_CHUNK_SIZE = 2
+            USER_PURGE_PAUSE = 0
+
+        self.app = create_app(PurgeConfig)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        for name in ("prolific", "other"):
+            user = User(username=name, email=f"{name}@test.com")
+            for i in range(5):
+                user.tweets.append(Tweet(text=f"{name} {i}"))
+            db.session.add(user)
+        db.session.commit()
+        db.session.add(Follow(follower_id=2, followee_id=1))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.context.pop()
+        shutil.rmtree(self.directory)
+
+    def remaining(self):
+        return db.session.query(Tweet.user_id).distinct().all()
+
+    def test_job_deletes_in_chunks(self):
+        on_deleted, on_progress = Mock(), Mock()
+        PurgeJob(self.app, 1, on_deleted, on_progress).run()
+        progress = purge_progress(1)
+        self.assertEqual(progress["status"], "done")
+        self.assertEqual((progress["total"], progress["deleted"]), (5, 5))
+        self.assertEqual(progress["chunks"], 3)
+        # The initial count, every chunk, and done
+        self.assertEqual(on_progress.call_count, 5)
+        on_deleted.assert_called_once_with(1)
+        self.assertIsNone(db.session.get(User, 1))
+        self.assertEqual(self.remaining(), [(2,)])
+        self.assertEqual(db.session.query(Follow).count(), 0)
+        changes = db.session.query(TweetChange.tweet_id, TweetChange.action)
+        changes = changes.order_by(TweetChange.id).all()
+        self.assertEqual(sorted(changes[:-1]), [(i, "deleted") for i in range(1, 6)])
+        self.assertEqual(changes[-1], (None, "user_deleted"))
+
+    def test_background_purge(self):
+        self.client.get("/users/1")
+        response = self.client.delete("/users/1?purge=background")
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json["user_id"], 1)
+        self.assertTrue(response.headers["Location"].endswith("/users/1/purge"))
+        self.app.extensions["purges"][1].join()
+
+        progress = self.client.get("/users/1/purge").json
+        self.assertEqual(progress["status"], "done")
+        self.assertEqual(progress["deleted"], 5)
+        self.assertEqual(self.client.get("/users/1").status_code, 404)
+        self.assertEqual(self.remaining(), [(2,)])
+
+    def test_background_purge_checks_if_match(self):
+        response = self.client.delete(
+            "/users/1?purge=background", headers={"If-Match": '"1.7"'}
+        )
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(
+            self.client.delete("/users/9?purge=background").status_code, 404
+        )
+        self.assertNotIn("purges", self.app.extensions)
+
+    def test_no_purge(self):
+        self.assertEqual(self.client.get("/users/1/purge").status_code, 404)
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+from app import create_app, db
+from app.models import User
+from tests.apis.helpers import SQLiteConfig
+
+
+class TestReplicaRouting(unittest.TestCase):
+    """A primary and a replica in two SQLite files, told apart by their users"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        class ReplicaConfig(SQLiteConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{self.directory}/primary.db"
+            DATABASE_REPLICA_URLS = [f"sqlite:///{self.directory}/replica.db"]
+
+        self.app = create_app(ReplicaConfig)
+        self.client = self.app.test_client()
+        self.context = self.app.app_context()
+        self.context.push()
+        self.replica_engine = db.engines["replica0"]
+        db.create_all()
+        db.metadata.create_all(self.replica_engine)
+        db.session.add(User(username="on-primary", email="p@test.com"))
+        db.session.commit()
+        with self.replica_engine.begin() as connection:
+            connection.execute(
+                User.__table__.insert(),
+                {"username": "on-replica", "email": "r@test.com"},
+            )
+        self.replicas = self.app.extensions["replicas"]
+
+    def tearDown(self):
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+        self.context.pop()
+        shutil.rmtree(self.directory)
+
+    def usernames(self):
+        response = self.client.get("/users?fields=username")
+        self.assertEqual(response.status_code, 200)
+        return [user["username"] for user in response.json]
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(self.usernames(), ["on-replica"])
+        self.assertEqual(self.client.get("/users/1").json["username"], "on-replica")
+        stats = self.client.get("/db/replicas").json
+        self.assertEqual(stats["replicas"][0]["reads"], 2)
+        self.assertTrue(stats["replicas"][0]["healthy"])
+
+    def test_writes_go_to_the_primary(self):
+        response = self.client.post(
+            "/users", json={"username": "new", "email": "new@test.com"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            db.session.query(User.username).order_by(User.id).all(),
+            [("on-primary",), ("new",)],
+        )
+
+    def test_client_reads_its_writes(self):
+        self.client.post("/users", json={"username": "new", "email": "new@test.com"})
+        self.assertEqual(sorted(self.usernames()), ["new", "on-primary"])
+        # Other clients have no write to wait for
+        other = self.app.test_client()
+        self.assertEqual(other.get("/users/1").json["username"], "on-replica")
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        self.replicas.refresh()
+        self.replicas.replicas[0].lag = 60
+        self.assertEqual(self.usernames(), ["on-primary"])
+        self.assertEqual(self.replicas.stats()["fallbacks"], 1)
+
+    def test_replica_reads_are_not_cached(self):
+        self.assertEqual(self.client.get("/users/1").json["username"], "on-replica")
+        self.replicas.replicas[0].lag = 60
+        self.assertEqual(self.client.get("/users/1").json["username"], "on-primary")
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        self.replicas.replicas[0].engine = db.create_engine(
+            f"sqlite:///{self.directory}/missing/replica.db"
+        )
+        self.assertEqual(self.usernames(), ["on-primary"])
+        replica = self.replicas.stats()["replicas"][0]
+        self.assertFalse(replica["healthy"])
+        self.assertIn("unable to open database file", replica["error"])
+
+
+class TestWithoutReplicas(unittest.TestCase):
+    def test_everything_uses_the_primary(self):
+        app = create_app(SQLiteConfig)
+        self.assertEqual(app.config["SQLALCHEMY_BINDS"], {})
+        stats = app.test_client().get("/db/replicas").json
+        self.assertEqual(stats, {"replicas": [], "fallbacks": 0})
@@ -0,0 +1,61 @@
+import json
+import unittest
+from datetime import datetime
+from flask_restx import marshal
+from app import create_app
+from app.apis.tweets import model as tweet_model, page_model
+from app.apis.users import model as user_model
+from app.cache import dump_json
+from app.models import Tweet, User
+from app.serializers import serialize, serialized_response
+from tests.apis.helpers import SQLiteConfig
+
+
+def sample_tweets():
+    user = User(id=1, username="alice", email="alice@test.com", api_key="k")
+    return [
+        Tweet(
+            id=2,
+            text="héllo",
+            created_at=datetime(2020, 10, 8, 14, 35, 1, 5),
+            user=user,
+        ),
+        Tweet(id=1, text="first", created_at=None, user=None),
+        Tweet(id=None, text=None),
+    ]
+
+
+class TestSerializers(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(SQLiteConfig)
+
+    def assertSameJSON(self, data, model):
+        with self.app.app_context():
+            self.assertEqual(
+                dump_json(serialize(data, model)), dump_json(marshal(data, model))
+            )
+
+    def test_matches_marshal(self):
+        tweets = sample_tweets()
+        for tweet in tweets:
+            self.assertSameJSON(tweet, tweet_model)
+        self.assertSameJSON(tweets, tweet_model)
+        self.assertSameJSON({"tweets": tweets, "next_cursor": "abc"}, page_model)
+        self.assertSameJSON({"tweets": tweets}, page_model)
+        self.assertSameJSON({"tweets": None}, page_model)
+        self.assertSameJSON({"tweets": [None]}, page_model)
+        self.assertSameJSON([tweets[0].user, User(id=3)], user_model)
+
+    def test_mask_header_falls_back_to_marshal(self):
+        data = {"tweets": sample_tweets()[:1], "next_cursor": None}
+        headers = {"X-Fields": "tweets{id,text}"}
+        with self.app.test_request_context(headers=headers):
+            response = serialized_response(data, page_model)
+        self.assertEqual(response.json, {"tweets": [{"id": 2, "text": "héllo"}]})
+
+    def test_orjson_encoder(self):
+        self.app.config["JSON_ENCODER"] = "orjson"
+        data = {"tweets": sample_tweets(), "next_cursor": None}
+        with self.app.test_request_context():
+            body = serialized_response(data, page_model).get_data(as_text=True)
+        self.assertEqual(json.loads(body), marshal(data, page_model))
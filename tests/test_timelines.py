@@ -0,0 +1,55 @@
+import unittest
+from app.timelines import MemoryTimelineStore, RedisTimelineStore
+
+
+class FakeRedis:
+    """Local stand-in for the few redis-py commands RedisTimelineStore uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        pass
+
+    def lpush(self, key, value):
+        self.data.setdefault(key, []).insert(0, str(value).encode())
+
+    def ltrim(self, key, start, end):
+        self.data[key] = self.data[key][start : end + 1]
+
+    def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(str(v).encode() for v in values)
+
+    def lrange(self, key, start, end):
+        return self.data.get(key, [])[start : end + 1]
+
+    def sadd(self, key, member):
+        self.data.setdefault(key, set()).add(str(member).encode())
+
+    def smembers(self, key):
+        return self.data.get(key, set())
+
+
+class TestTimelineStores(unittest.TestCase):
+    def check_store(self, store):
+        for tweet_id in range(1, 5):
+            store.push([1, 2], tweet_id)
+        store.push([2], 5)
+        self.assertEqual(store.read(1, 10), [4, 3, 2])
+        self.assertEqual(store.read(2, 2), [5, 4])
+        self.assertIsNone(store.read(3, 10))
+        store.mark_celebrity(7)
+        self.assertEqual(store.celebrities(), {7})
+        # Pushed between the rebuild's query and the rebuild
+        store.push([3], 9)
+        store.rebuild(3, [8, 6, 4])
+        self.assertEqual(store.read(3, 10), [9, 8, 6])
+
+    def test_memory_store(self):
+        self.check_store(MemoryTimelineStore(max_length=3))
+
+    def test_redis_store(self):
+        self.check_store(RedisTimelineStore(FakeRedis(), max_length=3))